@@ -10,15 +10,14 @@ Algorithm:
 3. Convert to docx format.
 """
 
+import asyncio
 import boto3
 import json
 import os
 from dotenv import load_dotenv
 from typing import List, Dict
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from botocore.exceptions import ClientError
-import time
-from threading import Lock
+from aws_helpers import async_retrieval
+from aws_helpers.rate_limiter import get_limiter
 load_dotenv(override=True)
 
 # Initialize client
@@ -29,188 +28,34 @@ APPLICATION_FORM = os.getenv("APPLICATION_FORM", None)
 session = boto3.Session(aws_access_key_id=AWS_ACCESS_KEY,
                         aws_secret_access_key=AWS_SECRET_KEY,
                         region_name='us-east-1')
-bedrock_agent = session.client('bedrock-agent-runtime')
 s3_client = session.client("s3")
 
 # Configuration
 KB_ID = os.getenv('KNOWLEDGE_BASE_ID', None)
 NUM_RESULTS_PER_QUERY = 10
-MAX_WORKERS = 15  # Stay under 20 RPS limit
+MAX_IN_FLIGHT = 100  # Concurrent retrievals on the event loop; RETRIEVE_RPS paces the request rate
 
-# Thread-safe counter for progress tracking
-class ProgressTracker:
-    def __init__(self, total):
-        self.total = total
-        self.completed = 0
-        self.failed = 0
-        self.lock = Lock()
-    
-    def increment_completed(self):
-        with self.lock:
-            self.completed += 1
-            print(f"Progress: {self.completed}/{self.total} completed, {self.failed} failed")
-    
-    def increment_failed(self):
-        with self.lock:
-            self.failed += 1
-
-def retrieve_with_retry(question_text: str, user: str, max_retries: int = 3) -> Dict:
-    """
-    Retrieve from Knowledge Base with exponential backoff retry logic.
-    
-    Args:
-        question_text: The question to retrieve context for
-        max_retries: Maximum number of retry attempts
-        
-    Returns:
-        Dict containing retrieval results
-    """
-    for attempt in range(max_retries):
-        try:
-            response = bedrock_agent.retrieve(
-                knowledgeBaseId=KB_ID,
-                retrievalQuery={'text': question_text},
-                retrievalConfiguration={
-                    'vectorSearchConfiguration': {
-                        'numberOfResults': NUM_RESULTS_PER_QUERY,
-                        'filter': {
-                            'equals': {
-                                'key': 'username',
-                                'value': user
-                            }
-                        }
-                    }
-                }
-            )
-            return response
-            
-        except ClientError as e:
-            error_code = e.response['Error']['Code']
-            
-            if error_code == 'ThrottlingException' and attempt < max_retries - 1:
-                # Exponential backoff with jitter
-                wait_time = (2 ** attempt) + (0.1 * (attempt + 1))
-                print(f"Throttled. Waiting {wait_time:.2f}s before retry {attempt + 1}...")
-                time.sleep(wait_time)
-            else:
-                raise
-    
-    raise Exception(f"Max retries ({max_retries}) exceeded for question: {question_text}")
-
-def retrieve_context_for_question(question_item: Dict, progress: ProgressTracker, user: str) -> Dict:
-    """
-    Retrieve context for a single question with error handling.
-    
-    Args:
-        question_item: Dict with 'id' and 'question' keys
-        progress: Progress tracker for monitoring
-        
-    Returns:
-        Dict with question ID, text, context, and metadata
-    """
-    question_id = question_item['id']
-    question_text = question_item['question']
-    
-    try:
-        # Retrieve from Knowledge Base
-        response = retrieve_with_retry(question_text, user)
-        
-        # Extract context chunks
-        context_chunks = []
-        sources = []
-        
-        for result in response.get('retrievalResults', []):
-            content = result.get('content', {})
-            if content.get('text'):
-                context_chunks.append(content['text'])
-                
-                # Extract source information
-                location = result.get('location', {})
-                if location.get('s3Location'):
-                    sources.append({
-                        'uri': location['s3Location'].get('uri', ''),
-                        'score': result.get('score', 0)
-                    })
-        
-        # Combine all chunks
-        combined_context = '\n\n---\n\n'.join(context_chunks)
-        
-        progress.increment_completed()
-        
-        return {
-            'id': question_id,
-            'section': question_item['section'],
-            'question': question_text,
-            'context': combined_context,
-            'sources': sources,
-            'num_chunks': len(context_chunks),
-            'status': 'success'
-        }
-        
-    except Exception as e:
-        error_msg = str(e)
-        print(f"ERROR for question {question_id}: {error_msg}")
-        
-        progress.increment_failed()
-        
-        return {
-            'id': question_id,
-            'question': question_text,
-            'context': '',
-            'error': error_msg,
-            'status': 'failed'
-        }
-
-def retrieve_all_contexts_concurrent(questions: List[Dict], user: str, max_workers: int = 15) -> List[Dict]:
+async def retrieve_all_contexts_for_user(questions: List[Dict], user: str) -> List[Dict]:
     """
-    Retrieve contexts for all questions using concurrent threads.
+    Retrieve contexts for all questions of one user on a single event loop.
     
     Args:
-        questions: List of dicts with 'id' and 'question' keys
-        max_workers: Maximum number of concurrent threads (default 15 to stay under 20 RPS)
+        questions: List of dicts with 'id', 'section' and 'question' keys
+        user: Username stored in the document metadata
         
     Returns:
-        List of enriched question dicts with retrieved context
+        List of enriched question dicts with retrieved context, sorted by id
     """
-    print(f"\n{'='*60}")
-    print(f"Starting concurrent retrieval for {len(questions)} questions")
-    print(f"Max workers: {max_workers}")
-    print(f"Rate limit: 20 requests/second")
-    print(f"{'='*60}\n")
-    
-    start_time = time.time()
-    progress = ProgressTracker(len(questions))
-    enriched_questions = []
-    
-    # Use ThreadPoolExecutor for concurrent API calls
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        future_to_question = {
-            executor.submit(retrieve_context_for_question, q, progress, user): q 
-            for q in questions
-        }
-        
-        # Collect results as they complete
-        for future in as_completed(future_to_question):
-            result = future.result()
-            enriched_questions.append(result)
-    
-    # Sort by original question ID to maintain order
-    enriched_questions.sort(key=lambda x: x['id'])
-    
-    elapsed_time = time.time() - start_time
-    
-    # Print summary
-    print(f"\n{'='*60}")
-    print(f"Retrieval Complete!")
-    print(f"Total questions: {len(questions)}")
-    print(f"Successful: {progress.completed}")
-    print(f"Failed: {progress.failed}")
-    print(f"Time elapsed: {elapsed_time:.2f} seconds")
-    print(f"Average time per question: {elapsed_time/len(questions):.2f} seconds")
-    print(f"{'='*60}\n")
-    
-    return enriched_questions
+    async with async_retrieval.open_retrieve_client(region_name='us-east-1',
+                                                    aws_access_key_id=AWS_ACCESS_KEY,
+                                                    aws_secret_access_key=AWS_SECRET_KEY) as retrieve:
+        return await async_retrieval.retrieve_all_contexts_async(questions,
+                                                                 user=user,
+                                                                 kb_id=KB_ID,
+                                                                 retrieve=retrieve,
+                                                                 number_of_results=NUM_RESULTS_PER_QUERY,
+                                                                 max_in_flight=MAX_IN_FLIGHT,
+                                                                 limiter=get_limiter('retrieve'))
 
 # Example Usage
 if __name__ == "__main__":
@@ -228,11 +73,10 @@ if __name__ == "__main__":
     # ]
     
     # Retrieve contexts concurrently
-    enriched_questions = retrieve_all_contexts_concurrent(
+    enriched_questions = asyncio.run(retrieve_all_contexts_for_user(
         can_export_questions["questions"], 
-        max_workers=MAX_WORKERS,  # Adjust based on your needs,
         user = user
-    )
+    ))
     
     # Save results locally
     with open('enriched_questions.json', 'w') as f:
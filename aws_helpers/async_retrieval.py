@@ -0,0 +1,344 @@
+"""
+Asyncio retrieval engine for Bedrock knowledge base lookups.
+
+Replaces the ThreadPoolExecutor fan-out in retrieve_all_contexts_concurrent. Every
+question becomes a coroutine on a single event loop, so a form with hundreds of
+questions keeps hundreds of retrievals in flight without a thread per request. The
+input and output contract is unchanged: a list of question dicts in, enriched
+question dicts sorted by id out.
+
+Pacing against the service quota is delegated to an optional limiter with the
+interface of aws_helpers.rate_limiter.AdaptiveRateLimiter (call_async); without one,
+throttled calls fall back to exponential back-off.
+
+The engine talks to any async callable with the signature of
+bedrock-agent-runtime's retrieve (keyword arguments in, response dict out), such
+as the one open_retrieve_client() yields for the real service.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional
+)
+
+RetrieveFn = Callable[..., Awaitable[Dict]]
+
+def _error_code(error: Exception) -> str:
+    """
+    Pull the AWS error code out of a botocore ClientError (or anything shaped like one).
+    """
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code', '')
+
+def build_retrieve_request(kb_id: str,
+                           question_text: str,
+                           user: str,
+                           year: Optional[int] = None,
+                           number_of_results: int = 5) -> Dict:
+    """
+    Build the keyword arguments for bedrock-agent-runtime retrieve, filtered to a
+    single tenant (username, and year when given).
+
+    Parameters:
+        kb_id (str): Knowledge base ID.
+        question_text (str): The question to retrieve context for.
+        user (str): Username stored in the document metadata.
+        year (Optional[int]): Year stored in the document metadata.
+        number_of_results (int): Number of chunks to retrieve.
+
+    Returns:
+        Dict of keyword arguments for retrieve.
+    """
+    if year is None:
+        retrieval_filter = {'equals': {'key': 'username', 'value': user}}
+    else:
+        retrieval_filter = {
+            'andAll': [
+                {'equals': {'key': 'username', 'value': user}},
+                {'equals': {'key': 'year', 'value': year}}
+            ]
+        }
+
+    return {
+        'knowledgeBaseId': kb_id,
+        'retrievalQuery': {'text': question_text},
+        'retrievalConfiguration': {
+            'vectorSearchConfiguration': {
+                'numberOfResults': number_of_results,
+                'filter': retrieval_filter
+            }
+        }
+    }
+
+def parse_retrieval_response(question_item: Dict, response: Dict) -> Dict:
+    """
+    Turn a retrieve response into an enriched question dict.
+
+    Parameters:
+        question_item (Dict): Dict with 'id', 'section' and 'question' keys.
+        response (Dict): Response from retrieve.
+
+    Returns:
+        Dict with question ID, section, text, context, sources, per-chunk details and chunk count.
+    """
+    context_chunks = []
+    sources = []
+    chunks = []
+
+    for result in response.get('retrievalResults', []):
+        content = result.get('content', {})
+        if content.get('text'):
+            context_chunks.append(content['text'])
+
+            # Extract source information
+            location = result.get('location', {})
+            uri = ''
+            if location.get('s3Location'):
+                uri = location['s3Location'].get('uri', '')
+                sources.append({
+                    'uri': uri,
+                    'score': result.get('score', 0)
+                })
+            chunks.append({
+                'text': content['text'],
+                'uri': uri,
+                'score': result.get('score', 0)
+            })
+
+    return {
+        'id': question_item['id'],
+        'section': question_item.get('section'),
+        'question': question_item['question'],
+        'context': '\n\n---\n\n'.join(context_chunks),
+        'sources': sources,
+        'chunks': chunks,
+        'num_chunks': len(context_chunks),
+        'status': 'success'
+    }
+
+class AsyncRetrievalEngine:
+    def __init__(self,
+                 retrieve: RetrieveFn,
+                 kb_id: str,
+                 number_of_results: int = 5,
+                 max_in_flight: int = 100,
+                 max_retries: int = 3,
+                 limiter: Optional[Any] = None,
+                 on_progress: Optional[Callable[[int, int], Any]] = None):
+        """
+        Runs knowledge base retrievals for many questions concurrently on one event loop.
+
+        Parameters:
+            retrieve (RetrieveFn): Async callable with the signature of bedrock-agent-runtime retrieve.
+            kb_id (str): Knowledge base ID.
+            number_of_results (int): Number of chunks to retrieve per question.
+            max_in_flight (int): Upper bound on concurrent retrieve calls. The service quota,
+                                 not this number, is the real ceiling; throttled calls back off.
+            max_retries (int): Attempts per question before it is marked as failed.
+            limiter (Optional[Any]): Shared rate limiter for retrieve, e.g. get_limiter('retrieve').
+            on_progress (Optional[Callable[[int, int], Any]]): Called with (questions done, total)
+                                                               after every question.
+        """
+        self.retrieve = retrieve
+        self.kb_id = kb_id
+        self.number_of_results = number_of_results
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.limiter = limiter
+        self.on_progress = on_progress
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+
+    async def _retrieve_with_retry(self, question_text: str, user: str, year: Optional[int]) -> Dict:
+        request = build_retrieve_request(self.kb_id, question_text, user, year, self.number_of_results)
+        if self.limiter is not None:
+            return await self.limiter.call_async(self.retrieve, max_retries=self.max_retries, **request)
+
+        for attempt in range(self.max_retries):
+            try:
+                return await self.retrieve(**request)
+            except Exception as e:
+                if _error_code(e) == 'ThrottlingException' and attempt < self.max_retries - 1:
+                    wait_time = (2 ** attempt) + (0.1 * (attempt + 1))
+                    print(f"Throttled. Waiting {wait_time:.2f}s before retry {attempt + 1}...")
+                    await asyncio.sleep(wait_time)
+                else:
+                    raise
+
+        raise Exception(f"Max retries ({self.max_retries}) exceeded for question: {question_text}")
+
+    def _report_progress(self) -> None:
+        if self.on_progress is not None:
+            try:
+                self.on_progress(self.completed + self.failed, self.total)
+            except Exception as e:
+                print(f"Warning: progress callback failed: {str(e)}")
+
+    async def retrieve_one(self, question_item: Dict, user: str, year: Optional[int], semaphore: asyncio.Semaphore) -> Dict:
+        """
+        Retrieve context for a single question. Errors are captured in the returned dict
+        so one bad question never cancels the rest.
+        """
+        async with semaphore:
+            try:
+                response = await self._retrieve_with_retry(question_item['question'], user, year)
+                result = parse_retrieval_response(question_item, response)
+                self.completed += 1
+                self._report_progress()
+                return result
+            except Exception as e:
+                error_msg = str(e)
+                print(f"ERROR for question {question_item['id']}: {error_msg}")
+                self.failed += 1
+                self._report_progress()
+                return {
+                    'id': question_item['id'],
+                    'section': question_item.get('section'),
+                    'question': question_item['question'],
+                    'context': '',
+                    'error': error_msg,
+                    'status': 'failed'
+                }
+
+    async def retrieve_all(self, questions: List[Dict], user: str, year: Optional[int] = None) -> List[Dict]:
+        """
+        Retrieve contexts for all questions.
+
+        Parameters:
+            questions (List[Dict]): Dicts with 'id', 'section' and 'question' keys.
+            user (str): Username to filter on.
+            year (Optional[int]): Year to filter on.
+
+        Returns:
+            List of enriched question dicts sorted by id.
+        """
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        self.total = len(questions)
+        enriched_questions = await asyncio.gather(
+            *(self.retrieve_one(q, user, year, semaphore) for q in questions)
+        )
+        return sorted(enriched_questions, key=lambda x: x['id'])
+
+@asynccontextmanager
+async def open_retrieve_client(region_name: Optional[str] = None,
+                               max_pool_connections: int = 100,
+                               **client_kwargs: Any) -> AsyncIterator[RetrieveFn]:
+    """
+    Yield an async retrieve callable for bedrock-agent-runtime.
+
+    Uses aiobotocore when it is installed so requests are multiplexed on the event
+    loop. Otherwise falls back to a boto3 client whose blocking calls run on the
+    default executor, which keeps the same interface at the cost of threads.
+
+    The connection pool is sized to max_pool_connections (pass max_in_flight); the
+    botocore default of 10 would otherwise cap the concurrent retrieves at 10.
+    """
+    try:
+        from aiobotocore.config import AioConfig
+        from aiobotocore.session import get_session
+    except ImportError:
+        import boto3
+        from botocore.config import Config
+        client = boto3.client('bedrock-agent-runtime', region_name=region_name,
+                              config=Config(max_pool_connections=max_pool_connections), **client_kwargs)
+
+        async def retrieve(**kwargs):
+            return await asyncio.to_thread(client.retrieve, **kwargs)
+
+        yield retrieve
+        return
+
+    session = get_session()
+    async with session.create_client('bedrock-agent-runtime', region_name=region_name,
+                                     config=AioConfig(max_pool_connections=max_pool_connections),
+                                     **client_kwargs) as client:
+        yield client.retrieve
+
+async def retrieve_all_contexts_async(questions: List[Dict],
+                                      user: str,
+                                      kb_id: str,
+                                      year: Optional[int] = None,
+                                      retrieve: Optional[RetrieveFn] = None,
+                                      number_of_results: int = 5,
+                                      max_in_flight: int = 100,
+                                      region_name: Optional[str] = None,
+                                      limiter: Optional[Any] = None,
+                                      on_progress: Optional[Callable[[int, int], Any]] = None) -> List[Dict]:
+    """
+    Coroutine version of retrieve_all_contexts. Pass retrieve to use an existing
+    client or a fake endpoint; otherwise a client is opened for the duration of the call.
+    """
+    print(f"\n{'='*60}")
+    print(f"Starting async retrieval for {len(questions)} questions")
+    print(f"Max in flight: {max_in_flight}")
+    if limiter is not None:
+        print(f"Rate limit: {limiter.max_rate:g} requests/second")
+    print(f"{'='*60}\n")
+
+    start_time = time.time()
+
+    if retrieve is None:
+        async with open_retrieve_client(region_name=region_name, max_pool_connections=max_in_flight) as client_retrieve:
+            engine = AsyncRetrievalEngine(client_retrieve, kb_id, number_of_results, max_in_flight,
+                                          limiter=limiter, on_progress=on_progress)
+            enriched_questions = await engine.retrieve_all(questions, user, year)
+    else:
+        engine = AsyncRetrievalEngine(retrieve, kb_id, number_of_results, max_in_flight,
+                                      limiter=limiter, on_progress=on_progress)
+        enriched_questions = await engine.retrieve_all(questions, user, year)
+
+    elapsed_time = time.time() - start_time
+
+    # Print summary
+    print(f"\n{'='*60}")
+    print(f"Retrieval Complete!")
+    print(f"Total questions: {len(questions)}")
+    print(f"Successful: {engine.completed}")
+    print(f"Failed: {engine.failed}")
+    print(f"Time elapsed: {elapsed_time:.2f} seconds")
+    if questions:
+        print(f"Average time per question: {elapsed_time/len(questions):.2f} seconds")
+    print(f"{'='*60}\n")
+
+    return enriched_questions
+
+def retrieve_all_contexts(questions: List[Dict],
+                          user: str,
+                          kb_id: str,
+                          year: Optional[int] = None,
+                          retrieve: Optional[RetrieveFn] = None,
+                          number_of_results: int = 5,
+                          max_in_flight: int = 100,
+                          region_name: Optional[str] = None,
+                          limiter: Optional[Any] = None,
+                          on_progress: Optional[Callable[[int, int], Any]] = None) -> List[Dict]:
+    """
+    Synchronous entry point for callers that are not already inside an event loop,
+    such as a Lambda handler or a script.
+
+    Parameters:
+        questions (List[Dict]): Dicts with 'id', 'section' and 'question' keys.
+        user (str): Username to filter on.
+        kb_id (str): Knowledge base ID.
+        year (Optional[int]): Year to filter on. Omitted from the filter when None.
+        retrieve (Optional[RetrieveFn]): Async retrieve callable. Defaults to a real client.
+        number_of_results (int): Number of chunks per question.
+        max_in_flight (int): Upper bound on concurrent retrieve calls.
+        region_name (Optional[str]): Region for the default client.
+        limiter (Optional[Any]): Shared rate limiter for retrieve.
+        on_progress (Optional[Callable[[int, int], Any]]): Called with (questions done, total).
+
+    Returns:
+        List of enriched question dicts sorted by id.
+    """
+    return asyncio.run(retrieve_all_contexts_async(questions, user, kb_id, year, retrieve,
+                                                   number_of_results, max_in_flight, region_name, limiter,
+                                                   on_progress))
@@ -0,0 +1,129 @@
+"""
+Streaming parser for Bedrock batch inference output.
+
+A batch job writes one JSON record per line to {input}.jsonl.out:
+
+    {"recordId": "12", "modelInput": {...}, "modelOutput": {"content": [{"text": ...}], "usage": {...}}}
+
+recordId is the id of an enriched question, or contains PADDING for the filler
+records added to reach the job's minimum record count. The parser reads the output
+line by line (a StreamingBody's iter_lines() or an open file), looks every record's
+question up in a dict built once from enriched_questions, and spools the answers
+to one temporary file per section. Memory therefore stays flat however large the
+output is, and the completed form is written section by section at the end:
+
+    {section}
+    Question: ...
+    Answer: ...
+
+    {next section}
+    ...
+"""
+import json
+import shutil
+import tempfile
+from typing import (
+    Any,
+    Dict,
+    IO,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union
+)
+from .prompt_cache import PromptCacheStats
+
+def index_questions(enriched_questions: List[Dict]) -> Dict[int, Dict]:
+    """
+    Enriched questions by id, so each record is matched in O(1).
+    """
+    return {int(question['id']): question for question in enriched_questions}
+
+class SectionSpool:
+    """
+    Lines grouped by section in temporary files, one per section, in the order the
+    sections were first seen.
+    """
+    def __init__(self):
+        self.directory = tempfile.TemporaryDirectory(prefix='batch-output-')
+        self.files: Dict[Any, IO[str]] = {}
+
+    def add(self, section: Any, lines: List[str]) -> None:
+        spool = self.files.get(section)
+        if spool is None:
+            spool = open(f"{self.directory.name}/{len(self.files)}.txt", 'w+', encoding='utf-8')
+            self.files[section] = spool
+        spool.write('\n'.join(lines) + '\n')
+
+    def write_to(self, output: IO[str]) -> None:
+        for section, spool in self.files.items():
+            output.write(f"{section}\n")
+            spool.seek(0)
+            shutil.copyfileobj(spool, output)
+            output.write('\n')
+
+    def close(self) -> None:
+        for spool in self.files.values():
+            spool.close()
+        self.files = {}
+        self.directory.cleanup()
+
+    def __enter__(self) -> 'SectionSpool':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+class BatchOutputParser:
+    def __init__(self, enriched_questions: List[Dict], cache_stats: Optional[PromptCacheStats] = None):
+        """
+        Parameters:
+            enriched_questions (List[Dict]): Questions of the batch, with id, section and question.
+            cache_stats (PromptCacheStats): Collects the prompt cache usage of every record.
+        """
+        self.questions = index_questions(enriched_questions)
+        self.cache_stats = cache_stats or PromptCacheStats()
+        self.counts = {'processed': 0, 'success': 0, 'failed': 0, 'padding': 0}
+
+    def iter_answers(self, lines: Iterable[Union[bytes, str]]) -> Iterator[Tuple[Any, Optional[str], str]]:
+        """
+        Generator of (section, question, answer) for every answered record in lines.
+        Records that cannot be parsed are logged and counted as failed.
+        """
+        for line in lines:
+            if not line.strip():
+                continue
+            self.counts['processed'] += 1
+            record_id = None
+            try:
+                record = json.loads(line)
+                record_id = record['recordId']
+                if 'PADDING' in record_id:
+                    self.counts['padding'] += 1
+                    continue
+                output = record['modelOutput']
+                text = output['content'][0]['text']
+                self.cache_stats.record(output.get('usage'))
+                question = self.questions.get(int(record_id), {})
+            except Exception as e:
+                print(f"\x1b[31mJSON extraction failed for {record_id}\x1b[0m")
+                print(f"\x1b[31m{e}\x1b[0m")
+                self.counts['failed'] += 1
+                continue
+            self.counts['success'] += 1
+            yield question.get('section'), question.get('question'), text
+
+    def write_completed_form(self, lines: Iterable[Union[bytes, str]], output: IO[str]) -> Dict[str, int]:
+        """
+        Group the answers in lines by section and write the completed form to output.
+
+        Returns:
+            counts (Dict[str, int]): Records processed, answered, failed and padding.
+        """
+        with SectionSpool() as spool:
+            for section, question, answer in self.iter_answers(lines):
+                spool.add(section, [f"Question: {question}", f"Answer: {answer}"])
+            spool.write_to(output)
+        return self.counts
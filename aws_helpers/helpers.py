@@ -3,6 +3,7 @@ from typing import (
     Optional, 
     Dict, 
     Any, 
+    Iterator,
     List, 
     Tuple)
 import logging
@@ -12,6 +13,7 @@ import json
 import traceback
 from functools import wraps
 import time
+from .rate_limiter import get_limiter
 from dotenv import load_dotenv
 load_dotenv(override=True)
 
@@ -142,9 +144,11 @@ def _count_tokens(model_id: str, content: str, claude: bool = True) -> int:
 
     bedrock_runtime = session.client("bedrock-runtime", region_name="us-east-1")
 
+    limiter = get_limiter('count_tokens')
+
     # Your text/context that you want to count tokens for
     if claude == False:
-        response = bedrock_runtime.count_tokens(
+        response = limiter.call(bedrock_runtime.count_tokens,
             modelId=model_id,  # Claude 3.5 Sonnet v2
             input={
                 "invokeModel": {
@@ -164,7 +168,7 @@ def _count_tokens(model_id: str, content: str, claude: bool = True) -> int:
             ]
         })
 
-        response = bedrock_runtime.count_tokens(
+        response = limiter.call(bedrock_runtime.count_tokens,
             modelId=model_id,  # Claude 3.5 Sonnet v2
             input={
                 "invokeModel": {
@@ -343,6 +347,29 @@ def list_obj_s3(s3_client: Any,
 
     return obj_list
 
+def iter_obj_s3(s3_client: Any,
+                bucket_name: str,
+                folder_name: str,
+                suffix: str = '') -> Iterator[Dict]:
+    """
+    Generator over the objects under a prefix, one paginated listing at a time, so
+    callers can start working on the first page before the last one is listed.
+
+    Parameters:
+        s3_client (Any): S3 client object
+        bucket_name (str): Name of S3 bucket where concerned objects are present.
+        folder_name (str): Prefix of the objects.
+        suffix (str): Only yield keys ending with suffix, e.g. '.md'.
+
+    Returns:
+        Iterator of listing entries (Key, ETag, Size, LastModified).
+    """
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=folder_name):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith(suffix):
+                yield obj
+
 def create_sns_topic(sns_client: Any) -> str:
     """
     Function to create a SNS topic. Can be generalized to create any SNS topic, 
@@ -0,0 +1,625 @@
+"""
+In-process markdown to docx writer.
+
+pypandoc.convert_text starts a pandoc process for every document and needs the
+~150 MB pandoc binary in the image. The completed forms only use a small markdown
+subset, which this module writes straight into a docx package in memory with the
+standard library (zipfile + WordprocessingML):
+
+    - ATX and setext headings
+    - paragraphs with soft and hard line breaks
+    - bullet and numbered lists, nested by indentation
+    - **bold**, *italic*, ***both***, ~~strike~~, `code` and [links](url)
+    - GFM pipe tables with a header row and column alignment
+    - block quotes, fenced code blocks and horizontal rules
+
+Anything outside the subset (images, raw HTML, footnotes) raises
+UnsupportedMarkdown. convert_markdown() then falls back to pandoc, so a document
+is never lost because of the native writer.
+
+parse_markdown() returns the parsed document as a list of Blocks, so other
+renderers can reuse one parse; blocks_to_docx() writes them as a docx.
+"""
+import io
+import os
+import re
+import tempfile
+import zipfile
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple
+)
+from xml.sax.saxutils import escape
+
+DOCX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+W_NAMESPACES = ('xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+                'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"')
+RELATIONSHIP_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+class UnsupportedMarkdown(ValueError):
+    """
+    The document uses markdown the native writer does not handle.
+    """
+
+FENCE_PATTERN = re.compile(r'^\s{0,3}(```+|~~~+)\s*([\w+-]*)\s*$')
+ATX_HEADING_PATTERN = re.compile(r'^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$')
+RULE_PATTERN = re.compile(r'^\s{0,3}((\*\s*){3,}|(-\s*){3,}|(_\s*){3,})$')
+SETEXT_PATTERN = re.compile(r'^\s{0,3}(=+|-+)\s*$')
+LIST_ITEM_PATTERN = re.compile(r'^(\s*)([-*+]|(\d{1,9})[.)])\s+(.*)$')
+TABLE_SEPARATOR_PATTERN = re.compile(r'^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$')
+QUOTE_PATTERN = re.compile(r'^\s{0,3}>\s?(.*)$')
+HTML_BLOCK_PATTERN = re.compile(r'^\s{0,3}<(?!br\s*/?>)[A-Za-z!/]')
+FOOTNOTE_PATTERN = re.compile(r'\[\^[^\]]+\]')
+INVALID_XML_PATTERN = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+INLINE_PATTERN = re.compile(
+    r'\\(?P<escaped>[\\`*_{}\[\]()#+\-.!|>~<])'
+    r'|(?P<ticks>`+)(?P<code>.+?)(?P=ticks)'
+    r'|(?P<image>!\[)'
+    r'|\[(?P<link_text>[^\]]+)\]\((?P<link_url>[^)\s]+)(?:\s+"[^"]*")?\)'
+    r'|<(?P<autolink>https?://[^>\s]+)>'
+    r'|(?P<br><br\s*/?>)'
+    r'|(?P<html></?[A-Za-z][^>]*>)'
+    r'|\*\*\*(?P<strong_em>[^\s*](?:.*?[^\s*])?)\*\*\*'
+    r'|\*\*(?P<strong>[^\s*](?:.*?[^\s])?)\*\*'
+    r'|(?<![A-Za-z0-9_])__(?P<strong_u>[^\s_](?:.*?[^\s_])?)__(?![A-Za-z0-9_])'
+    r'|\*(?P<em>[^\s*](?:[^*]*?[^\s*])?)\*'
+    r'|(?<![A-Za-z0-9_])_(?P<em_u>[^\s_](?:[^_]*?[^\s_])?)_(?![A-Za-z0-9_])'
+    r'|~~(?P<strike>.+?)~~',
+    re.S)
+
+HEADING_SIZES = (32, 28, 26, 24, 22, 22)
+BULLETS = ('•', '◦', '▪')
+
+def _xml_text(text: str) -> str:
+    return escape(INVALID_XML_PATTERN.sub('', text))
+
+class _Run:
+    __slots__ = ('text', 'bold', 'italic', 'strike', 'code', 'link')
+
+    def __init__(self, text: str, bold: bool = False, italic: bool = False,
+                 strike: bool = False, code: bool = False, link: Optional[str] = None):
+        self.text = text
+        self.bold = bold
+        self.italic = italic
+        self.strike = strike
+        self.code = code
+        self.link = link
+
+def parse_inline(text: str, bold: bool = False, italic: bool = False,
+                 strike: bool = False, link: Optional[str] = None) -> List[_Run]:
+    """
+    Split inline markdown into formatted runs. Line breaks in text are kept as
+    '\\n' and become hard breaks.
+    """
+    runs: List[_Run] = []
+    position = 0
+
+    def plain(segment: str) -> None:
+        if segment:
+            runs.append(_Run(segment, bold, italic, strike, False, link))
+
+    for match in INLINE_PATTERN.finditer(text):
+        plain(text[position:match.start()])
+        position = match.end()
+        group = match.lastgroup
+        if group == 'escaped':
+            plain(match.group('escaped'))
+        elif group == 'code':
+            runs.append(_Run(match.group('code').strip(), bold, italic, strike, True, link))
+        elif group == 'image':
+            raise UnsupportedMarkdown('image')
+        elif group == 'link_url':
+            runs.extend(parse_inline(match.group('link_text'), bold, italic, strike, match.group('link_url')))
+        elif group == 'autolink':
+            runs.append(_Run(match.group('autolink'), bold, italic, strike, False, match.group('autolink')))
+        elif group == 'br':
+            plain('\n')
+        elif group == 'html':
+            raise UnsupportedMarkdown(f'inline HTML {match.group("html")}')
+        elif group == 'strong_em':
+            runs.extend(parse_inline(match.group(group), True, True, strike, link))
+        elif group in ('strong', 'strong_u'):
+            runs.extend(parse_inline(match.group(group), True, italic, strike, link))
+        elif group in ('em', 'em_u'):
+            runs.extend(parse_inline(match.group(group), bold, True, strike, link))
+        elif group == 'strike':
+            runs.extend(parse_inline(match.group(group), bold, italic, True, link))
+    plain(text[position:])
+    return runs
+
+class Block:
+    """
+    One block of a parsed markdown document. Which fields are set depends on kind:
+
+        heading    level, runs
+        paragraph  runs, style (None or 'Quote')
+        code       lines
+        rule       -
+        list       items: (level, ordered, start number, runs)
+        table      header (runs per cell), alignments, rows (runs per cell)
+    """
+    __slots__ = ('kind', 'level', 'runs', 'style', 'lines', 'items', 'header', 'alignments', 'rows')
+
+    def __init__(self, kind: str, **fields):
+        self.kind = kind
+        for name in self.__slots__[1:]:
+            setattr(self, name, fields.get(name))
+
+def _join_lines(lines: List[str]) -> str:
+    """
+    Join the source lines of a paragraph: soft breaks become spaces, lines ending in
+    two spaces or a backslash become hard breaks.
+    """
+    parts = []
+    for index, line in enumerate(lines):
+        last = index == len(lines) - 1
+        if not last and (line.endswith('  ') or line.endswith('\\')):
+            parts.append(line.rstrip().rstrip('\\').strip() + '\n')
+        else:
+            parts.append(line.strip() + ('' if last else ' '))
+    return ''.join(parts)
+
+def _split_row(line: str) -> List[str]:
+    line = line.strip()
+    if line.startswith('|'):
+        line = line[1:]
+    if line.endswith('|') and not line.endswith('\\|'):
+        line = line[:-1]
+    return [cell.strip().replace('\\|', '|') for cell in re.split(r'(?<!\\)\|', line)]
+
+class _DocumentBuilder:
+    def __init__(self):
+        self.body: List[str] = []
+        self.hyperlinks: Dict[str, str] = {}
+        self.lists: List[List[Tuple[str, int]]] = []
+
+    # Runs and paragraphs --------------------------------------------------
+    def _link_id(self, url: str) -> str:
+        if url not in self.hyperlinks:
+            self.hyperlinks[url] = f"rIdLink{len(self.hyperlinks) + 1}"
+        return self.hyperlinks[url]
+
+    def _run_xml(self, run: _Run, extra_bold: bool = False) -> str:
+        properties = []
+        if run.link:
+            properties.append('<w:rStyle w:val="Hyperlink"/>')
+        elif run.code:
+            properties.append('<w:rStyle w:val="VerbatimChar"/>')
+        if run.bold or extra_bold:
+            properties.append('<w:b/><w:bCs/>')
+        if run.italic:
+            properties.append('<w:i/><w:iCs/>')
+        if run.strike:
+            properties.append('<w:strike/>')
+        rpr = f"<w:rPr>{''.join(properties)}</w:rPr>" if properties else ''
+        pieces = []
+        for index, line in enumerate(run.text.split('\n')):
+            if index:
+                pieces.append('<w:br/>')
+            if line:
+                pieces.append(f'<w:t xml:space="preserve">{_xml_text(line)}</w:t>')
+        return f"<w:r>{rpr}{''.join(pieces)}</w:r>"
+
+    def _runs_xml(self, runs: List[_Run], bold: bool = False) -> str:
+        xml = []
+        index = 0
+        while index < len(runs):
+            run = runs[index]
+            if run.link:
+                # Consecutive runs of one link share a hyperlink element.
+                group = [run]
+                while index + 1 < len(runs) and runs[index + 1].link == run.link:
+                    index += 1
+                    group.append(runs[index])
+                inner = ''.join(self._run_xml(item, bold) for item in group)
+                xml.append(f'<w:hyperlink r:id="{self._link_id(run.link)}" w:history="1">{inner}</w:hyperlink>')
+            else:
+                xml.append(self._run_xml(run, bold))
+            index += 1
+        return ''.join(xml)
+
+    def paragraph(self, runs: List[_Run], style: Optional[str] = None, numbering: Optional[Tuple[int, int]] = None,
+                  extra_properties: str = '') -> None:
+        properties = ''
+        if style:
+            properties += f'<w:pStyle w:val="{style}"/>'
+        if numbering:
+            properties += f'<w:numPr><w:ilvl w:val="{numbering[1]}"/><w:numId w:val="{numbering[0]}"/></w:numPr>'
+        properties += extra_properties
+        ppr = f'<w:pPr>{properties}</w:pPr>' if properties else ''
+        self.body.append(f'<w:p>{ppr}{self._runs_xml(runs)}</w:p>')
+
+    def heading(self, level: int, runs: List[_Run]) -> None:
+        self.paragraph(runs, style=f'Heading{level}')
+
+    def rule(self) -> None:
+        self.body.append('<w:p><w:pPr><w:pBdr><w:bottom w:val="single" w:sz="6" w:space="1" w:color="auto"/>'
+                         '</w:pBdr></w:pPr></w:p>')
+
+    def code_block(self, lines: List[str]) -> None:
+        for line in lines or ['']:
+            text = f'<w:r><w:t xml:space="preserve">{_xml_text(line)}</w:t></w:r>' if line else ''
+            self.body.append(f'<w:p><w:pPr><w:pStyle w:val="SourceCode"/></w:pPr>{text}</w:p>')
+
+    # Lists ----------------------------------------------------------------
+    def list_block(self, items: List[Tuple[int, bool, int, List[_Run]]]) -> None:
+        """
+        items: (level, ordered, start number, runs). Every list block gets its own
+        numbering definition; a level's format comes from its first item.
+        """
+        levels: Dict[int, Tuple[str, int]] = {}
+        for level, ordered, start, _ in items:
+            levels.setdefault(level, ('decimal' if ordered else 'bullet', start))
+        definition = [levels.get(level, ('bullet', 1)) for level in range(9)]
+        self.lists.append(definition)
+        num_id = len(self.lists)
+        for level, _, _, runs in items:
+            self.paragraph(runs, style='ListParagraph', numbering=(num_id, level))
+
+    # Tables ---------------------------------------------------------------
+    def table(self, header: List[List[_Run]], alignments: List[str], rows: List[List[List[_Run]]]) -> None:
+        columns = max([len(header)] + [len(row) for row in rows])
+        width = 9360 // max(columns, 1)
+        xml = ['<w:tbl><w:tblPr><w:tblStyle w:val="TableGrid"/><w:tblW w:w="5000" w:type="pct"/>'
+               '<w:tblLook w:val="04A0" w:firstRow="1" w:lastRow="0" w:firstColumn="0" w:lastColumn="0" '
+               'w:noHBand="0" w:noVBand="1"/></w:tblPr><w:tblGrid>']
+        xml.extend(f'<w:gridCol w:w="{width}"/>' for _ in range(columns))
+        xml.append('</w:tblGrid>')
+        for row_index, row in enumerate([header] + rows):
+            is_header = row_index == 0
+            xml.append('<w:tr><w:trPr><w:tblHeader/></w:trPr>' if is_header else '<w:tr>')
+            for column in range(columns):
+                cell = row[column] if column < len(row) else []
+                alignment = alignments[column] if column < len(alignments) else ''
+                jc = f'<w:jc w:val="{alignment}"/>' if alignment else ''
+                ppr = f'<w:pPr><w:spacing w:after="0"/>{jc}</w:pPr>'
+                xml.append(f'<w:tc><w:tcPr><w:tcW w:w="{width}" w:type="dxa"/></w:tcPr>'
+                           f'<w:p>{ppr}{self._runs_xml(cell, bold=is_header)}</w:p></w:tc>')
+            xml.append('</w:tr>')
+        xml.append('</w:tbl>')
+        self.body.append(''.join(xml))
+        # Keeps two consecutive tables apart and the document from ending in a table.
+        self.body.append('<w:p/>')
+
+    def add(self, block: Block) -> None:
+        if block.kind == 'heading':
+            self.heading(block.level, block.runs)
+        elif block.kind == 'paragraph':
+            self.paragraph(block.runs, style=block.style)
+        elif block.kind == 'code':
+            self.code_block(block.lines)
+        elif block.kind == 'rule':
+            self.rule()
+        elif block.kind == 'list':
+            self.list_block(block.items)
+        elif block.kind == 'table':
+            self.table(block.header, block.alignments, block.rows)
+
+    # Package --------------------------------------------------------------
+    def _numbering_xml(self) -> str:
+        xml = [f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:numbering {W_NAMESPACES}>']
+        for index, definition in enumerate(self.lists):
+            xml.append(f'<w:abstractNum w:abstractNumId="{index}"><w:multiLevelType w:val="hybridMultilevel"/>')
+            for level, (number_format, start) in enumerate(definition):
+                if number_format == 'decimal':
+                    text = f'%{level + 1}.'
+                else:
+                    text = BULLETS[level % len(BULLETS)]
+                indent = 720 * (level + 1)
+                xml.append(f'<w:lvl w:ilvl="{level}"><w:start w:val="{start}"/><w:numFmt w:val="{number_format}"/>'
+                           f'<w:lvlText w:val="{text}"/><w:lvlJc w:val="left"/>'
+                           f'<w:pPr><w:ind w:left="{indent}" w:hanging="360"/></w:pPr></w:lvl>')
+            xml.append('</w:abstractNum>')
+        for index in range(len(self.lists)):
+            xml.append(f'<w:num w:numId="{index + 1}"><w:abstractNumId w:val="{index}"/></w:num>')
+        xml.append('</w:numbering>')
+        return ''.join(xml)
+
+    def _relationships_xml(self) -> str:
+        xml = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+               '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+               f'<Relationship Id="rIdStyles" Type="{RELATIONSHIP_TYPE}/styles" Target="styles.xml"/>'
+               f'<Relationship Id="rIdNumbering" Type="{RELATIONSHIP_TYPE}/numbering" Target="numbering.xml"/>']
+        for url, rid in self.hyperlinks.items():
+            xml.append(f'<Relationship Id="{rid}" Type="{RELATIONSHIP_TYPE}/hyperlink" '
+                       f'Target="{escape(url, {chr(34): "&quot;"})}" TargetMode="External"/>')
+        xml.append('</Relationships>')
+        return ''.join(xml)
+
+    def _document_xml(self) -> str:
+        return (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:document {W_NAMESPACES}><w:body>'
+                + ''.join(self.body) +
+                '<w:sectPr><w:pgSz w:w="12240" w:h="15840"/>'
+                '<w:pgMar w:top="1440" w:right="1440" w:bottom="1440" w:left="1440" w:header="720" w:footer="720" w:gutter="0"/>'
+                '</w:sectPr></w:body></w:document>')
+
+    def package(self) -> bytes:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as docx:
+            docx.writestr('[Content_Types].xml', CONTENT_TYPES_XML)
+            docx.writestr('_rels/.rels', PACKAGE_RELATIONSHIPS_XML)
+            docx.writestr('word/document.xml', self._document_xml())
+            docx.writestr('word/styles.xml', STYLES_XML)
+            docx.writestr('word/numbering.xml', self._numbering_xml())
+            docx.writestr('word/_rels/document.xml.rels', self._relationships_xml())
+        return buffer.getvalue()
+
+def _is_block_start(line: str, next_line: Optional[str]) -> bool:
+    return bool(ATX_HEADING_PATTERN.match(line) or FENCE_PATTERN.match(line) or RULE_PATTERN.match(line)
+                or QUOTE_PATTERN.match(line) or HTML_BLOCK_PATTERN.match(line)
+                or ('|' in line and next_line is not None and TABLE_SEPARATOR_PATTERN.match(next_line)))
+
+def parse_markdown(markdown: str) -> List[Block]:
+    """
+    Parse markdown once into a list of blocks with their inline runs, which every
+    renderer (docx here, html and pdf in the completion Lambda) works from.
+
+    Raises:
+        UnsupportedMarkdown: The document uses syntax outside the supported subset.
+    """
+    if FOOTNOTE_PATTERN.search(markdown):
+        raise UnsupportedMarkdown('footnote')
+    blocks: List[Block] = []
+    lines = markdown.replace('\r\n', '\n').replace('\r', '\n').replace('\t', '    ').split('\n')
+    paragraph: List[str] = []
+
+    def flush() -> None:
+        if paragraph:
+            blocks.append(Block('paragraph', runs=parse_inline(_join_lines(paragraph))))
+            paragraph.clear()
+
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        next_line = lines[index + 1] if index + 1 < len(lines) else None
+        stripped = line.strip()
+
+        fence = FENCE_PATTERN.match(line)
+        if fence:
+            flush()
+            marker = fence.group(1)
+            code = []
+            index += 1
+            while index < len(lines) and not lines[index].strip().startswith(marker):
+                code.append(lines[index])
+                index += 1
+            blocks.append(Block('code', lines=code))
+            index += 1
+            continue
+
+        if not stripped:
+            flush()
+            index += 1
+            continue
+
+        setext = SETEXT_PATTERN.match(line)
+        if setext and paragraph:
+            blocks.append(Block('heading', level=1 if setext.group(1).startswith('=') else 2,
+                                runs=parse_inline(_join_lines(paragraph))))
+            paragraph.clear()
+            index += 1
+            continue
+
+        heading = ATX_HEADING_PATTERN.match(line)
+        if heading:
+            flush()
+            blocks.append(Block('heading', level=len(heading.group(1)), runs=parse_inline(heading.group(2))))
+            index += 1
+            continue
+
+        if RULE_PATTERN.match(line):
+            flush()
+            blocks.append(Block('rule'))
+            index += 1
+            continue
+
+        if HTML_BLOCK_PATTERN.match(line):
+            raise UnsupportedMarkdown(f'HTML block {stripped[:40]}')
+
+        if '|' in line and next_line is not None and TABLE_SEPARATOR_PATTERN.match(next_line):
+            flush()
+            header = _split_row(line)
+            alignments = []
+            for cell in _split_row(next_line):
+                if cell.startswith(':') and cell.endswith(':'):
+                    alignments.append('center')
+                elif cell.endswith(':'):
+                    alignments.append('right')
+                else:
+                    alignments.append('')
+            rows = []
+            index += 2
+            while index < len(lines) and lines[index].strip() and '|' in lines[index]:
+                rows.append(_split_row(lines[index]))
+                index += 1
+            blocks.append(Block('table', header=[parse_inline(cell) for cell in header], alignments=alignments,
+                                rows=[[parse_inline(cell) for cell in row] for row in rows]))
+            continue
+
+        quote = QUOTE_PATTERN.match(line)
+        if quote:
+            flush()
+            quoted: List[str] = []
+            while index < len(lines):
+                quote = QUOTE_PATTERN.match(lines[index])
+                if not quote:
+                    break
+                if quote.group(1).strip():
+                    quoted.append(quote.group(1))
+                elif quoted:
+                    blocks.append(Block('paragraph', runs=parse_inline(_join_lines(quoted)), style='Quote'))
+                    quoted = []
+                index += 1
+            if quoted:
+                blocks.append(Block('paragraph', runs=parse_inline(_join_lines(quoted)), style='Quote'))
+            continue
+
+        if LIST_ITEM_PATTERN.match(line):
+            flush()
+            items: List[List] = []
+            indents: List[int] = []
+            while index < len(lines):
+                current = lines[index]
+                item = LIST_ITEM_PATTERN.match(current)
+                if item:
+                    indent = len(item.group(1))
+                    if items and indent <= indents[0] and (item.group(3) is not None) != items[0][1]:
+                        # A top-level item with the other kind of marker starts a new list.
+                        break
+                    while indents and indent < indents[-1]:
+                        indents.pop()
+                    if not indents or indent > indents[-1]:
+                        indents.append(indent)
+                    number = item.group(3)
+                    items.append([min(len(indents) - 1, 8), number is not None, int(number or 1), [item.group(4)]])
+                    index += 1
+                elif not current.strip():
+                    # A blank line only continues the list if the list goes on after it.
+                    following = index + 1
+                    while following < len(lines) and not lines[following].strip():
+                        following += 1
+                    if following < len(lines) and (LIST_ITEM_PATTERN.match(lines[following])
+                                                   or lines[following].startswith('  ')):
+                        index = following
+                    else:
+                        break
+                elif current.startswith('  ') or not _is_block_start(current, lines[index + 1] if index + 1 < len(lines) else None):
+                    # Continuation line of the last item.
+                    items[-1][3].append(current)
+                    index += 1
+                else:
+                    break
+            blocks.append(Block('list', items=[(level, ordered, start, parse_inline(_join_lines(text)))
+                                               for level, ordered, start, text in items]))
+            continue
+
+        paragraph.append(line)
+        index += 1
+
+    flush()
+    return blocks
+
+def blocks_to_docx(blocks: List[Block]) -> bytes:
+    """
+    Write parsed blocks into a docx package.
+    """
+    builder = _DocumentBuilder()
+    for block in blocks:
+        builder.add(block)
+    return builder.package()
+
+def markdown_to_docx(markdown: str) -> bytes:
+    """
+    Convert markdown to docx bytes without pandoc.
+
+    Raises:
+        UnsupportedMarkdown: The document uses syntax outside the supported subset.
+    """
+    return blocks_to_docx(parse_markdown(markdown))
+
+def pandoc_to_docx(markdown: str) -> bytes:
+    """
+    Convert markdown to docx bytes with pandoc.
+    """
+    import pypandoc
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'output.docx')
+        pypandoc.convert_text(source=markdown, to='docx', format='md', outputfile=path)
+        with open(path, 'rb') as f:
+            return f.read()
+
+def convert_markdown(markdown: str,
+                     writer: str = 'native',
+                     pandoc: Optional[Callable[[str], bytes]] = None) -> Tuple[bytes, str]:
+    """
+    Convert markdown to docx bytes.
+
+    Parameters:
+        markdown (str): Markdown document.
+        writer (str): 'native' for the in-process writer with pandoc as fallback, or 'pandoc'.
+        pandoc (Callable): Converts with pandoc instead of pandoc_to_docx, e.g. a
+            PandocServer's to_docx.
+
+    Returns:
+        (docx bytes, writer that produced them)
+    """
+    if writer == 'native':
+        try:
+            return markdown_to_docx(markdown), 'native'
+        except UnsupportedMarkdown as e:
+            print(f"Native docx writer does not support {str(e)}, converting with pandoc")
+        except Exception as e:
+            print(f"Warning: Native docx writer failed, converting with pandoc: {str(e)}")
+    return (pandoc or pandoc_to_docx)(markdown), 'pandoc'
+
+CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '<Override PartName="/word/numbering.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.numbering+xml"/>'
+    '</Types>')
+
+PACKAGE_RELATIONSHIPS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    f'<Relationship Id="rId1" Type="{RELATIONSHIP_TYPE}/officeDocument" Target="word/document.xml"/>'
+    '</Relationships>')
+
+def _heading_style(level: int) -> str:
+    return (f'<w:style w:type="paragraph" w:styleId="Heading{level}"><w:name w:val="heading {level}"/>'
+            f'<w:basedOn w:val="Normal"/><w:next w:val="Normal"/><w:uiPriority w:val="9"/><w:qFormat/>'
+            f'<w:pPr><w:keepNext/><w:keepLines/><w:spacing w:before="{360 if level == 1 else 200}" w:after="80"/>'
+            f'<w:outlineLvl w:val="{level - 1}"/></w:pPr>'
+            f'<w:rPr><w:b/><w:bCs/><w:color w:val="1F3864"/><w:sz w:val="{HEADING_SIZES[level - 1]}"/>'
+            f'<w:szCs w:val="{HEADING_SIZES[level - 1]}"/></w:rPr></w:style>')
+
+STYLES_XML = (
+    f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:styles {W_NAMESPACES}>'
+    '<w:docDefaults><w:rPrDefault><w:rPr>'
+    '<w:rFonts w:ascii="Calibri" w:hAnsi="Calibri" w:eastAsia="Calibri" w:cs="Calibri"/>'
+    '<w:sz w:val="22"/><w:szCs w:val="22"/><w:lang w:val="en-CA"/></w:rPr></w:rPrDefault>'
+    '<w:pPrDefault><w:pPr><w:spacing w:after="160" w:line="259" w:lineRule="auto"/></w:pPr></w:pPrDefault>'
+    '</w:docDefaults>'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/></w:style>'
+    + ''.join(_heading_style(level) for level in range(1, 7)) +
+    '<w:style w:type="paragraph" w:styleId="ListParagraph"><w:name w:val="List Paragraph"/>'
+    '<w:basedOn w:val="Normal"/><w:uiPriority w:val="34"/><w:qFormat/>'
+    '<w:pPr><w:spacing w:after="60"/><w:ind w:left="720"/><w:contextualSpacing/></w:pPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Quote"><w:name w:val="Quote"/><w:basedOn w:val="Normal"/>'
+    '<w:next w:val="Normal"/><w:qFormat/><w:pPr><w:ind w:left="720" w:right="720"/></w:pPr>'
+    '<w:rPr><w:i/><w:iCs/><w:color w:val="404040"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="SourceCode"><w:name w:val="Source Code"/><w:basedOn w:val="Normal"/>'
+    '<w:pPr><w:spacing w:after="0" w:line="240" w:lineRule="auto"/></w:pPr>'
+    '<w:rPr><w:rFonts w:ascii="Consolas" w:hAnsi="Consolas"/><w:sz w:val="20"/></w:rPr></w:style>'
+    '<w:style w:type="character" w:default="1" w:styleId="DefaultParagraphFont">'
+    '<w:name w:val="Default Paragraph Font"/><w:uiPriority w:val="1"/><w:semiHidden/></w:style>'
+    '<w:style w:type="character" w:styleId="Hyperlink"><w:name w:val="Hyperlink"/>'
+    '<w:basedOn w:val="DefaultParagraphFont"/><w:rPr><w:color w:val="0563C1"/><w:u w:val="single"/></w:rPr></w:style>'
+    '<w:style w:type="character" w:styleId="VerbatimChar"><w:name w:val="Verbatim Char"/>'
+    '<w:basedOn w:val="DefaultParagraphFont"/><w:rPr><w:rFonts w:ascii="Consolas" w:hAnsi="Consolas"/>'
+    '<w:sz w:val="20"/></w:rPr></w:style>'
+    '<w:style w:type="table" w:default="1" w:styleId="TableNormal"><w:name w:val="Normal Table"/>'
+    '<w:semiHidden/><w:tblPr><w:tblInd w:w="0" w:type="dxa"/>'
+    '<w:tblCellMar><w:top w:w="0" w:type="dxa"/><w:left w:w="108" w:type="dxa"/>'
+    '<w:bottom w:w="0" w:type="dxa"/><w:right w:w="108" w:type="dxa"/></w:tblCellMar></w:tblPr></w:style>'
+    '<w:style w:type="table" w:styleId="TableGrid"><w:name w:val="Table Grid"/><w:basedOn w:val="TableNormal"/>'
+    '<w:pPr><w:spacing w:after="0" w:line="240" w:lineRule="auto"/></w:pPr><w:tblPr><w:tblBorders>'
+    '<w:top w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+    '<w:left w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+    '<w:bottom w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+    '<w:right w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+    '<w:insideH w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+    '<w:insideV w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+    '</w:tblBorders></w:tblPr></w:style>'
+    '</w:styles>')
@@ -0,0 +1,181 @@
+"""
+Persistent pandoc server for repeated conversions.
+
+pypandoc.convert_text starts a new pandoc process for every document, which
+dominates the conversion time of short forms and of batch re-conversions. pandoc
+3 ships an HTTP server mode (`pandoc server`) that converts documents posted as
+JSON. PandocServer starts it once per process (a Lambda container) on localhost
+and sends conversions to it:
+
+    server = PandocServer(fallback=pandoc_to_docx)
+    docx_bytes = server.to_docx(markdown)
+
+The server is started on the first conversion. If it cannot be started, dies, or
+rejects a document, that conversion goes to the fallback (pandoc as a subprocess)
+instead, and a new start is attempted after retry_seconds.
+"""
+import base64
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Optional
+)
+
+class PandocServerError(RuntimeError):
+    """
+    Raised when the pandoc server is unavailable or fails a conversion.
+    """
+
+def pandoc_path() -> str:
+    """
+    pandoc binary used by pypandoc (PYPANDOC_PANDOC, pypandoc-binary or the PATH).
+    """
+    if os.getenv('PYPANDOC_PANDOC'):
+        return os.environ['PYPANDOC_PANDOC']
+    try:
+        import pypandoc
+        return pypandoc.get_pandoc_path()
+    except Exception:
+        return 'pandoc'
+
+class PandocServer:
+    def __init__(self,
+                 fallback: Optional[Callable[[str], bytes]] = None,
+                 port: int = 3030,
+                 request_timeout: int = 60,
+                 startup_timeout: float = 5.0,
+                 retry_seconds: float = 60.0,
+                 executable: Optional[str] = None):
+        """
+        Parameters:
+            fallback (Callable): Converts markdown to docx bytes without the server,
+                e.g. md_docx.pandoc_to_docx. Without one, server failures are raised.
+            port (int): Localhost port of the server.
+            request_timeout (int): Seconds the server and client allow per conversion.
+            startup_timeout (float): Seconds to wait for the server to accept connections.
+            retry_seconds (float): Seconds after a failed start before starting again.
+            executable (str): pandoc binary, see pandoc_path by default.
+        """
+        self.fallback = fallback
+        self.port = port
+        self.request_timeout = request_timeout
+        self.startup_timeout = startup_timeout
+        self.retry_seconds = retry_seconds
+        self.executable = executable
+        self.process: Optional[subprocess.Popen] = None
+        self.failed_at = 0.0
+        self.stats = {'server': 0, 'fallback': 0, 'starts': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/"
+
+    def running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def _accepting(self) -> bool:
+        try:
+            with socket.create_connection(('127.0.0.1', self.port), timeout=0.2):
+                return True
+        except OSError:
+            return False
+
+    def start(self) -> bool:
+        """
+        Start the server unless it is running, or failed less than retry_seconds ago.
+        Returns whether it is running.
+        """
+        with self._lock:
+            if self.running():
+                return True
+            if self.failed_at and time.time() - self.failed_at < self.retry_seconds:
+                return False
+            start = time.perf_counter()
+            try:
+                self.process = subprocess.Popen(
+                    [self.executable or pandoc_path(), 'server',
+                     '--port', str(self.port), '--timeout', str(self.request_timeout)],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL)
+                deadline = time.perf_counter() + self.startup_timeout
+                while not self._accepting():
+                    if self.process.poll() is not None or time.perf_counter() > deadline:
+                        raise PandocServerError(f"pandoc server did not start on port {self.port}")
+                    time.sleep(0.02)
+            except Exception as e:
+                print(f"Warning: Could not start pandoc server, converting with subprocesses: {str(e)}")
+                self._kill()
+                self.failed_at = time.time()
+                return False
+            self.failed_at = 0.0
+            self.stats['starts'] += 1
+            print(f"pandoc server started on port {self.port} in {(time.perf_counter() - start) * 1000:.0f} ms")
+            return True
+
+    def stop(self) -> None:
+        with self._lock:
+            self._kill()
+
+    def _kill(self) -> None:
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+
+    def convert(self, text: str, to: str, from_format: str = 'markdown') -> bytes:
+        """
+        Convert text with the server. Binary formats (docx, pdf) come back decoded.
+        Raises PandocServerError if the server is not running or the conversion fails.
+        """
+        if not self.running():
+            raise PandocServerError("pandoc server is not running")
+        payload: Dict[str, Any] = {'text': text, 'from': from_format, 'to': to}
+        request = urllib.request.Request(self.url,
+                                         data=json.dumps(payload).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json',
+                                                  'Accept': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.request_timeout) as response:
+                result = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise PandocServerError(f"pandoc server returned {e.code}: {e.read()[:500]!r}") from e
+        except (OSError, ValueError) as e:
+            raise PandocServerError(f"pandoc server request failed: {str(e)}") from e
+        if result.get('error'):
+            raise PandocServerError(f"pandoc server error: {result['error']}")
+        output = result.get('output', '')
+        if result.get('base64'):
+            return base64.b64decode(output)
+        return output.encode('utf-8')
+
+    def to_docx(self, markdown: str) -> bytes:
+        """
+        Convert markdown to docx bytes with the server, starting it if needed, or
+        with the fallback if the server is unavailable.
+        """
+        if self.start():
+            try:
+                docx_bytes = self.convert(markdown, 'docx')
+                self.stats['server'] += 1
+                return docx_bytes
+            except PandocServerError as e:
+                if self.fallback is None:
+                    raise
+                print(f"Warning: {str(e)}, converting with a pandoc subprocess")
+                if not self.running():
+                    self.failed_at = time.time()
+        elif self.fallback is None:
+            raise PandocServerError("pandoc server is not available")
+        self.stats['fallback'] += 1
+        return self.fallback(markdown)
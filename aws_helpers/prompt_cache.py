@@ -0,0 +1,109 @@
+"""
+Bedrock prompt caching helpers.
+
+Every completion sends the same application_writing_prompt and the same
+{form}_template.docx ahead of the per-user content. Cache points after those
+blocks let Bedrock reuse the processed prefix across invocations and users, so it
+is billed at the cache-read rate and skipped in time-to-first-token.
+
+Converse requests mark a cache point with a {'cachePoint': {'type': 'default'}}
+block. Batch inference records use the model's native body, where Anthropic models
+take cache_control on the block that ends the prefix. Usage is reported as
+cacheReadInputTokens / cacheWriteInputTokens (converse) or cache_read_input_tokens /
+cache_creation_input_tokens (native), and PromptCacheStats accepts both.
+"""
+import json
+import threading
+import time
+from typing import (
+    Any,
+    Dict,
+    Optional
+)
+
+CACHE_POINT = {'cachePoint': {'type': 'default'}}
+ANTHROPIC_CACHE_CONTROL = {'type': 'ephemeral'}
+
+def _usage_value(usage: Dict, *names: str) -> int:
+    for name in names:
+        if name in usage:
+            return int(usage[name] or 0)
+    return 0
+
+class PromptCacheStats:
+    def __init__(self):
+        """
+        Running totals of cached and uncached input tokens. Thread-safe, so concurrent
+        section calls can record into the same instance.
+        """
+        self.requests = 0
+        self.input_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.lock = threading.Lock()
+
+    def record(self, usage: Optional[Dict]) -> None:
+        """
+        Add the usage block of one response (converse, converse_stream metadata or a
+        batch inference modelOutput).
+        """
+        if not usage:
+            return
+        with self.lock:
+            self.requests += 1
+            self.input_tokens += _usage_value(usage, 'inputTokens', 'input_tokens')
+            self.cache_read_tokens += _usage_value(usage, 'cacheReadInputTokens', 'cache_read_input_tokens')
+            self.cache_write_tokens += _usage_value(usage, 'cacheWriteInputTokens', 'cache_creation_input_tokens')
+
+    def merge(self, other: Dict) -> None:
+        """
+        Add totals previously returned by as_dict.
+        """
+        with self.lock:
+            self.requests += other.get('requests', 0)
+            self.input_tokens += other.get('inputTokens', 0)
+            self.cache_read_tokens += other.get('cacheReadInputTokens', 0)
+            self.cache_write_tokens += other.get('cacheWriteInputTokens', 0)
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        Share of all prompt tokens served from the cache. inputTokens only counts the
+        uncached remainder, so the three counters add up to the full prompt.
+        """
+        total = self.input_tokens + self.cache_read_tokens + self.cache_write_tokens
+        return self.cache_read_tokens / total if total else 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            'requests': self.requests,
+            'inputTokens': self.input_tokens,
+            'cacheReadInputTokens': self.cache_read_tokens,
+            'cacheWriteInputTokens': self.cache_write_tokens,
+            'hitRate': round(self.hit_rate, 4)
+        }
+
+def update_stats_s3(s3_client: Any, bucket: str, key: str, stats: PromptCacheStats) -> Dict:
+    """
+    Add stats to the running totals stored at key and return the new totals. This
+    is a read-modify-write without locking, so two runs finishing at the same moment
+    can lose one update; that is acceptable for a reporting metric.
+
+    Parameters:
+        s3_client (Any): S3 client object.
+        bucket (str): Bucket holding the totals.
+        key (str): JSON object with the totals, created on first use.
+        stats (PromptCacheStats): Usage of the current run.
+
+    Returns:
+        Totals across all runs recorded so far.
+    """
+    totals = PromptCacheStats()
+    try:
+        totals.merge(json.loads(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()))
+    except Exception:
+        pass
+    totals.merge(stats.as_dict())
+    body = {**totals.as_dict(), 'updatedAt': int(time.time())}
+    s3_client.put_object(Bucket=bucket, Key=key, Body=json.dumps(body), ContentType='application/json')
+    return body
@@ -0,0 +1,209 @@
+"""
+Token-bucket rate limiter with AIMD (additive increase, multiplicative decrease)
+back-off for Bedrock calls.
+
+Each API (retrieve, converse, count_tokens) gets one shared limiter per process.
+The configured requests-per-second is the ceiling, normally the account quota.
+When a call is throttled the refill rate is cut multiplicatively; every
+successful call nudges it back up additively until it reaches the ceiling again.
+Callers therefore run at the quota instead of a guessed thread count and do not
+pile into a throttle-retry storm.
+
+Limits can be overridden per API with environment variables, e.g. RETRIEVE_RPS=20
+and RETRIEVE_BURST=20.
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Optional,
+    Tuple
+)
+
+# (requests per second, burst) per API. Override with {API}_RPS / {API}_BURST.
+DEFAULT_RATE_LIMITS: Dict[str, Tuple[float, float]] = {
+    'retrieve': (20.0, 20.0),
+    'converse': (1.0, 5.0),
+    'count_tokens': (10.0, 10.0)
+}
+
+def is_throttling_error(error: Exception) -> bool:
+    """
+    True if the exception is a botocore ClientError with a throttling error code.
+    """
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code', '') in ('ThrottlingException', 'TooManyRequestsException')
+
+class AdaptiveRateLimiter:
+    def __init__(self,
+                 rate: float,
+                 burst: float,
+                 min_rate: Optional[float] = None,
+                 increase: Optional[float] = None,
+                 decrease_factor: float = 0.5,
+                 cooldown: float = 1.0,
+                 name: str = ''):
+        """
+        Thread-safe token bucket whose refill rate adapts with AIMD. Usable from
+        threads (acquire) and from coroutines (acquire_async).
+
+        Parameters:
+            rate (float): Ceiling in requests per second, normally the service quota.
+            burst (float): Bucket capacity, i.e. how many requests may go out back to back.
+            min_rate (Optional[float]): Floor for the adaptive rate. Defaults to 5% of rate.
+            increase (Optional[float]): Requests per second added after each success.
+                                        Defaults to 1% of rate.
+            decrease_factor (float): Multiplier applied to the rate on throttling.
+            cooldown (float): Minimum seconds between two multiplicative decreases.
+            name (str): Name used in log lines.
+        """
+        if rate <= 0 or burst <= 0:
+            raise ValueError("rate and burst must be positive")
+        self.max_rate = float(rate)
+        self.burst = float(burst)
+        self.min_rate = float(min_rate) if min_rate else self.max_rate * 0.05
+        self.increase = float(increase) if increase else self.max_rate * 0.01
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.name = name
+        self.rate = self.max_rate
+        self.tokens = self.burst
+        self.throttle_count = 0
+        self.last_refill = time.monotonic()
+        self.last_decrease = float('-inf')
+        self.lock = threading.Lock()
+
+    def _try_take(self) -> float:
+        """
+        Take a token if one is available. Returns 0 on success, otherwise the time
+        until the next token is due at the current rate. Waiters re-check after
+        sleeping, so a rate change applies to requests that are already queued.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self) -> None:
+        """
+        Block the calling thread until a request may be sent.
+        """
+        wait_time = self._try_take()
+        while wait_time > 0:
+            time.sleep(wait_time)
+            wait_time = self._try_take()
+
+    async def acquire_async(self) -> None:
+        """
+        Suspend the calling coroutine until a request may be sent.
+        """
+        wait_time = self._try_take()
+        while wait_time > 0:
+            await asyncio.sleep(wait_time)
+            wait_time = self._try_take()
+
+    def on_success(self) -> None:
+        """
+        Additive increase towards the configured ceiling.
+        """
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self) -> None:
+        """
+        Multiplicative decrease, and drop any accumulated burst so the next calls are
+        paced. Requests already in flight when the quota was hit tend to be throttled
+        together, so the rate is cut at most once per cooldown window.
+        """
+        with self.lock:
+            self.throttle_count += 1
+            self.tokens = min(self.tokens, 0.0)
+            now = time.monotonic()
+            if now - self.last_decrease < self.cooldown:
+                return
+            self.last_decrease = now
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            print(f"Throttled on {self.name or 'API'}. Rate reduced to {self.rate:.2f} requests/second")
+
+    def call(self, func: Callable[..., Any], *args: Any, max_retries: int = 5, **kwargs: Any) -> Any:
+        """
+        Call func under the limiter, retrying throttled calls. Any other error is raised as is.
+
+        Parameters:
+            func (Callable): Blocking client method, e.g. bedrock_runtime_client.converse.
+            max_retries (int): Attempts before the throttling error is re-raised.
+
+        Returns:
+            Whatever func returns.
+        """
+        for attempt in range(max_retries):
+            self.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if is_throttling_error(e) and attempt < max_retries - 1:
+                    self.on_throttle()
+                    continue
+                raise
+            self.on_success()
+            return result
+
+    async def call_async(self, func: Callable[..., Any], *args: Any, max_retries: int = 5, **kwargs: Any) -> Any:
+        """
+        Coroutine version of call for async client methods.
+        """
+        for attempt in range(max_retries):
+            await self.acquire_async()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                if is_throttling_error(e) and attempt < max_retries - 1:
+                    self.on_throttle()
+                    continue
+                raise
+            self.on_success()
+            return result
+
+_limiters: Dict[str, AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def configure_limiter(api: str, rate: float, burst: Optional[float] = None, **kwargs: Any) -> AdaptiveRateLimiter:
+    """
+    Create (or replace) the shared limiter for an API.
+
+    Parameters:
+        api (str): API name, e.g. 'retrieve', 'converse', 'count_tokens'.
+        rate (float): Requests per second ceiling.
+        burst (Optional[float]): Bucket capacity. Defaults to rate.
+        **kwargs: Passed to AdaptiveRateLimiter.
+
+    Returns:
+        The new limiter.
+    """
+    limiter = AdaptiveRateLimiter(rate, burst if burst is not None else rate, name=api, **kwargs)
+    with _limiters_lock:
+        _limiters[api] = limiter
+    return limiter
+
+def get_limiter(api: str) -> AdaptiveRateLimiter:
+    """
+    Return the shared limiter for an API, creating it from the environment or
+    DEFAULT_RATE_LIMITS on first use.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(api)
+        if limiter is None:
+            default_rate, default_burst = DEFAULT_RATE_LIMITS.get(api, (10.0, 10.0))
+            rate = float(os.getenv(f"{api.upper()}_RPS", default_rate))
+            burst = float(os.getenv(f"{api.upper()}_BURST", default_burst))
+            limiter = AdaptiveRateLimiter(rate, burst, name=api)
+            _limiters[api] = limiter
+        return limiter
@@ -0,0 +1,272 @@
+"""
+Offline token estimator calibrated against real Bedrock count_tokens results.
+
+helpers._count_tokens opens a new boto3 session and makes a network round trip per
+string, which is far too slow inside a packing loop. This module estimates token
+counts locally from three cheap features (characters, whitespace-separated words and
+non-ASCII bytes) with a linear model fitted per model id to a stored sample of exact
+counts. Exact counts are kept in an LRU, and every exact count becomes a new
+calibration sample.
+
+count_tokens has the same signature as helpers._count_tokens plus an exact flag, and
+count_tokens_batch sizes thousands of chunks in milliseconds without network access.
+
+Calibrations are stored as JSON at TOKEN_CALIBRATION_PATH (default:
+token_calibration.json next to this module, which ships seed coefficients for the
+Sonnet and Haiku models in use), keyed by foundation model id. Inference-profile ids
+such as us.anthropic.claude-sonnet-4-5-20250929-v1:0 are mapped to their foundation
+model id, both for the calibration lookup and for count_tokens, which only accepts
+foundation model ids. To (re)calibrate a model from a folder of sample text files:
+
+    python -m aws_helpers.token_estimator <model_id> <folder>
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence
+)
+
+DEFAULT_CALIBRATION_PATH = os.getenv('TOKEN_CALIBRATION_PATH',
+                                     os.path.join(os.path.dirname(os.path.abspath(__file__)), 'token_calibration.json'))
+# Uncalibrated fallback: roughly four characters per token for English prose.
+DEFAULT_COEFFICIENTS = [0.0, 0.25, 0.0, 0.0]
+MAX_SAMPLES_PER_MODEL = 500
+# Geography prefix of a cross-region inference profile id.
+INFERENCE_PROFILE_PATTERN = re.compile(r'^(us|us-gov|eu|apac|jp|au|global)\.')
+
+def foundation_model_id(model_id: Optional[str]) -> Optional[str]:
+    """
+    Foundation model id of an inference-profile id, e.g.
+    us.anthropic.claude-sonnet-4-5-20250929-v1:0 -> anthropic.claude-sonnet-4-5-20250929-v1:0.
+    Foundation model ids are returned unchanged.
+    """
+    return INFERENCE_PROFILE_PATTERN.sub('', model_id) if model_id else model_id
+
+def _words(text: str) -> int:
+    # Separator count is close enough to a word count and avoids allocating a list.
+    return text.count(' ') + text.count('\n') + 1 if text else 0
+
+def _non_ascii_bytes(text: str) -> int:
+    return 0 if text.isascii() else len(text.encode('utf-8')) - len(text)
+
+def _features(text: str) -> List[float]:
+    """
+    [intercept, characters, words, non-ASCII bytes]. All computed by C-level str methods.
+    """
+    return [1.0, float(len(text)), float(_words(text)), float(_non_ascii_bytes(text))]
+
+def _solve(matrix: List[List[float]], vector: List[float]) -> Optional[List[float]]:
+    """
+    Gaussian elimination with partial pivoting. Returns None for a singular system.
+    """
+    n = len(vector)
+    augmented = [row[:] + [vector[i]] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(augmented[r][col]))
+        if abs(augmented[pivot][col]) < 1e-12:
+            return None
+        augmented[col], augmented[pivot] = augmented[pivot], augmented[col]
+        for r in range(n):
+            if r != col:
+                factor = augmented[r][col] / augmented[col][col]
+                for c in range(col, n + 1):
+                    augmented[r][c] -= factor * augmented[col][c]
+    return [augmented[i][n] / augmented[i][i] for i in range(n)]
+
+def fit_coefficients(samples: Sequence[Dict]) -> List[float]:
+    """
+    Least-squares fit of tokens against the features of each sample, with a small
+    ridge term so a handful of similar samples still gives a usable model. Falls back
+    to a plain tokens-per-character ratio if the system is degenerate.
+
+    Parameters:
+        samples (Sequence[Dict]): Dicts with 'features' and 'tokens'.
+
+    Returns:
+        Coefficients for [intercept, characters, words, non-ASCII bytes].
+    """
+    if not samples:
+        return DEFAULT_COEFFICIENTS[:]
+
+    n = len(DEFAULT_COEFFICIENTS)
+    xtx = [[0.0] * n for _ in range(n)]
+    xty = [0.0] * n
+    for sample in samples:
+        x = sample['features']
+        for i in range(n):
+            xty[i] += x[i] * sample['tokens']
+            for j in range(n):
+                xtx[i][j] += x[i] * x[j]
+    for i in range(1, n):
+        xtx[i][i] += 1e-3 * (xtx[i][i] or 1.0)
+
+    coefficients = _solve(xtx, xty)
+    if coefficients is None or coefficients[1] < 0:
+        total_chars = sum(sample['features'][1] for sample in samples)
+        ratio = sum(sample['tokens'] for sample in samples) / total_chars if total_chars else DEFAULT_COEFFICIENTS[1]
+        coefficients = [0.0, ratio, 0.0, 0.0]
+    return coefficients
+
+def _default_exact_counter(model_id: str, content: str) -> int:
+    # Imported lazily so copies of this module outside aws_helpers do not need helpers.
+    from aws_helpers.helpers import _count_tokens
+    return _count_tokens(model_id, content)
+
+class TokenEstimator:
+    def __init__(self,
+                 calibration_path: Optional[str] = DEFAULT_CALIBRATION_PATH,
+                 exact_counter: Optional[Callable[[str, str], int]] = None,
+                 cache_size: int = 4096):
+        """
+        Local token estimator with per-model calibration and an LRU of exact counts.
+
+        Parameters:
+            calibration_path (Optional[str]): JSON file holding samples and coefficients per model id.
+                                              None keeps calibrations in memory only.
+            exact_counter (Optional[Callable[[str, str], int]]): (model_id, content) -> exact tokens.
+                                                                 Defaults to helpers._count_tokens.
+            cache_size (int): Number of exact counts kept in the LRU.
+        """
+        self.calibration_path = calibration_path
+        self.exact_counter = exact_counter or _default_exact_counter
+        self.cache_size = cache_size
+        self.exact_cache: OrderedDict = OrderedDict()
+        self.calibrations: Dict[str, Dict] = {}
+        self.lock = threading.Lock()
+        if calibration_path and os.path.exists(calibration_path):
+            with open(calibration_path, 'r', encoding='utf-8') as f:
+                self.calibrations = json.load(f)
+
+    def coefficients(self, model_id: Optional[str]) -> List[float]:
+        calibration = self.calibrations.get(foundation_model_id(model_id) or '')
+        return calibration['coefficients'] if calibration else DEFAULT_COEFFICIENTS
+
+    def estimate(self, model_id: Optional[str], text: str) -> int:
+        """
+        Estimated token count of text for model_id. Uses an exact count from the LRU when one exists.
+        """
+        key = (foundation_model_id(model_id), hashlib.sha1(text.encode('utf-8')).hexdigest())
+        with self.lock:
+            if key in self.exact_cache:
+                self.exact_cache.move_to_end(key)
+                return self.exact_cache[key]
+        coefficients = self.coefficients(model_id)
+        return max(0, round(sum(c * x for c, x in zip(coefficients, _features(text)))))
+
+    def estimate_batch(self, model_id: Optional[str], texts: Sequence[str]) -> List[int]:
+        """
+        Estimated token counts for many texts. No LRU lookups, so it stays in the
+        millisecond range for thousands of chunks.
+        """
+        a, b, c, d = self.coefficients(model_id)
+        return [max(0, round(a + b * len(text) + c * _words(text) + d * _non_ascii_bytes(text))) for text in texts]
+
+    def count_exact(self, model_id: str, text: str, counter: Optional[Callable[[str, str], int]] = None) -> int:
+        """
+        Exact token count, served from the LRU when possible. Network results are
+        recorded as calibration samples for model_id. The counter is called with the
+        foundation model id.
+
+        Parameters:
+            model_id (str): Model ID of foundation model.
+            text (str): Content to count.
+            counter (Optional[Callable[[str, str], int]]): (model_id, content) -> exact tokens,
+                                                           overriding exact_counter for this call.
+        """
+        model_id = foundation_model_id(model_id)
+        key = (model_id, hashlib.sha1(text.encode('utf-8')).hexdigest())
+        with self.lock:
+            if key in self.exact_cache:
+                self.exact_cache.move_to_end(key)
+                return self.exact_cache[key]
+
+        tokens = (counter or self.exact_counter)(model_id, text)
+
+        with self.lock:
+            self.exact_cache[key] = tokens
+            while len(self.exact_cache) > self.cache_size:
+                self.exact_cache.popitem(last=False)
+            calibration = self.calibrations.setdefault(model_id, {'samples': [], 'coefficients': DEFAULT_COEFFICIENTS[:]})
+            calibration['samples'].append({'features': _features(text), 'tokens': tokens})
+            del calibration['samples'][:-MAX_SAMPLES_PER_MODEL]
+        return tokens
+
+    def calibrate(self, model_id: str, texts: Sequence[str], save: bool = True) -> List[float]:
+        """
+        Count texts exactly, refit the model id's coefficients and optionally save.
+
+        Parameters:
+            model_id (str): Model ID of foundation model.
+            texts (Sequence[str]): Representative sample, ideally a few dozen chunks of real documents.
+            save (bool): Write the calibration file afterwards.
+
+        Returns:
+            Fitted coefficients.
+        """
+        model_id = foundation_model_id(model_id)
+        for text in texts:
+            self.count_exact(model_id, text)
+        with self.lock:
+            calibration = self.calibrations[model_id]
+            calibration['coefficients'] = fit_coefficients(calibration['samples'])
+            calibration['source'] = f"Fitted on {len(calibration['samples'])} count_tokens samples"
+        if save:
+            self.save()
+        return calibration['coefficients']
+
+    def save(self) -> None:
+        if not self.calibration_path:
+            return
+        with self.lock:
+            temp_path = f"{self.calibration_path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.calibrations, f, indent=2)
+            os.replace(temp_path, self.calibration_path)
+
+default_estimator = TokenEstimator()
+
+def count_tokens(model_id: str, content: str, claude: bool = True, exact: bool = False) -> int:
+    """
+    Drop-in replacement for helpers._count_tokens. Returns a local estimate unless
+    exact is True, in which case Bedrock count_tokens is called (through the LRU).
+
+    Parameters:
+        model_id (str): Model ID of foundation models ONLY
+        content (str): Content that will be passed to model.
+        claude (bool): Kept for signature compatibility with helpers._count_tokens.
+        exact (bool): Ask Bedrock instead of estimating.
+
+    Returns:
+        Number of input tokens.
+    """
+    if exact:
+        return default_estimator.count_exact(model_id, content)
+    return default_estimator.estimate(model_id, content)
+
+def count_tokens_batch(model_id: str, contents: Sequence[str]) -> List[int]:
+    """
+    Local estimates for many strings at once.
+    """
+    return default_estimator.estimate_batch(model_id, contents)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python -m aws_helpers.token_estimator <model_id> <folder of .txt/.md samples>")
+        sys.exit(1)
+    model_id, folder = sys.argv[1], sys.argv[2]
+    texts = []
+    for name in sorted(os.listdir(folder)):
+        if name.endswith(('.txt', '.md')):
+            with open(os.path.join(folder, name), 'r', encoding='utf-8') as f:
+                texts.append(f.read())
+    coefficients = default_estimator.calibrate(model_id, texts)
+    print(f"Calibrated {model_id} on {len(texts)} samples: {coefficients}")
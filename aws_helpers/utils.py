@@ -9,6 +9,8 @@ from .helpers import (
     list_obj_s3,
     _get_s3_client
 )
+from .prompt_cache import ANTHROPIC_CACHE_CONTROL
+from .batch_output import BatchOutputParser
 import json
 import os
 import sys
@@ -85,7 +87,14 @@ class BatchInference():
                 "modelInput": {
                     "anthropic_version": "bedrock-2023-05-31",
                     "max_tokens": 1024,
-                    "system": self.creation_prompt,
+                    # Same system prompt on every record, so it is marked as a cacheable prefix.
+                    "system": [
+                        {
+                            "type": "text",
+                            "text": self.creation_prompt,
+                            "cache_control": ANTHROPIC_CACHE_CONTROL
+                        }
+                    ],
                     "messages": [
                         {
                             "role": "user",
@@ -267,173 +276,69 @@ class BatchInference():
         elif not jobArn and not hasattr('self', 'jobArn'):
             print("\x1b[31mEither enter ARN of batch inference job or first start a batch inference job and poll the same object\x1b[0m")
 
-    def process_batch_inference_output(self, local_copy: Optional[bool]=None):
+    def process_batch_inference_output(self, local_copy: Optional[bool]=None, return_text: bool=True):
         """
         Function to post process the jsonl file after batch inference job. The outputs are stored as input.jsonl.out in 
         the folder mentioned during inference job creation in the S3DataConfig parameter. The function looks at the first folder 
         in the output folder. Modify the code as necessary.
 
-        Currently output JSON file is of the format;
+        Every line of the output file is a record of the format;
 
         {
-            "output": [
-                {
-                    "s3_uri": <recordId>,
-                    "license_plate": <license plate number>,
-                    "year": <year>,
-                    "make": <make>,
-                    "model": <model>,
-                    "color": <color>,
-                    "identifiers": <text>
-                }
-            ]
+            "recordId": <id of the enriched question, or PADDING>,
+            "modelInput": {...},
+            "modelOutput": {
+                "content": [{"text": <answer>}],
+                "usage": {...}
+            }
         }
 
+        The output is streamed line by line through BatchOutputParser, which matches each record to its question by
+        id and groups the answers by section on disk, so memory stays flat on multi-GB outputs.
+
         Parameters:
-            local_copy (Optional[bool]): Whether you can a local copy as a csv file.
+            local_copy (Optional[bool]): Read the output and enriched questions from local files instead of S3.
+            return_text (bool): Read the completed form back and return it. Turn off for very large outputs.
         Returns:
+            completed_application (Optional[str]): Completed form grouped by section, if return_text.
         """
+        print("\x1b[31mProcessing output jsonl file\x1b[0m")
         if local_copy == False:
             OUTPUT_FILENAME = f'{date.today()}_input.jsonl.out'
-
-            print("\x1b[31mProcessing output jsonl file\x1b[0m")
+            FORM_FILENAME = "completed_application_form"
 
             list_folders_output = list_obj_s3(s3_client=self.s3_client,
                                 bucket_name=self.bucket_name,
                                 folder_name=f"{self.folder_name}/{self.application_form}/{self.user}/{self.output_folder}",
                                 delimiter='/')[-1]
             
-            response_binary = self.s3_client.get_object(Bucket=self.bucket_name,
-                                            Key=os.path.join(list_folders_output, f"{date.today()}_input.jsonl.out"))["Body"]
-            
             enriched_questions = self.s3_client.get_object(Bucket=self.bucket_name,
                                                         Key=f"{self.folder_name}/{self.application_form}/{self.user}/enriched_questions.json")
-            enriched_questions = json.loads(enriched_questions.decode('utf-8'))
-            
-            form = {}
-            processed_counter = 0
-            success_counter = 0
-            failed_counter = 0
-            justOnce = False
-            for response in response_binary.iter_lines():
-                processed_counter += 1
-                try:
-                    json_obj = json.loads(response.decode('utf-8'))
-                    text = json_obj["modelOutput"]["content"][0]["text"]
-                    text = json.loads(text)
-                    if not justOnce:
-                        print(text)
-                        justOnce = True
-                    record_id = json_obj["recordId"] # Contains the filename
-                    if "PADDING" in record_id:
-                        continue
-                    else:
-                        id = int(record_id)
-                        section = None
-                        for question in enriched_questions:
-                            if question['id'] == id:
-                                section = question['section']
-                                break
-                        if section not in form.keys():
-                            form[section] = [text]
-                        else:
-                            form[section].append(text)
-                    
-                    success_counter += 1
-                except Exception as e:
-                    json_obj = json.loads(response.decode('utf-8'))
-                    # text = json_obj["modelOutput"]["content"][0]["text"]
-                    record_id = json_obj["recordId"] # Contains the filename
-                    print(f"\x1b[31mJSON extraction failed for {json_obj['recordId']}\x1b[0m")
-                    # print(text)
+            enriched_questions = json.loads(enriched_questions['Body'].read().decode('utf-8'))
+            parser = BatchOutputParser(enriched_questions)
 
-                    print(f"\x1b[31m{e}\x1b[0m")
-                    failed_counter += 1
-                # print(json.dumps(json.loads(json_obj), indent = 2))
-
-            final_form = {}
-            for key, value in form.items():
-                final_form[key] = "\n".join(value)
-
-            completed_application = ''
-            for key, value in final_form.items():
-                completed_application = completed_application + key + "\n" + value + "\n\n"
-
-            with open("completed_application_form", "w") as f:
-                f.write(completed_application)
+            response_binary = self.s3_client.get_object(Bucket=self.bucket_name,
+                                            Key=os.path.join(list_folders_output, OUTPUT_FILENAME))["Body"]
+            with open(FORM_FILENAME, "w", encoding='utf-8') as f:
+                counts = parser.write_completed_form(response_binary.iter_lines(), f)
 
         else:
             OUTPUT_FILENAME = f'2025-11-10_input.jsonl.out'
+            FORM_FILENAME = "completed_application_form.txt"
 
-            print("\x1b[31mProcessing output jsonl file\x1b[0m")
-            data = []
-            with open(OUTPUT_FILENAME, "r", encoding='utf-8') as f:
-                for line in f:
-                    json_object = json.loads(line)
-                    data.append(json_object)
-            
             with open("enriched_questions.json", 'r') as f:
-                enriched_questions = f.read()
-            enriched_questions = json.loads(enriched_questions)
-            
-            form = {}
-            processed_counter = 0
-            success_counter = 0
-            failed_counter = 0
-            for response in data:
-                processed_counter += 1
-                try:
-                    json_obj = response
-                    text = json_obj["modelOutput"]["content"][0]["text"]
-                    record_id = json_obj["recordId"] # Contains the filename
-                    if "PADDING" in record_id:
-                        continue
-                    else:
-                        id = int(record_id)
-                        section = None
-                        question = None
-                        for q in enriched_questions:
-                            if q['id'] == id:
-                                section = q['section']
-                                question = q['question']
-                                break
-                        block = {
-                            "Question": question,
-                            "Answer": text
-                        }
-                        if section not in form.keys():
-                            form[section] = [block]
-                        else:
-                            form[section].append(block)
-                    
-                    success_counter += 1
-                except Exception as e:
-                    json_obj = response
-                    # text = json_obj["modelOutput"]["content"][0]["text"]
-                    record_id = json_obj["recordId"] # Contains the filename
-                    print(f"\x1b[31mJSON extraction failed for {json_obj['recordId']}\x1b[0m")
-                    # print(text)
-
-                    print(f"\x1b[31m{e}\x1b[0m")
-                    failed_counter += 1
-                # print(json.dumps(json.loads(json_obj), indent = 2))
-
-            final_form = {}
-            for key, blocks in form.items():
-                temp = []
-                for block in blocks:
-                    temp.append(f"Question: {block['Question']}")
-                    temp.append(f"Answer: {block['Answer']}")
-                final_form[key] = "\n".join(temp)
-
-            completed_application = ''
-            for key, value in final_form.items():
-                completed_application = completed_application + key + "\n" + value + "\n\n"
-
-            with open("completed_application_form.txt", "w") as f:
-                f.write(completed_application)
-
-            return completed_application
+                enriched_questions = json.load(f)
+            parser = BatchOutputParser(enriched_questions)
+
+            with open(OUTPUT_FILENAME, "r", encoding='utf-8') as lines, open(FORM_FILENAME, "w", encoding='utf-8') as f:
+                counts = parser.write_completed_form(lines, f)
+
+        print(f"Records: {json.dumps(counts)}")
+        print(f"Prompt cache: {json.dumps(parser.cache_stats.as_dict())}")
+
+        if return_text:
+            with open(FORM_FILENAME, "r", encoding='utf-8') as f:
+                return f.read()
 
 
 class FineTuning():
@@ -0,0 +1,109 @@
+"""
+Benchmark the batch inference output parser (aws_helpers/batch_output.py) against
+the previous implementation of BatchInference.process_batch_inference_output.
+
+A synthetic .jsonl.out with --records records (100k by default, one question per
+record across --sections sections, plus padding records) is written to a temp
+directory. The script reports, for each parser, wall time and peak Python memory
+(tracemalloc):
+
+    - streaming: dict lookup by id, answers spooled per section, read line by line
+    - legacy:    whole file loaded into a list, linear scan of the questions for
+                 every record, result built with += (run on the first
+                 --legacy-records records only, since it is O(records x questions))
+
+Usage:
+    python benchmark_batch_output.py [--records 100000] [--sections 20] [--legacy-records 5000]
+"""
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from aws_helpers.batch_output import BatchOutputParser
+
+def write_synthetic_output(path, records, sections):
+    questions = [{'id': index, 'section': f"Section {index % sections + 1}", 'question': f"Question {index}?"}
+                 for index in range(records)]
+    with open(path, 'w', encoding='utf-8') as f:
+        for question in questions:
+            f.write(json.dumps({
+                'recordId': str(question['id']),
+                'modelInput': {'messages': [{'role': 'user', 'content': question['question']}]},
+                'modelOutput': {'content': [{'type': 'text', 'text': f"Answer to question {question['id']}. " * 8}],
+                                'usage': {'input_tokens': 900, 'output_tokens': 120,
+                                          'cache_read_input_tokens': 800, 'cache_creation_input_tokens': 0}}
+            }) + '\n')
+        for index in range(max(1, records // 1000)):
+            f.write(json.dumps({'recordId': f"PADDING{index}", 'modelOutput': {'content': [{'text': ''}]}}) + '\n')
+    return questions
+
+def legacy_parse(path, enriched_questions, limit):
+    data = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for index, line in enumerate(f):
+            if index >= limit:
+                break
+            data.append(json.loads(line))
+    form = {}
+    for json_obj in data:
+        text = json_obj["modelOutput"]["content"][0]["text"]
+        record_id = json_obj["recordId"]
+        if "PADDING" in record_id:
+            continue
+        id = int(record_id)
+        section = None
+        question = None
+        for q in enriched_questions:
+            if q['id'] == id:
+                section = q['section']
+                question = q['question']
+                break
+        form.setdefault(section, []).append({"Question": question, "Answer": text})
+    completed_application = ''
+    for key, blocks in form.items():
+        temp = []
+        for block in blocks:
+            temp.append(f"Question: {block['Question']}")
+            temp.append(f"Answer: {block['Answer']}")
+        completed_application = completed_application + key + "\n" + "\n".join(temp) + "\n\n"
+    return completed_application
+
+def streaming_parse(path, enriched_questions, limit=None):
+    output = io.StringIO() if limit is not None else open(os.devnull, 'w', encoding='utf-8')
+    with open(path, 'r', encoding='utf-8') as lines, output:
+        selected = lines if limit is None else (line for index, line in enumerate(lines) if index < limit)
+        BatchOutputParser(enriched_questions).write_completed_form(selected, output)
+        return output.getvalue() if limit is not None else None
+
+def measure(parse, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = parse(*args)
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak / 1024 / 1024, result
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    records = int(args[args.index('--records') + 1]) if '--records' in args else 100000
+    sections = int(args[args.index('--sections') + 1]) if '--sections' in args else 20
+    legacy_records = int(args[args.index('--legacy-records') + 1]) if '--legacy-records' in args else 5000
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'input.jsonl.out')
+        questions = write_synthetic_output(path, records, sections)
+        print(f"Output: {records} records, {sections} sections, {os.path.getsize(path) / 1024 / 1024:.1f} MiB\n")
+
+        legacy_records = min(legacy_records, records)
+        # Both parsers must produce the same form.
+        assert streaming_parse(path, questions, legacy_records) == legacy_parse(path, questions, legacy_records)
+
+        print(f"{'parser':10} {'records':>8} {'seconds':>9} {'records/s':>10} {'peak MiB':>9}")
+        duration, peak, _ = measure(legacy_parse, path, questions, legacy_records)
+        print(f"{'legacy':10} {legacy_records:8} {duration:9.2f} {legacy_records / duration:10.0f} {peak:9.1f}")
+        duration, peak, _ = measure(streaming_parse, path, questions)
+        print(f"{'streaming':10} {records:8} {duration:9.2f} {records / duration:10.0f} {peak:9.1f}")
@@ -0,0 +1,109 @@
+"""
+Benchmark the in-process docx writer (aws_helpers/md_docx.py) against pypandoc.
+
+For a markdown document (a completed form, or a synthetic one with the same mix of
+headings, lists, tables and emphasis) the script reports:
+
+    - conversion latency per document (median and p95 over --runs conversions)
+    - cold start: a fresh interpreter importing the writer and converting once
+    - what each writer adds to the container image
+
+pypandoc is optional; without it only the native writer is measured.
+
+Usage:
+    python benchmark_docx_writer.py [completed_form.md] [--runs 50] [--out native.docx]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+from aws_helpers.md_docx import markdown_to_docx, pandoc_to_docx
+
+def synthetic_form(sections=12):
+    parts = ["# CanExport SMEs Application\n"]
+    for section in range(1, sections + 1):
+        parts.append(f"## {section}. Section {section}\n")
+        parts.append("**Question:** Describe the *export* project and its expected results "
+                     "(maximum 2,000 characters).\n")
+        parts.append("The company plans to expand into **three new markets** with a focused "
+                     "trade show and digital campaign. " * 6 + "\n")
+        parts.append("1. Market research in the United States\n2. Trade show in Germany\n"
+                     "   - Booth and travel\n   - Translated marketing material\n3. Digital campaign\n")
+        parts.append("| Activity | Market | Cost |\n|:---|:---:|---:|\n"
+                     + "".join(f"| Activity {row} | Market {row} | ${row * 1250:,} |\n" for row in range(1, 6)))
+    return "\n".join(parts)
+
+def time_conversions(convert, markdown, runs):
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        convert(markdown)
+        durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    return statistics.median(durations), durations[max(0, int(len(durations) * 0.95) - 1)]
+
+def cold_start(statement):
+    """
+    Wall-clock milliseconds for a new interpreter to run statement.
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', statement], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return (time.perf_counter() - start) * 1000
+
+def directory_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    runs = int(args[args.index('--runs') + 1]) if '--runs' in args else 50
+    out = args[args.index('--out') + 1] if '--out' in args else None
+    paths = [arg for index, arg in enumerate(args)
+             if not arg.startswith('--') and (index == 0 or args[index - 1] not in ('--runs', '--out'))]
+
+    if paths:
+        with open(paths[0], 'r', encoding='utf-8') as f:
+            markdown = f.read()
+    else:
+        markdown = synthetic_form()
+    print(f"Document: {len(markdown)} characters, {markdown.count(chr(10))} lines, {runs} runs\n")
+
+    try:
+        import pypandoc
+        pypandoc.get_pandoc_version()
+        has_pandoc = True
+    except Exception as e:
+        print(f"pypandoc not available, measuring the native writer only ({str(e)})\n")
+        has_pandoc = False
+
+    empty = cold_start("pass")
+    writers = [('native', markdown_to_docx,
+                "from aws_helpers.md_docx import markdown_to_docx; markdown_to_docx('# Form\\n\\n**x**')")]
+    if has_pandoc:
+        writers.append(('pandoc', pandoc_to_docx,
+                        "from aws_helpers.md_docx import pandoc_to_docx; pandoc_to_docx('# Form\\n\\n**x**')"))
+
+    print(f"{'writer':8} {'median ms':>10} {'p95 ms':>10} {'cold start ms':>14} {'docx bytes':>11}")
+    for name, convert, statement in writers:
+        median, p95 = time_conversions(convert, markdown, runs)
+        # Interpreter start-up itself is subtracted.
+        startup = cold_start(statement) - empty
+        size = len(convert(markdown))
+        print(f"{name:8} {median:10.1f} {p95:10.1f} {startup:14.1f} {size:11}")
+
+    print("\nImage footprint:")
+    native_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'aws_helpers', 'md_docx.py')
+    print(f"  native  {directory_size(native_path) / 1024:10.1f} KiB (md_docx.py, standard library only)")
+    if has_pandoc:
+        package = os.path.dirname(pypandoc.__file__)
+        pandoc_binary = pypandoc.get_pandoc_path()
+        binary_size = 0 if pandoc_binary.startswith(package) else directory_size(pandoc_binary)
+        print(f"  pandoc  {(directory_size(package) + binary_size) / 1024 / 1024:10.1f} MiB (pypandoc and the pandoc binary)")
+
+    if out:
+        with open(out, 'wb') as f:
+            f.write(markdown_to_docx(markdown))
+        print(f"\nNative output written to {out}")
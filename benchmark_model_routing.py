@@ -0,0 +1,119 @@
+"""
+Benchmark per-section model routing against the single-model baseline.
+
+Every section of a saved enriched_questions.json is generated twice: once with
+the large model everywhere (baseline) and once with the model picked by
+ModelRouter. For each run the script reports the wall-clock time (sections run
+concurrently, as in the Lambda), latency per section, input/output tokens and the
+token cost.
+
+Usage:
+    python benchmark_model_routing.py <enriched_questions.json> <prompt.txt> [config.json] [--dry-run]
+
+config.json is a form config with a modelRouting block. --dry-run only prints the
+routing table and needs no AWS credentials.
+"""
+import json
+import os
+import sys
+import time
+import boto3
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+# The generation modules live with the completion Lambda, which imports the shared
+# aws_helpers modules flat, as they are laid out in its image.
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'aws_helpers'))
+sys.path.insert(0, os.path.join(ROOT, 'fundica-cdk', 'services', 'lambdas', 'application-completion-lambda'))
+from chunk_store import build_enriched_text
+from model_router import ModelRouter, estimate_cost
+from section_generator import generate_sections, group_by_section, section_instruction
+
+AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY", None)
+AWS_SECRET_KEY = os.getenv("AWS_SECRET_KEY", None)
+MODEL_ID = 'us.anthropic.claude-sonnet-4-5-20250929-v1:0'
+SECTION_MAX_TOKENS = 16000
+MAX_WORKERS = 8
+
+def run(bedrock_runtime_client, sections, prompt, route):
+    """
+    Generate all sections concurrently with route(section, questions) -> model id.
+    Returns per-section results and the wall-clock time.
+    """
+    calls = {}
+
+    def generate_section(section, questions, position):
+        model_id = route(section, questions)
+        enriched_text, _ = build_enriched_text(questions)
+        enriched_text += "\n\n" + section_instruction(section, position, len(sections))
+        start = time.time()
+        response = bedrock_runtime_client.converse(modelId=model_id,
+                                                   messages=[{'role': 'user', 'content': [{'text': enriched_text}]}],
+                                                   system=[{'text': prompt}],
+                                                   inferenceConfig={'maxTokens': SECTION_MAX_TOKENS})
+        usage = response['usage']
+        calls[section] = {
+            'model': model_id,
+            'seconds': time.time() - start,
+            'inputTokens': usage['inputTokens'],
+            'outputTokens': usage['outputTokens'],
+            'cost': estimate_cost(model_id, usage['inputTokens'], usage['outputTokens'])
+        }
+        return response['output']['message']['content'][0]['text']
+
+    start = time.time()
+    generate_sections(sections, generate_section, max_workers=MAX_WORKERS)
+    return calls, time.time() - start
+
+def summarize(name, calls, wall_clock):
+    print(f"\n{name}: wall clock {wall_clock:.1f}s, "
+          f"slowest section {max(c['seconds'] for c in calls.values()):.1f}s, "
+          f"{sum(c['inputTokens'] for c in calls.values())} input / "
+          f"{sum(c['outputTokens'] for c in calls.values())} output tokens, "
+          f"${sum(c['cost'] for c in calls.values()):.4f}")
+    for section, call in calls.items():
+        print(f"  {section[:40]:40} {call['model'][:45]:45} {call['seconds']:6.1f}s "
+              f"{call['inputTokens']:7} in {call['outputTokens']:6} out ${call['cost']:.4f}")
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != '--dry-run']
+    if len(args) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    with open(args[0], 'r', encoding='utf-8') as f:
+        enriched_questions = json.load(f)
+    with open(args[1], 'r', encoding='utf-8') as f:
+        prompt = f.read()
+    config = {}
+    if len(args) > 2:
+        with open(args[2], 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+    sections = group_by_section(enriched_questions)
+    router = ModelRouter.from_config(MODEL_ID, config.get('modelRouting')) or ModelRouter(MODEL_ID)
+
+    print("Routing table:")
+    for section, questions in sections:
+        model_id, route_class = router.route(section, questions)
+        print(f"  {section[:40]:40} {route_class:7} {router.context_tokens(questions):7} context tokens -> {model_id}")
+    if '--dry-run' in sys.argv:
+        sys.exit(0)
+
+    session = boto3.Session(aws_access_key_id=AWS_ACCESS_KEY,
+                            aws_secret_access_key=AWS_SECRET_KEY,
+                            region_name='us-east-1')
+    bedrock_runtime_client = session.client('bedrock-runtime')
+
+    baseline_calls, baseline_time = run(bedrock_runtime_client, sections, prompt, lambda section, questions: MODEL_ID)
+    routed_calls, routed_time = run(bedrock_runtime_client, sections, prompt,
+                                    lambda section, questions: router.route(section, questions)[0])
+
+    summarize("Baseline (single model)", baseline_calls, baseline_time)
+    summarize("Routed", routed_calls, routed_time)
+    baseline_cost = sum(c['cost'] for c in baseline_calls.values())
+    routed_cost = sum(c['cost'] for c in routed_calls.values())
+    print(f"\nRouted vs baseline: wall clock {routed_time - baseline_time:+.1f}s, "
+          f"cost {routed_cost - baseline_cost:+.4f} USD "
+          f"({(routed_cost / baseline_cost - 1) if baseline_cost else 0:+.1%})")
@@ -0,0 +1,53 @@
+"""
+Benchmark pandoc conversions as subprocesses against a persistent pandoc server.
+
+For a markdown document (a completed form, or the synthetic form of
+benchmark_docx_writer.py) the script converts it --runs times to docx with:
+
+    - subprocess: pypandoc.convert_text, one pandoc process per document
+    - server:     aws_helpers/pandoc_server.py, one `pandoc server` for all documents
+
+and reports median and p95 latency per document and the server's start-up time.
+Needs pypandoc and a pandoc 3 binary with the server mode.
+
+Usage:
+    python benchmark_pandoc_server.py [completed_form.md] [--runs 50] [--port 3030]
+"""
+import sys
+import time
+from aws_helpers.md_docx import pandoc_to_docx
+from aws_helpers.pandoc_server import PandocServer
+from benchmark_docx_writer import synthetic_form, time_conversions
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    runs = int(args[args.index('--runs') + 1]) if '--runs' in args else 50
+    port = int(args[args.index('--port') + 1]) if '--port' in args else 3030
+    paths = [arg for index, arg in enumerate(args)
+             if not arg.startswith('--') and (index == 0 or args[index - 1] not in ('--runs', '--port'))]
+
+    if paths:
+        with open(paths[0], 'r', encoding='utf-8') as f:
+            markdown = f.read()
+    else:
+        markdown = synthetic_form()
+    print(f"Document: {len(markdown)} characters, {markdown.count(chr(10))} lines, {runs} runs\n")
+
+    # No fallback, so a server failure is reported instead of being measured as a subprocess.
+    server = PandocServer(port=port, retry_seconds=0)
+    start = time.perf_counter()
+    if not server.start():
+        sys.exit("pandoc server could not be started; check that pandoc 3 is installed")
+    startup = (time.perf_counter() - start) * 1000
+
+    try:
+        # Warm both paths once so the first conversion does not skew the median.
+        pandoc_to_docx(markdown)
+        server.to_docx(markdown)
+        print(f"{'mode':11} {'median ms':>10} {'p95 ms':>10}")
+        for name, convert in (('subprocess', pandoc_to_docx), ('server', server.to_docx)):
+            median, p95 = time_conversions(convert, markdown, runs)
+            print(f"{name:11} {median:10.1f} {p95:10.1f}")
+        print(f"\nServer start-up: {startup:.0f} ms (once per container)")
+    finally:
+        server.stop()
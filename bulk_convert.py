@@ -0,0 +1,219 @@
+"""
+Bulk re-conversion of completed forms from markdown to docx.
+
+Every .md object under --prefix (results/ by default) is downloaded, converted with
+aws_helpers/md_docx.py and uploaded as a .docx next to it, or under --dest-prefix
+with the same relative path. The stages overlap:
+
+    - the listing is a paginator generator, so work starts with the first page
+    - download and conversion run in a process pool (--workers), each worker with
+      its own S3 client
+    - finished documents are uploaded from a thread pool (--upload-workers) while
+      the listing continues and the pool keeps converting
+    - at most IN_FLIGHT_PER_WORKER conversions per worker and per upload worker are
+      pending at a time, so the listing waits instead of holding every converted
+      document in memory
+
+A manifest of source ETags (JSON in S3 under the destination prefix, or a local
+file with --manifest) records what was converted with which writer. Later runs skip
+documents whose ETag has not changed, so only new or edited forms are converted.
+The manifest is saved every --manifest-every uploads and again when the run ends,
+also when it fails or is interrupted, so a rerun resumes where it stopped.
+
+Usage:
+    python bulk_convert.py [--bucket BUCKET] [--prefix results/] [--dest-prefix PREFIX]
+                           [--writer native|pandoc] [--workers N] [--upload-workers N]
+                           [--manifest manifest.json] [--manifest-every N] [--force] [--dry-run]
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import time
+from io import BytesIO
+import boto3
+from aws_helpers import helpers
+from aws_helpers.md_docx import DOCX_CONTENT_TYPE, convert_markdown
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+S3_BUCKET_NAME = os.getenv("S3_BUCKET", '')
+AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY", '')
+AWS_SECRET_KEY = os.getenv("AWS_SECRET_KEY", '')
+MANIFEST_NAME = 'bulk-convert-manifest.json'
+# Pending conversions per process and pending uploads per upload thread; bounds the
+# docx bytes held in memory however many documents are listed.
+IN_FLIGHT_PER_WORKER = 4
+
+def create_s3_client():
+    session = boto3.Session(aws_access_key_id=AWS_ACCESS_KEY or None,
+                            aws_secret_access_key=AWS_SECRET_KEY or None,
+                            region_name='us-east-1')
+    return session.client("s3")
+
+# S3 client of a pool worker, created once by init_worker.
+worker_s3_client = None
+
+def init_worker():
+    global worker_s3_client
+    worker_s3_client = create_s3_client()
+
+def convert_object(bucket, key, writer):
+    """
+    Download one markdown object and convert it in a pool worker.
+
+    Returns:
+        (key, ETag of the converted version, docx bytes, writer that produced them)
+    """
+    response = worker_s3_client.get_object(Bucket=bucket, Key=key)
+    markdown = response['Body'].read().decode('utf-8')
+    docx_bytes, used_writer = convert_markdown(markdown, writer=writer)
+    return key, response['ETag'], docx_bytes, used_writer
+
+def output_key(key, prefix, dest_prefix):
+    relative = key[len(prefix):] if key.startswith(prefix) else key
+    return f"{dest_prefix}{os.path.splitext(relative)[0]}.docx"
+
+def load_manifest(s3_client, bucket, manifest_key, manifest_path):
+    try:
+        if manifest_path:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        response = s3_client.get_object(Bucket=bucket, Key=manifest_key)
+        return json.loads(response['Body'].read())
+    except Exception as e:
+        if 'NoSuchKey' not in str(e) and not isinstance(e, FileNotFoundError):
+            print(f"Warning: Could not read manifest, converting everything: {str(e)}")
+        return {}
+
+def save_manifest(s3_client, bucket, manifest_key, manifest_path, manifest):
+    body = json.dumps(manifest, indent=1, sort_keys=True)
+    if manifest_path:
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            f.write(body)
+    else:
+        s3_client.put_object(Bucket=bucket, Key=manifest_key, Body=body, ContentType='application/json')
+
+def unchanged(entry, obj, out_key, writer):
+    return (entry is not None
+            and entry.get('etag') == obj['ETag']
+            and entry.get('output') == out_key
+            and entry.get('writer') == writer)
+
+def bulk_convert(args):
+    s3_client = create_s3_client()
+    dest_prefix = args.prefix if args.dest_prefix is None else args.dest_prefix
+    manifest_key = f"{dest_prefix}{MANIFEST_NAME}"
+    manifest = {} if args.force else load_manifest(s3_client, args.bucket, manifest_key, args.manifest)
+    counts = {'listed': 0, 'skipped': 0, 'converted': 0, 'failed': 0}
+    start = time.time()
+    # Uploads recorded in the manifest since it was last saved.
+    unsaved = 0
+
+    def flush():
+        nonlocal unsaved
+        if unsaved and not args.dry_run:
+            save_manifest(s3_client, args.bucket, manifest_key, args.manifest, manifest)
+            unsaved = 0
+
+    def upload(key, etag, docx_bytes, out_key):
+        s3_client.upload_fileobj(BytesIO(docx_bytes), args.bucket, out_key,
+                                 ExtraArgs={'ContentType': DOCX_CONTENT_TYPE})
+        return key, etag, out_key
+
+    def record(future):
+        nonlocal unsaved
+        try:
+            key, etag, out_key = future.result()
+        except Exception as e:
+            counts['failed'] += 1
+            print(f"Error uploading: {str(e)}")
+            return
+        manifest[key] = {'etag': etag, 'output': out_key, 'writer': args.writer}
+        counts['converted'] += 1
+        unsaved += 1
+        print(f"Converted {key} -> {out_key}")
+        if unsaved >= args.manifest_every:
+            flush()
+
+    def drain_uploads(wait=False):
+        # Record finished uploads; with wait, first block until one finishes.
+        if wait:
+            concurrent.futures.wait(uploads, return_when=concurrent.futures.FIRST_COMPLETED)
+        finished = {future for future in uploads if future.done()}
+        for future in finished:
+            record(future)
+        uploads.difference_update(finished)
+
+    def drain_conversions(uploader, wait=False):
+        # Hand finished conversions to the uploader; with wait, first block until one finishes.
+        if wait:
+            concurrent.futures.wait(conversions, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in [future for future in conversions if future.done()]:
+            out_key = conversions.pop(future)
+            try:
+                key, etag, docx_bytes, used_writer = future.result()
+            except Exception as e:
+                counts['failed'] += 1
+                print(f"Error converting {out_key}: {str(e)}")
+                continue
+            if used_writer != args.writer:
+                print(f"{key} converted with {used_writer} writer")
+            while len(uploads) >= max_uploads:
+                drain_uploads(wait=True)
+            uploads.add(uploader.submit(upload, key, etag, docx_bytes, out_key))
+        drain_uploads()
+
+    # Pending conversion futures (to their output key) and upload futures.
+    conversions = {}
+    uploads = set()
+    max_conversions = args.workers * IN_FLIGHT_PER_WORKER
+    max_uploads = args.upload_workers * IN_FLIGHT_PER_WORKER
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as pool, \
+             concurrent.futures.ThreadPoolExecutor(max_workers=args.upload_workers) as uploader:
+            for obj in helpers.iter_obj_s3(s3_client, args.bucket, args.prefix, suffix='.md'):
+                counts['listed'] += 1
+                out_key = output_key(obj['Key'], args.prefix, dest_prefix)
+                if unchanged(manifest.get(obj['Key']), obj, out_key, args.writer):
+                    counts['skipped'] += 1
+                    continue
+                if args.dry_run:
+                    print(f"Would convert {obj['Key']} -> {out_key}")
+                    continue
+                conversions[pool.submit(convert_object, args.bucket, obj['Key'], args.writer)] = out_key
+                # Upload what is done while listing; wait once the pool is full.
+                drain_conversions(uploader, wait=len(conversions) >= max_conversions)
+
+            while conversions:
+                drain_conversions(uploader, wait=True)
+            while uploads:
+                drain_uploads(wait=True)
+    finally:
+        try:
+            flush()
+        except Exception as e:
+            print(f"Warning: Could not save manifest, {unsaved} conversions will be redone: {str(e)}")
+    print(f"\n{counts['listed']} documents listed, {counts['converted']} converted, "
+          f"{counts['skipped']} unchanged, {counts['failed']} failed in {time.time() - start:.1f}s")
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-convert completed markdown forms in S3 to docx.")
+    parser.add_argument('--bucket', default=S3_BUCKET_NAME, help="Bucket of the forms (S3_BUCKET by default)")
+    parser.add_argument('--prefix', default='results/', help="Prefix of the markdown documents")
+    parser.add_argument('--dest-prefix', default=None,
+                        help="Prefix of the docx output, the source prefix by default")
+    parser.add_argument('--writer', default='native', choices=('native', 'pandoc'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Download and conversion processes")
+    parser.add_argument('--upload-workers', type=int, default=16, help="Concurrent uploads")
+    parser.add_argument('--manifest', default=None,
+                        help=f"Local manifest file instead of {MANIFEST_NAME} under the destination prefix")
+    parser.add_argument('--manifest-every', type=int, default=50,
+                        help="Save the manifest after this many uploads")
+    parser.add_argument('--force', action='store_true', help="Convert every document, ignoring the manifest")
+    parser.add_argument('--dry-run', action='store_true', help="List what would be converted")
+    args = parser.parse_args()
+    if not args.bucket:
+        parser.error("--bucket or S3_BUCKET is required")
+    bulk_convert(args)
@@ -25,6 +25,18 @@ export class InfraStack extends cdk.Stack {
       autoDeleteObjects: true
     })
 
+    // Cached knowledge base retrievals expire even if the KB is never re-synced
+    s3_docs.addLifecycleRule({
+      prefix: 'retrieval-cache/',
+      expiration: cdk.Duration.days(30)
+    })
+
+    // Cached generations are keyed by their full request and are never reused once stale
+    s3_docs.addLifecycleRule({
+      prefix: 'generation-cache/',
+      expiration: cdk.Duration.days(7)
+    })
+
     new aws_s3_deployment.BucketDeployment(this, 'DeployPrompts', {
       sources: [
         aws_s3_deployment.Source.asset(path.join(__dirname, "../../local-files"))
@@ -38,6 +50,12 @@ export class InfraStack extends cdk.Stack {
       autoDeleteObjects: true
     })
 
+    // Status records of asynchronous completion jobs are only polled while the job runs
+    s3_filled_bucket.addLifecycleRule({
+      prefix: 'jobs/',
+      expiration: cdk.Duration.days(30)
+    })
+
     const s3_users_bucket = new aws_s3.Bucket(this, 'UserBucket', {
       bucketName: `fundica-users-${this.account}`,
       removalPolicy: cdk.RemovalPolicy.RETAIN,
@@ -126,10 +144,14 @@ export class InfraStack extends cdk.Stack {
       role: kb_lambda_role,
       environment: {
         KB_ID: process.env.KB_ID || '',
-        KB_DATASOURCE_ID: process.env.KB_DATASOURCE_ID || ''
+        KB_DATASOURCE_ID: process.env.KB_DATASOURCE_ID || '',
+        S3_DOCS: s3_docs.bucketName
       }
     })
 
+    // KB sync lambda records the ingestion version and purges the retrieval cache
+    s3_docs.grantReadWrite(kb_sync_lambda)
+
     // Application form completion lambda
     // const application_form_lambda = new aws_lambda.Function(this, 'ApplicationFormLambda', {
     //   functionName: 'application-form-completion-lambda',
@@ -150,15 +172,21 @@ export class InfraStack extends cdk.Stack {
     const application_form_lambda = new aws_lambda.DockerImageFunction(this, 'ApplicationFormLambda', {
       functionName: 'application-form-completion-lambda',
       description: 'Lamda that will complete the appplication form',
+      // Built from the repository root so the image copies the shared modules in
+      // aws_helpers/ (the root .dockerignore limits what is sent to the builder)
       code: aws_lambda.DockerImageCode.fromImageAsset(
-        path.join(__dirname, '../../services/lambdas/application-completion-lambda/'), 
+        path.join(__dirname, '../../..'),
         {
+          file: 'fundica-cdk/services/lambdas/application-completion-lambda/Dockerfile',
           platform: aws_ecr_assets.Platform.LINUX_AMD64
         }
       ),
       timeout: cdk.Duration.minutes(15),
       memorySize: 2048,
       role: application_role,
+      // An async job's worker invocation records its own failure; a retry would
+      // run the whole completion again.
+      retryAttempts: 0,
       environment: {
         S3_DOCS: s3_docs.bucketName,
         S3_FILLED: s3_filled_bucket.bucketName,
@@ -170,12 +198,38 @@ export class InfraStack extends cdk.Stack {
     s3_filled_bucket.grantReadWrite(application_form_lambda)
     s3_docs.grantReadWrite(application_form_lambda)
 
+    // In async mode the completion lambda invokes itself for the worker run
+    application_role.addToPolicy(new aws_iam.PolicyStatement({
+      actions: ['lambda:InvokeFunction'],
+      resources: [`arn:aws:lambda:${this.region}:${this.account}:function:application-form-completion-lambda*`],
+      effect: aws_iam.Effect.ALLOW
+    }))
+
+    // Reads the status record of an asynchronous completion job
+    const job_status_lambda = new aws_lambda.Function(this, 'JobStatusLambda', {
+      functionName: 'job-status-lambda',
+      description: 'Lambda that returns the progress of an asynchronous application form job',
+      code: aws_lambda.Code.fromAsset(path.join(__dirname, '../../services/lambdas/')),
+      handler: 'job_status_lambda.lambda_handler',
+      runtime: aws_lambda.Runtime.PYTHON_3_13,
+      timeout: cdk.Duration.seconds(10),
+      memorySize: 256,
+      role: basic_lambda_role,
+      environment: {
+        S3_FILLED: s3_filled_bucket.bucketName
+      }
+    })
+
+    s3_filled_bucket.grantRead(job_status_lambda, 'jobs/*')
+
     // MD to DOCX lambda
     const md_docx_lambda = new aws_lambda.DockerImageFunction(this, 'PyPandocLambda', {
       functionName: 'md-to-docx-lambda',
+      // Built from the repository root, like the completion lambda
       code: aws_lambda.DockerImageCode.fromImageAsset(
-        path.join(__dirname, '../../services/lambdas/pypandoc-lambda/'),
+        path.join(__dirname, '../../..'),
         {
+          file: 'fundica-cdk/services/lambdas/pypandoc-lambda/Dockerfile',
           platform: aws_ecr_assets.Platform.LINUX_AMD64
         }
       ),
@@ -202,11 +256,24 @@ export class InfraStack extends cdk.Stack {
       outputPath: '$.Payload'
     })
 
+    // The execution name is the run id of the completion, so a retry of this task
+    // resumes from the stage checkpoints of the failed attempt.
     const third_task_application = new aws_sfn_tasks.LambdaInvoke(this, 'InvokeApplicationLambda', {
       lambdaFunction: application_form_lambda,
+      payload: aws_sfn.TaskInput.fromObject({
+        'body.$': '$.body',
+        'runId.$': '$$.Execution.Name'
+      }),
       outputPath: '$.Payload'
     })
 
+    third_task_application.addRetry({
+      errors: ['States.TaskFailed', 'Lambda.ServiceException', 'Lambda.SdkClientException'],
+      interval: cdk.Duration.seconds(5),
+      maxAttempts: 2,
+      backoffRate: 2
+    })
+
     const fourth_task_md = new aws_sfn_tasks.LambdaInvoke(this, 'InvokeMdDocxLambda', {
       lambdaFunction: md_docx_lambda,
       outputPath: '$.Payload'
@@ -219,7 +286,8 @@ export class InfraStack extends cdk.Stack {
 
     const stateMachine = new aws_sfn.StateMachine(this, 'StateMachine', {
       definitionBody: aws_sfn.DefinitionBody.fromChainable(definition),
-      timeout: cdk.Duration.minutes(15),
+      // Leaves room for a retry of the completion after a Lambda timeout
+      timeout: cdk.Duration.minutes(45),
       stateMachineName: 'form-completion-orchestration'
     })
   }
@@ -1,14 +1,50 @@
+from lazy_init import LazyModule, lazy_client, log_cold_start
 import json
-import boto3
+import hashlib
 import os
 import time
-import pypandoc
 from io import BytesIO
-from threading import Lock
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 from datetime import date
+from async_retrieval import retrieve_all_contexts
+from rate_limiter import get_limiter
+from chunk_store import build_enriched_text
+from context_packer import ContextPacker, count_tokens_exact
+from token_estimator import default_estimator
+from model_router import ModelRouter
+from continuation import converse_with_continuation, with_prefill
+from generation_cache import GenerationCache, generation_entries_prefix
+from asset_cache import AssetCache
+from checkpoint import NoCheckpoints, RunCheckpoints, run_prefix
+from md_render import CONTENT_TYPES, OUTPUT_FORMATS, render_formats
+from template_filler import TemplateFiller
+from job_status import JobStatus, NoJobStatus, new_job_id, read_job
+from prompt_cache import CACHE_POINT, PromptCacheStats, update_stats_s3
+from template_skeleton import (
+    compile_skeleton,
+    load_skeleton,
+    store_skeleton,
+    template_key
+)
+from stream_writer import S3StreamWriter, consume_converse_stream
+from section_generator import (
+    build_manifest,
+    generate_sections,
+    group_by_section,
+    load_manifest,
+    plan_regeneration,
+    section_instruction,
+    stitch_sections,
+    store_manifest
+)
+from retrieval_cache import (
+    LocalDiskCacheBackend,
+    RetrievalCache,
+    S3CacheBackend,
+    entries_prefix,
+    read_ingestion_version
+)
 
 # os.environ['PYPANDOC_PANDOC'] = '/opt/bin/pandoc'
 
@@ -17,20 +53,89 @@ S3_DOCS = os.environ.get('S3_DOCS')
 S3_FILLED = os.getenv("S3_FILLED")
 KB_ID = os.getenv("KB_ID", '')
 NUM_RESULTS_PER_QUERY = 5
-MAX_WORKERS = 15
+# Concurrent retrieve calls on the event loop. Request rate is paced separately by
+# the shared 'retrieve' limiter (RETRIEVE_RPS / RETRIEVE_BURST).
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", 100))
+# Where retrievals are cached between runs: 's3' (S3_DOCS), 'local' (/tmp) or 'none'
+RETRIEVAL_CACHE_BACKEND = os.getenv("RETRIEVAL_CACHE_BACKEND", 's3')
+RETRIEVAL_CACHE_TTL_SECONDS = int(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+# Cache of finished generations keyed by the full converse request: 's3' (S3_DOCS),
+# 'local' (/tmp) or 'none'. Bounded by TTL and total size.
+GENERATION_CACHE_BACKEND = os.getenv("GENERATION_CACHE_BACKEND", 's3')
+GENERATION_CACHE_TTL_SECONDS = int(os.getenv("GENERATION_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+GENERATION_CACHE_MAX_BYTES = int(os.getenv("GENERATION_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Input-token budget for system prompt + enriched_text when the form config sets none.
+# Sonnet's 200k window also has to hold the template document and maxTokens of output.
+DEFAULT_INPUT_TOKEN_BUDGET = int(os.getenv("DEFAULT_INPUT_TOKEN_BUDGET", 120000))
+# 'single' writes the whole form in one converse call, 'section' writes every section
+# concurrently and stitches them in template order. The form config can override it.
+DEFAULT_GENERATION_MODE = os.getenv("GENERATION_MODE", 'single')
+# Sections generated at the same time in section mode. Request rate is paced
+# separately by the shared 'converse' limiter (CONVERSE_RPS / CONVERSE_BURST).
+SECTION_MAX_WORKERS = int(os.getenv("SECTION_MAX_WORKERS", 8))
+# Output tokens per converse call. A reply that hits the limit is continued from its
+# last complete markdown block, up to MAX_CONTINUATIONS times.
+MAX_OUTPUT_TOKENS = int(os.getenv("MAX_OUTPUT_TOKENS", 16000))
+MAX_CONTINUATIONS = int(os.getenv("MAX_CONTINUATIONS", 4))
+# Cache points after the system prompt and the template document, which are the same
+# for every user of a form. Hit rates across runs are kept in S3_DOCS per form.
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", 'true').lower() == 'true'
+PROMPT_CACHE_STATS_PREFIX = 'prompt-cache-stats'
+# Send the template as a compact text skeleton (sections, questions, field limits)
+# compiled once per template ETag, instead of the raw docx document block. The form
+# config can override it with templateSkeleton.
+TEMPLATE_SKELETON = os.getenv("TEMPLATE_SKELETON", 'false').lower() == 'true'
+# Stream the reply into S3_FILLED as a draft markdown while it is generated (single
+# mode only). The form config can override it with streamOutput.
+STREAM_OUTPUT = os.getenv("STREAM_OUTPUT", 'false').lower() == 'true'
+# Seconds kept in reserve before the Lambda timeout to close the draft and convert it.
+STREAM_DEADLINE_RESERVE_SECONDS = int(os.getenv("STREAM_DEADLINE_RESERVE_SECONDS", 60))
+# Template, questions, prompt and form config are kept in the warm container (and
+# mirrored to /tmp) and revalidated against S3 with a conditional GET at most once
+# per ASSET_REVALIDATE_SECONDS.
+ASSET_CACHE = os.getenv("ASSET_CACHE", 'true').lower() == 'true'
+ASSET_REVALIDATE_SECONDS = int(os.getenv("ASSET_REVALIDATE_SECONDS", 60))
+# Default for requests without 'async': accept the request, return a job id and run
+# the completion in a second (Event) invocation that reports progress to
+# jobs/{job_id}.json in S3_FILLED.
+ASYNC_JOBS = os.getenv("ASYNC_JOBS", 'false').lower() == 'true'
+# 'native' writes the docx in process (md_docx) and falls back to pandoc for markdown
+# it does not support; 'pandoc' always converts with pypandoc.
+DOCX_WRITER = os.getenv("DOCX_WRITER", 'native')
+# Write the answers into the form's own template docx instead of converting the
+# markdown to a new document. The form config can override it with fillTemplate.
+FILL_TEMPLATE = os.getenv("FILL_TEMPLATE", 'false').lower() == 'true'
+# Formats written to S3_FILLED from one parse of the completed form: docx, pdf, html.
+# The form config (outputFormats) and the request (outputFormats) can override it;
+# docx is always written.
+DEFAULT_OUTPUT_FORMATS = [output.strip() for output in os.getenv("OUTPUT_FORMATS", 'docx').split(',') if output.strip()]
+# Outputs are streamed to S3 from memory; documents above one part are uploaded in
+# UPLOAD_PART_BYTES parts, UPLOAD_MAX_CONCURRENCY at a time.
+UPLOAD_PART_BYTES = int(os.getenv("UPLOAD_PART_BYTES", 8 * 1024 * 1024))
+UPLOAD_MAX_CONCURRENCY = int(os.getenv("UPLOAD_MAX_CONCURRENCY", 4))
+DEFAULT_SECTION_MAX_TOKENS = 16000
 # MODEL_ID = 'us.anthropic.claude-sonnet-4-20250514-v1:0'
 # MODEL_ID = 'us.anthropic.claude-3-7-sonnet-20250219-v1:0'
 MODEL_ID = 'us.anthropic.claude-sonnet-4-5-20250929-v1:0'
 
-# Initialize clients
-bedrock_runtime_client = boto3.client("bedrock-runtime")
-bedrock_agent = boto3.client('bedrock-agent-runtime')
-s3_client = boto3.client('s3')
+# Clients are created on first use; pypandoc is only imported if pandoc is needed
+bedrock_runtime_client = lazy_client("bedrock-runtime")
+s3_client = lazy_client('s3')
+lambda_client = lazy_client('lambda')
+s3_transfer = LazyModule('boto3.s3.transfer')
+asset_cache = AssetCache(s3_client, S3_DOCS, revalidate_seconds=ASSET_REVALIDATE_SECONDS)
 
+@log_cold_start
 def lambda_handler(event, context):
     """
     This Lambda function is triggered after the knowledge base sync is complete.
     It generates the completed application form and returns it to the frontend.
+
+    With 'async' in the body (or ASYNC_JOBS) it returns a job id right away and the
+    form is generated by a second invocation of this function carrying that job id.
+
+    A runId in the event (the Step Functions execution name) or in the body turns on
+    stage checkpointing, so a retry of the same run resumes where it stopped.
     """
 
     try:
@@ -47,139 +152,608 @@ def lambda_handler(event, context):
         # Validate required fields
         if not username or not application_form:
             return error_response(400, 'Missing required fields: username and applicationForm')
+        output_formats = body.get('outputFormats')
+        if output_formats is not None and (not isinstance(output_formats, list)
+                                           or not set(output_formats) <= set(OUTPUT_FORMATS)):
+            return error_response(400, f'outputFormats must be a list of {list(OUTPUT_FORMATS)}')
     
     except Exception as e:
         print(f"Error in lambda_handler: {str(e)}")
         return error_response(500, f'Internal server error: {str(e)}')
 
-    # Read the CanExport Application form in the form of bytes
-    print('Read the CanExport Application form template in the form of bytes')
+    if event.get('jobId'):
+        return run_job(event['jobId'], body, context)
+    if body.get('async', ASYNC_JOBS):
+        return submit_job(body, context)
+    return complete_application_form(body, context, run_id=event.get('runId') or body.get('runId'))
+
+def complete_application_form(body, context, job=None, run_id=None):
+    """
+    Generate the completed application form for a validated request body and
+    upload it to S3_FILLED. Progress is reported to job if given.
+
+    With a run id, the enriched questions, the generated markdown and the final
+    response are checkpointed under {username}/{year}/runs/{run_id}/ as each stage
+    finishes, and a retry of the same run skips the stages it already completed.
+
+    Returns:
+        API response, as returned by lambda_handler.
+    """
+    job = job or NoJobStatus()
+    username = body.get('username')
+    application_form = body.get('applicationForm')
+    year = body.get('year', date.today().year)
+    checkpoints = open_checkpoints(username, year, run_id)
+
+    output = checkpoints.load('output')
+    if output is not None:
+        print(f"Run {run_id} already completed, returning its output checkpoint")
+        return success_response({**output, 'resumedFrom': 'output'})
+
+    generated = checkpoints.load('generation')
+    if generated is not None:
+        print(f"Resuming run {run_id} from its generation checkpoint")
+    else:
+        generated, error = generate_stage(body, context, job, checkpoints)
+        if error is not None:
+            return error
+
+    job.stage('conversion')
+    output_name = f'{username}_{year}_{application_form}_completed'
     try:
-        response = s3_client.get_object(Bucket=S3_DOCS, Key=f'{application_form}/templates/{application_form}_template.docx')
-        document_bytes = response['Body'].read()
+        # Parse the markdown once and render every format from it. The docx is the
+        # filled template if fillTemplate is on and any answer could be placed.
+        start = time.time()
+        form_config = load_form_config(application_form)
+        output_formats = ['docx'] + [output for output in (body.get('outputFormats')
+                                                          or form_config.get('outputFormats')
+                                                          or DEFAULT_OUTPUT_FORMATS) if output != 'docx']
+        docx_bytes = None
+        if form_config.get('fillTemplate', FILL_TEMPLATE):
+            docx_bytes = fill_template(application_form, generated['markdown'])
+        outputs = render_formats(generated['markdown'], output_formats, writer=DOCX_WRITER, docx_bytes=docx_bytes)
+        print(f"Rendered in {time.time() - start:.2f}s: "
+              + ', '.join(f"{output} ({renderer}, {len(data)} bytes)" for output, (data, renderer) in outputs.items()))
+        upload_outputs({output: data for output, (data, _) in outputs.items()}, f'{username}/{year}/{output_name}')
+
+    except Exception as s3_error:
+        print(f"Warning: Could not save form to S3: {str(s3_error)}")
+        return error_response(400, f"Warning: Could not save form to S3: {str(s3_error)}")
+    response_data = {
+        'message': 'Application form completed',
+        'username': username,
+        'applicationForm': application_form,
+        'generatedAt': f'{date.today()}',
+        'filename': f"{output_name}.docx",
+        'outputs': {output: f"{output_name}.{output}" for output in outputs},
+        'chunkStats': generated['chunkStats'],
+        'promptCache': generated['promptCache']
+    }
+    if generated.get('draftStatus') is not None:
+        response_data['draftFilename'] = f"{username}_{year}_{application_form}_draft.md"
+        response_data['draftStatus'] = generated['draftStatus']
+    if run_id:
+        response_data['runId'] = run_id
+    checkpoints.save('output', response_data)
+    return success_response(response_data)
+
+def generate_stage(body, context, job, checkpoints):
+    """
+    Load the form's assets, retrieve contexts and generate the completed form as
+    markdown. Enriched questions are taken from and saved to checkpoints.
+
+    Returns:
+        (generated, None) with generated holding 'markdown', 'chunkStats',
+        'promptCache' and 'draftStatus', or (None, error response).
+    """
+    username = body.get('username')
+    application_form = body.get('applicationForm')
+    year = body.get('year', date.today().year)
+
+    job.stage('loading')
+    form_config = load_form_config(application_form)
+    # Read the CanExport Application form as a compiled skeleton, or in the form of bytes
+    print('Read the CanExport Application form template')
+    try:
+        template = load_template(application_form, skeleton=form_config.get('templateSkeleton', TEMPLATE_SKELETON))
     except Exception as e:
         print(f"{application_form} not found. Upload applicaiton form first")
-        return error_response(400, f'Application form template not found: {str(e)}')
+        return None, error_response(400, f'Application form template not found: {str(e)}')
 
 
     # Load questions
     print("Load questions")
     try:
-        response = s3_client.get_object(Bucket=S3_DOCS, Key=f'{application_form}/questions/{application_form}_questions.json')
-        questions = json.loads(response['Body'].read())
+        questions = json.loads(read_asset(f'{application_form}/questions/{application_form}_questions.json'))
     except Exception as e:
         print(f"{application_form}_questions.json not found. Check generation of questions.")
-        return error_response(400, f'Questions not found: {str(e)}')
+        return None, error_response(400, f'Questions not found: {str(e)}')
 
     # Create enriched questions concurrently
     print("Create enriched questions")
-    enriched_questions = retrieve_all_contexts_concurrent(
-        questions["questions"], 
-        max_workers=MAX_WORKERS,  # Adjust based on your needs,
-        user = username,
-        year = year
-    )
+    job.stage('retrieval', total=len(questions["questions"]))
+    enriched_questions = checkpoints.load('enriched_questions')
+    to_retrieve = questions["questions"]
+    if enriched_questions is not None:
+        # Retrievals that failed in an earlier attempt are retried, not reused.
+        failed_ids = {enriched['id'] for enriched in enriched_questions if enriched.get('status') != 'success'}
+        enriched_questions = [enriched for enriched in enriched_questions if enriched['id'] not in failed_ids]
+        to_retrieve = [question for question in questions["questions"] if question['id'] in failed_ids]
+        print(f"Using {len(enriched_questions)} enriched questions from the run checkpoint, "
+              f"retrying {len(to_retrieve)} failed retrievals")
+    else:
+        enriched_questions = []
+    if to_retrieve:
+        enriched_questions = sorted(enriched_questions + retrieve_all_contexts_cached(
+            to_retrieve, 
+            user = username,
+            year = year,
+            on_progress = job.progress
+        ), key=lambda x: x['id'])
+        # Only a complete retrieval is checkpointed, so a retry of the run retrieves
+        # the failed questions again instead of keeping their empty contexts.
+        failed = sum(1 for enriched in enriched_questions if enriched.get('status') != 'success')
+        if failed:
+            print(f"Warning: {failed} retrievals failed, enriched questions not checkpointed")
+        else:
+            checkpoints.save('enriched_questions', enriched_questions)
+    else:
+        job.progress(len(questions["questions"]), len(questions["questions"]))
 
     # Load application_writing_prompt.
     print("Load application_writing_prompt.")
     try:
-        response = s3_client.get_object(Bucket=S3_DOCS, Key=f'{application_form}/prompts/{application_form}_application_writing_prompt.txt')
-        application_writing_prompt = response['Body'].read().decode('utf-8')
+        application_writing_prompt = read_asset(f'{application_form}/prompts/{application_form}_application_writing_prompt.txt').decode('utf-8')
     except Exception as e:
         print(f"{application_form}_application_writing_prompt.txt not found. Check existence of prompt.")
-        return error_response(400, f'Application prompt not found: {str(e)}')
+        return None, error_response(400, f'Application prompt not found: {str(e)}')
+    if ASSET_CACHE:
+        print(f"Asset cache (container totals): {json.dumps(asset_cache.stats)}")
 
     # Stitch retrieved contents, the questions and the section
     print("Stitch retrieved contents, the questions and the section")
-    enriched_data = []
     for enrich in enriched_questions:
-        try:
-            section = enrich['section']
-            question = enrich['question']
-            context = enrich['context']
-        except:
-            return error_response(400, f'{json.dumps(enrich, indent=2)}')
-
-        format = f"Section: {section}\nQuestion: {question}\nContext: {context}"
-        enriched_data.append(format)
+        if 'section' not in enrich or 'question' not in enrich:
+            return None, error_response(400, f'{json.dumps(enrich, indent=2)}')
 
-    enriched_text = "\n\n".join(enriched_data)
+    # Each distinct chunk is emitted once and referenced by id from every question,
+    # and only as many chunks as fit the form's input-token budget are kept
+    exact_counter = None
+    if form_config.get('exactTokenCheck'):
+        # Through the estimator's LRU, so repeated counts (the system prompt, a re-pack)
+        # are free and every network count becomes a calibration sample.
+        exact_counter = lambda text: default_estimator.count_exact(
+            MODEL_ID, text,
+            counter=lambda model_id, content: get_limiter('count_tokens').call(
+                count_tokens_exact, bedrock_runtime_client, model_id, content))
+    packer = ContextPacker(budget=form_config.get('inputTokenBudget', DEFAULT_INPUT_TOKEN_BUDGET),
+                           system_prompt=application_writing_prompt,
+                           estimator=lambda text: default_estimator.estimate(MODEL_ID, text),
+                           exact_counter=exact_counter,
+                           batch_estimator=lambda texts: default_estimator.estimate_batch(MODEL_ID, texts))
+    generation_mode = form_config.get('generationMode', DEFAULT_GENERATION_MODE)
+    stream_output = form_config.get('streamOutput', STREAM_OUTPUT)
+    draft_filename = f"{username}_{year}_{application_form}_draft.md"
+    draft_status = None
+    cache_stats = PromptCacheStats()
+    force = bool(body.get('forceRegenerate', False))
+    generation_cache = None if force else open_generation_cache()
 
     # Generate final completed application form
-    print("Generate final completed application form")
+    print(f"Generate final completed application form ({generation_mode} mode)")
+    job.stage('generation')
     try:
-        completed_application_form = generate_application_form(document_bytes, enriched_text, application_writing_prompt)
-
-        try:
-            # Convert markdown to docx using pypandoc
-            temp_docx = '/tmp/output.docx'
-            pypandoc.convert_text(
-                    source=completed_application_form,
-                    to='docx',
-                    format='md',
-                    outputfile=temp_docx
-                )
-            s3_client.upload_file(temp_docx, S3_FILLED, f'{username}/{year}/{username}_{year}_{application_form}_completed.docx')
-
-        except Exception as s3_error:
-            print(f"Warning: Could not save form to S3: {str(s3_error)}")
-            return error_response(400, f"Warning: Could not save form to S3: {str(s3_error)}")
-        return success_response({
-            'message': 'Application form completed',
-            'username': username,
-            'applicationForm': application_form,
-            'generatedAt': f'{date.today()}',
-            'filename': f"{username}_{year}_{application_form}_completed.docx"
-        })
+        if generation_mode == 'section':
+            # Sections whose inputs did not change since the last run are reused
+            # unless the request asks for a full regeneration.
+            completed_application_form, chunk_stats = generate_application_form_by_section(
+                template,
+                enriched_questions,
+                application_writing_prompt,
+                packer,
+                max_tokens=form_config.get('sectionMaxTokens', DEFAULT_SECTION_MAX_TOKENS),
+                cache_stats=cache_stats,
+                manifest_key=f'{username}/{year}/{username}_{year}_{application_form}_sections.json',
+                force=force,
+                generation_cache=generation_cache,
+                # Same calibrated estimate the packer sized the chunks with
+                router=ModelRouter.from_config(MODEL_ID, form_config.get('modelRouting'), estimator=packer.estimator),
+                on_progress=job.progress)
+        else:
+            enriched_text, chunk_stats = build_enriched_text(enriched_questions, packer=packer)
+            print(f"Chunk dedup: {chunk_stats['unique_chunks']} unique of {chunk_stats['chunk_references']} retrieved chunks, "
+                  f"~{chunk_stats['saved_tokens']} input tokens saved ({chunk_stats['saved_ratio']:.1%})")
+            if stream_output:
+                completed_application_form, draft_status = generate_application_form_streaming(
+                    template,
+                    enriched_text,
+                    application_writing_prompt,
+                    draft_key=f'{username}/{year}/{draft_filename}',
+                    deadline=stream_deadline(context),
+                    cache_stats=cache_stats,
+                    generation_cache=generation_cache)
+            else:
+                completed_application_form = generate_application_form(template, enriched_text, application_writing_prompt,
+                                                                        cache_stats=cache_stats,
+                                                                        generation_cache=generation_cache)
+        report_prompt_cache(application_form, cache_stats)
     except Exception as e:
         print(f"Error in lambda_handler: {str(e)}")
-        return error_response(500, f'Internal server error: {str(e)}')
+        return None, error_response(500, f'Internal server error: {str(e)}')
+
+    generated = {
+        'markdown': completed_application_form,
+        'chunkStats': chunk_stats,
+        'promptCache': cache_stats.as_dict(),
+        'draftStatus': draft_status
+    }
+    # A draft cut off by the deadline is still converted, but a retry should
+    # generate the form again rather than resume from it.
+    if draft_status in (None, 'complete'):
+        checkpoints.save('generation', generated)
+    return generated, None
 
-def generate_application_form(document_bytes, enriched_text, application_writing_prompt):
+def open_checkpoints(username, year, run_id):
+    """
+    Checkpoints of the run, or a no-op stand-in when the run has no id.
+    """
+    if not run_id:
+        return NoCheckpoints()
+    return RunCheckpoints(s3_client, S3_FILLED, run_prefix(username, year, run_id))
+
+def read_asset(key):
+    """
+    Bytes of an object in S3_DOCS, served from the warm-container asset cache when
+    ASSET_CACHE is on.
+    """
+    if ASSET_CACHE:
+        return asset_cache.get(key)[0]
+    return s3_client.get_object(Bucket=S3_DOCS, Key=key)['Body'].read()
+
+def load_template(application_form, skeleton=TEMPLATE_SKELETON):
+    """
+    Load the application form template for the generation prompt. With
+    skeleton on (TEMPLATE_SKELETON or the form's templateSkeleton), the skeleton compiled for the current template ETag is
+    used, and the docx is only downloaded when it has to be (re)compiled. If
+    compiling fails the raw docx bytes are returned instead.
+
+    With ASSET_CACHE on, the docx is kept in the warm container and the skeleton is
+    resolved once per template ETag.
+    """
+    key = template_key(application_form)
+    if not skeleton:
+        return read_asset(key)
+
+    if ASSET_CACHE:
+        return asset_cache.get_derived(key, 'skeleton',
+                                       lambda document_bytes, etag: template_for_prompt(application_form, document_bytes, etag))
+
+    etag = s3_client.head_object(Bucket=S3_DOCS, Key=key)['ETag']
+    stored = load_skeleton(s3_client, S3_DOCS, application_form, etag)
+    if stored is not None:
+        print(f"Using template skeleton for ETag {etag}")
+        return stored
+
+    response = s3_client.get_object(Bucket=S3_DOCS, Key=key)
+    # Key the skeleton by the ETag of the bytes actually compiled.
+    return template_for_prompt(application_form, response['Body'].read(), response['ETag'], skeleton_checked=True)
+
+def template_for_prompt(application_form, document_bytes, etag, skeleton_checked=False):
+    """
+    Skeleton for the template version with this ETag: the stored one if there is
+    one, otherwise compiled from document_bytes and stored. Falls back to the docx
+    bytes if compiling fails.
+    """
+    if not skeleton_checked:
+        skeleton = load_skeleton(s3_client, S3_DOCS, application_form, etag)
+        if skeleton is not None:
+            print(f"Using template skeleton for ETag {etag}")
+            return skeleton
+
+    try:
+        start = time.time()
+        sections, skeleton = compile_skeleton(document_bytes)
+        store_skeleton(s3_client, S3_DOCS, application_form, etag, sections, skeleton)
+        print(f"Compiled template skeleton in {time.time() - start:.1f}s: {len(sections)} sections, "
+              f"{len(skeleton)} characters from {len(document_bytes)} bytes of docx")
+        return skeleton
+    except Exception as e:
+        print(f"Warning: Could not compile template skeleton, sending the docx: {str(e)}")
+        return document_bytes
+
+def upload_outputs(outputs, key_prefix):
+    """
+    Stream every rendered format from memory to S3_FILLED as {key_prefix}.{format},
+    all at once, each in parts if it is larger than one part.
+    """
+    config = s3_transfer.TransferConfig(multipart_threshold=UPLOAD_PART_BYTES,
+                                        multipart_chunksize=UPLOAD_PART_BYTES,
+                                        max_concurrency=UPLOAD_MAX_CONCURRENCY)
+    def upload(output):
+        s3_client.upload_fileobj(BytesIO(outputs[output]), S3_FILLED, f'{key_prefix}.{output}',
+                                 ExtraArgs={'ContentType': CONTENT_TYPES[output]},
+                                 Config=config)
+    with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+        list(executor.map(upload, outputs))
+
+def fill_template(application_form, markdown):
+    """
+    The form's template docx with the answers in markdown written into it, or None
+    if no answer could be placed and the markdown should be converted instead. The
+    template's slots are located once per template ETag when ASSET_CACHE is on.
+    """
+    key = template_key(application_form)
+    try:
+        if ASSET_CACHE:
+            filler = asset_cache.get_derived(key, 'filler', lambda document_bytes, etag: TemplateFiller(document_bytes))
+        else:
+            filler = TemplateFiller(read_asset(key))
+        buffer, stats = filler.fill(markdown)
+    except Exception as e:
+        print(f"Warning: Could not fill the template, converting the markdown instead: {str(e)}")
+        return None
+    print(f"Template fill: {stats['filled']} answers placed, {stats['fields']} fields in {stats['slots']} slots")
+    if not stats['filled']:
+        return None
+    return buffer.getvalue()
+
+def load_form_config(application_form):
+    """
+    Load per-form settings from S3_DOCS. Missing config means defaults for everything.
+    """
+    try:
+        return json.loads(read_asset(f'{application_form}/config/{application_form}_config.json'))
+    except Exception as e:
+        print(f"{application_form}_config.json not found, using defaults: {str(e)}")
+        return {}
+
+def build_converse_request(template, enriched_text, application_writing_prompt, max_tokens=MAX_OUTPUT_TOKENS, model_id=MODEL_ID):
+    """
+    Keyword arguments shared by converse and converse_stream. With PROMPT_CACHE on,
+    cache points follow the system prompt and the template document, so only
+    enriched_text is processed from scratch once the prefix is cached.
+    """
+    cache_point = [CACHE_POINT] if PROMPT_CACHE else []
+    if isinstance(template, str):
+        template_block = {'text': f"Application form template (sections, questions and field limits):\n\n{template}"}
+    else:
+        template_block = {
+            'document': {
+                'format': 'docx',
+                'name': 'CanExport Application Form',
+                'source': {
+                    'bytes': template
+                }
+            }
+        }
+    return {
+        'modelId': model_id,
+        'messages': [
+            {
+                'role': 'user',
+                'content': [
+                    template_block,
+                    *cache_point,
+                    {
+                        'text': enriched_text
+                    }
+                ]
+            }
+        ],
+        'system': [
+            {
+                'text': application_writing_prompt
+            },
+            *cache_point
+        ],
+        'inferenceConfig': {
+            'maxTokens': max_tokens
+        }
+    }
+
+def generate_application_form(template, enriched_text, application_writing_prompt, max_tokens=MAX_OUTPUT_TOKENS, cache_stats=None, generation_cache=None, model_id=MODEL_ID):
     """
     Generate the application form based on the form type.
     This function contains templates for different application types.
     
     Replace the placeholder content with actual data extracted from your knowledge base.
+    An identical earlier request is answered from generation_cache without calling the model.
+    """
+    request = build_converse_request(template, enriched_text, application_writing_prompt, max_tokens, model_id)
+    if generation_cache is not None:
+        cached = generation_cache.get(request)
+        if cached is not None:
+            return cached
+
+    text, stop_reason = converse_with_continuation(
+        lambda **kwargs: get_limiter('converse').call(bedrock_runtime_client.converse, **kwargs),
+        request,
+        max_continuations=MAX_CONTINUATIONS,
+        on_response=lambda response: cache_stats.record(response.get('usage')) if cache_stats is not None else None)
+    # Truncated replies are not worth replaying.
+    if generation_cache is not None and stop_reason == 'end_turn':
+        generation_cache.put(request, text, stop_reason)
+    return text
+
+def stream_deadline(context):
+    """
+    Wall-clock time after which streaming stops, or None when not running in Lambda.
+    """
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return time.time() + context.get_remaining_time_in_millis() / 1000 - STREAM_DEADLINE_RESERVE_SECONDS
+
+def generate_application_form_streaming(template, enriched_text, application_writing_prompt, draft_key, deadline=None, max_tokens=MAX_OUTPUT_TOKENS, cache_stats=None, generation_cache=None):
+    """
+    Same as generate_application_form, but the reply is streamed into a draft
+    markdown in S3_FILLED as it is generated.
+
+    Args:
+        draft_key: Key of the draft markdown in S3_FILLED
+        deadline: time.time() after which generation stops and the draft is saved as partial
+        cache_stats: PromptCacheStats to record token usage into
+        generation_cache: GenerationCache; a hit is written to the draft in one piece
+
+    Returns:
+        Completed application form as markdown, and the draft status ('complete' or 'partial')
     """
+    request = build_converse_request(template, enriched_text, application_writing_prompt, max_tokens)
+    if generation_cache is not None:
+        cached = generation_cache.get(request)
+        if cached is not None:
+            s3_client.put_object(Bucket=S3_FILLED, Key=draft_key, Body=cached.encode('utf-8'), ContentType='text/markdown')
+            return cached, 'complete'
 
-    completed_application_form = bedrock_runtime_client.converse(modelId=MODEL_ID,
-                                                messages=[
-                                                    {
-                                                        'role': 'user',
-                                                        'content': [
-                                                            {
-                                                                'document':{
-                                                                    'format': 'docx',
-                                                                    'name': 'CanExport Application Form',
-                                                                    'source': {
-                                                                        'bytes': document_bytes
-                                                                    }
-                                                                }
-                                                            },
-                                                            {
-                                                                'text': enriched_text
-                                                            }
-                                                        ]
-                                                    }
-                                                ],
-                                                system=[
-                                                    {
-                                                        'text': application_writing_prompt
-                                                    }
-                                                ],
-                                                inferenceConfig={
-                                                    'maxTokens': 63000
-                                                })
-    return completed_application_form['output']['message']['content'][0]['text']
-
-
-def success_response(data):
+    with S3StreamWriter(s3_client, S3_FILLED, draft_key) as writer:
+        stop_reason = 'max_tokens'
+        rounds = 0
+        # Text already streamed cannot be taken back, so a continuation picks up
+        # exactly where the stream stopped rather than at the last complete block.
+        while stop_reason == 'max_tokens' and rounds <= MAX_CONTINUATIONS:
+            round_request = with_prefill(request, writer.text) if rounds else request
+            response = get_limiter('converse').call(bedrock_runtime_client.converse_stream, **round_request)
+            stop_reason, usage = consume_converse_stream(response, writer, deadline=deadline)
+            print(f"Stream finished: stopReason={stop_reason}, usage={usage}")
+            if cache_stats is not None:
+                cache_stats.record(usage)
+            rounds += 1
+        writer.close('partial' if stop_reason in ('deadline', 'max_tokens') else 'complete')
+    if generation_cache is not None and stop_reason == 'end_turn':
+        generation_cache.put(request, writer.text, stop_reason)
+    return writer.text, writer.status
+
+def generation_salt(template, application_writing_prompt, max_tokens, router=None):
+    """
+    Hash of the run-wide generation inputs that every section fingerprint depends on.
+    """
+    template_bytes = template.encode('utf-8') if isinstance(template, str) else template
+    routing = router.describe() if router is not None else None
+    payload = json.dumps([MODEL_ID, application_writing_prompt, hashlib.sha256(template_bytes).hexdigest(), max_tokens, routing],
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def generate_application_form_by_section(template, enriched_questions, application_writing_prompt, packer, max_tokens=DEFAULT_SECTION_MAX_TOKENS, cache_stats=None, manifest_key=None, force=False, generation_cache=None, router=None, on_progress=None):
+    """
+    Generate every section with its own converse call, concurrently, and stitch the
+    sections back together in template order. With manifest_key, sections whose
+    fingerprint matches the previous run in S3_FILLED are spliced in unchanged and
+    only the others are generated.
+
+    Args:
+        template: Application form template (skeleton text or docx bytes)
+        enriched_questions: Output of the retrieval step
+        application_writing_prompt: System prompt
+        packer: ContextPacker applied to each section's evidence
+        max_tokens: Output token limit per section
+        cache_stats: PromptCacheStats that every section call records into
+        manifest_key: Key in S3_FILLED of the section manifest of the previous run
+        force: Regenerate every section even if its fingerprint is unchanged
+        generation_cache: GenerationCache consulted for every section call
+        router: ModelRouter choosing the model per section, None for MODEL_ID everywhere
+
+    Returns:
+        Completed application form as markdown, and chunk stats and model per regenerated section
+    """
+    sections = group_by_section(enriched_questions)
+    positions = {section: position for position, (section, _) in enumerate(sections, start=1)}
+    chunk_stats = {}
+
+    previous = None
+    if manifest_key and not force:
+        previous = load_manifest(s3_client, S3_FILLED, manifest_key)
+    to_generate, reused, fingerprints = plan_regeneration(
+        sections, previous, generation_salt(template, application_writing_prompt, max_tokens, router))
+    print(f"Regenerating {len(to_generate)} of {len(sections)} sections, reusing {len(reused)}")
+
+    def generate_section(section, section_questions, position):
+        model_id, route = router.route(section, section_questions) if router is not None else (MODEL_ID, 'default')
+        enriched_text, stats = build_enriched_text(section_questions, packer=packer)
+        chunk_stats[section] = {**stats, 'model': model_id, 'route': route}
+        enriched_text += "\n\n" + section_instruction(section, position, len(sections))
+        return generate_application_form(template, enriched_text, application_writing_prompt,
+                                         max_tokens=max_tokens, cache_stats=cache_stats,
+                                         generation_cache=generation_cache, model_id=model_id)
+
+    start = time.time()
+    generated = generate_sections(to_generate, generate_section, max_workers=SECTION_MAX_WORKERS, positions=positions,
+                                  on_progress=on_progress)
+    print(f"Generated {len(generated)} sections in {time.time() - start:.1f}s "
+          f"(slowest {max((r['seconds'] for r in generated), default=0):.1f}s, "
+          f"sum {sum(r['seconds'] for r in generated):.1f}s)")
+
+    by_section = {**reused, **{result['section']: result for result in generated}}
+    results = [by_section[section] for section, _ in sections]
+    if manifest_key:
+        try:
+            store_manifest(s3_client, S3_FILLED, manifest_key, build_manifest(results, fingerprints))
+        except Exception as e:
+            print(f"Warning: Could not store section manifest: {str(e)}")
+    return stitch_sections(results), {section: chunk_stats[section] for section, _ in to_generate}
+
+
+def report_prompt_cache(application_form, cache_stats):
+    """
+    Log this run's prompt cache usage and add it to the form's totals across users.
+    """
+    print(f"Prompt cache: {json.dumps(cache_stats.as_dict())}")
+    try:
+        totals = update_stats_s3(s3_client, S3_DOCS, f'{PROMPT_CACHE_STATS_PREFIX}/{application_form}.json', cache_stats)
+        print(f"Prompt cache hit rate across users for {application_form}: {totals['hitRate']:.1%} over {totals['requests']} requests")
+    except Exception as e:
+        print(f"Warning: Could not update prompt cache stats: {str(e)}")
+
+def submit_job(body, context):
+    """
+    Record a queued job and start the worker invocation. Returns 202 with the job
+    id; the frontend polls the job status Lambda with it.
+    """
+    job_id = new_job_id()
+    job = JobStatus(s3_client, S3_FILLED, job_id)
+    job.queue({'username': body.get('username'),
+               'applicationForm': body.get('applicationForm'),
+               'year': body.get('year', date.today().year)})
+    try:
+        lambda_client.invoke(FunctionName=context.invoked_function_arn,
+                             InvocationType='Event',
+                             Payload=json.dumps({'jobId': job_id, 'body': {**body, 'async': False}}, default=str))
+    except Exception as e:
+        print(f"Could not start job {job_id}: {str(e)}")
+        job.finish('failed', error=f'Could not start job: {str(e)}')
+        return error_response(500, f'Could not start job: {str(e)}')
+    print(f"Accepted job {job_id}")
+    return success_response({
+        'message': 'Application form job accepted',
+        'jobId': job_id,
+        'status': 'queued',
+        'username': body.get('username'),
+        'applicationForm': body.get('applicationForm')
+    }, status_code=202)
+
+def run_job(job_id, body, context):
+    """
+    Worker side of an async job: run the completion and record its outcome.
+    """
+    job = JobStatus(s3_client, S3_FILLED, job_id, record=read_job(s3_client, S3_FILLED, job_id))
+    try:
+        # The job id doubles as run id, so a re-run of the job resumes from its checkpoints.
+        response = complete_application_form(body, context, job, run_id=body.get('runId') or job_id)
+    except Exception as e:
+        print(f"Error in job {job_id}: {str(e)}")
+        job.finish('failed', error=f'Internal server error: {str(e)}')
+        return error_response(500, f'Internal server error: {str(e)}')
+    data = json.loads(response['body'])
+    if response['statusCode'] == 200:
+        job.finish('succeeded', result=data)
+    else:
+        job.finish('failed', error=data.get('error'))
+    return response
+
+def success_response(data, status_code=200):
     """
     Return a successful response with proper CORS headers.
     """
     return {
-        'statusCode': 200,
+        'statusCode': status_code,
         'headers': {
             'Content-Type': 'application/json',
             'Access-Control-Allow-Origin': '*',
@@ -205,187 +779,88 @@ def error_response(status_code, message):
         'body': json.dumps({'error': message})
     }
 
-class ProgressTracker:
-    def __init__(self, total):
-        self.total = total
-        self.completed = 0
-        self.failed = 0
-        self.lock = Lock()
-    
-    def increment_completed(self):
-        with self.lock:
-            self.completed += 1
-            print(f"Progress: {self.completed}/{self.total} completed, {self.failed} failed")
-    
-    def increment_failed(self):
-        with self.lock:
-            self.failed += 1
-
-def retrieve_with_retry(question_text: str, user: str, year: int, max_retries: int = 3) -> Dict:
+def retrieve_all_contexts_concurrent(questions: List[Dict], user: str, year: int, max_in_flight: int = MAX_IN_FLIGHT, on_progress=None) -> List[Dict]:
     """
-    Retrieve from Knowledge Base with exponential backoff retry logic.
+    Retrieve contexts for all questions concurrently on a single event loop.
     
     Args:
-        question_text: The question to retrieve context for
-        max_retries: Maximum number of retry attempts
+        questions: List of dicts with 'id', 'section' and 'question' keys
+        max_in_flight: Maximum number of concurrent retrieve calls
+        on_progress: Optional callback with (questions done, total)
         
     Returns:
-        Dict containing retrieval results
+        List of enriched question dicts with retrieved context, sorted by id
     """
-    for attempt in range(max_retries):
-        try:
-            response = bedrock_agent.retrieve(
-                knowledgeBaseId=KB_ID,
-                retrievalQuery={'text': question_text},
-                retrievalConfiguration={
-                    'vectorSearchConfiguration': {
-                        'numberOfResults': NUM_RESULTS_PER_QUERY,
-                        'filter': {
-                            'andAll': [
-                                {
-                                    'equals': {
-                                        'key': 'username',
-                                        'value': user
-                                    }
-                                },
-                                {
-                                    'equals': {
-                                        'key': 'year',
-                                        'value': year
-                                    }
-                                }
-                            ]
-                        }
-                    }
-                }
-            )
-            return response
-            
-        except ClientError as e:
-            error_code = e.response['Error']['Code']
-            
-            if error_code == 'ThrottlingException' and attempt < max_retries - 1:
-                # Exponential backoff with jitter
-                wait_time = (2 ** attempt) + (0.1 * (attempt + 1))
-                print(f"Throttled. Waiting {wait_time:.2f}s before retry {attempt + 1}...")
-                time.sleep(wait_time)
-            else:
-                print(f"Error: {e}")
-                raise
-    
-    raise Exception(f"Max retries ({max_retries}) exceeded for question: {question_text}")
+    return retrieve_all_contexts(questions,
+                                 user=user,
+                                 kb_id=KB_ID,
+                                 year=year,
+                                 number_of_results=NUM_RESULTS_PER_QUERY,
+                                 max_in_flight=max_in_flight,
+                                 limiter=get_limiter('retrieve'),
+                                 on_progress=on_progress)
 
-def retrieve_context_for_question(question_item: Dict, progress: ProgressTracker, user: str, year: int) -> Dict:
+def open_retrieval_cache():
     """
-    Retrieve context for a single question with error handling.
-    
-    Args:
-        question_item: Dict with 'id' and 'question' keys
-        progress: Progress tracker for monitoring
-        
-    Returns:
-        Dict with question ID, text, context, and metadata
+    Build the retrieval cache for the configured backend, or None if caching is off
+    or the knowledge base has no recorded ingestion version yet.
     """
-    question_id = question_item['id']
-    question_text = question_item['question']
-    
-    try:
-        # Retrieve from Knowledge Base
-        response = retrieve_with_retry(question_text, user, year)
-        
-        # Extract context chunks
-        context_chunks = []
-        sources = []
-        
-        for result in response.get('retrievalResults', []):
-            content = result.get('content', {})
-            if content.get('text'):
-                context_chunks.append(content['text'])
-                
-                # Extract source information
-                location = result.get('location', {})
-                if location.get('s3Location'):
-                    sources.append({
-                        'uri': location['s3Location'].get('uri', ''),
-                        'score': result.get('score', 0)
-                    })
-        
-        # Combine all chunks
-        combined_context = '\n\n---\n\n'.join(context_chunks)
-        
-        progress.increment_completed()
-        
-        return {
-            'id': question_id,
-            'section': question_item['section'],
-            'question': question_text,
-            'context': combined_context,
-            'sources': sources,
-            'num_chunks': len(context_chunks),
-            'status': 'success'
-        }
-        
-    except Exception as e:
-        error_msg = str(e)
-        print(f"ERROR for question {question_id}: {error_msg}")
-        
-        progress.increment_failed()
-        
-        return {
-            'id': question_id,
-            'question': question_text,
-            'context': '',
-            'error': error_msg,
-            'status': 'failed'
-        }
+    if RETRIEVAL_CACHE_BACKEND == 'none':
+        return None
+
+    ingestion_version = read_ingestion_version(s3_client, S3_DOCS, KB_ID)
+    if not ingestion_version:
+        return None
+
+    if RETRIEVAL_CACHE_BACKEND == 'local':
+        backend = LocalDiskCacheBackend(f'/tmp/retrieval-cache/{KB_ID}', ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS)
+    else:
+        backend = S3CacheBackend(s3_client, S3_DOCS, entries_prefix(KB_ID), ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS)
+    return RetrievalCache(backend, KB_ID, ingestion_version)
 
-def retrieve_all_contexts_concurrent(questions: List[Dict], user: str, year: int, max_workers: int = 15) -> List[Dict]:
+def open_generation_cache():
     """
-    Retrieve contexts for all questions using concurrent threads.
-    
-    Args:
-        questions: List of dicts with 'id' and 'question' keys
-        max_workers: Maximum number of concurrent threads (default 15 to stay under 20 RPS)
-        
-    Returns:
-        List of enriched question dicts with retrieved context
+    Build the generation cache for the configured backend, or None if it is off.
     """
-    print(f"\n{'='*60}")
-    print(f"Starting concurrent retrieval for {len(questions)} questions")
-    print(f"Max workers: {max_workers}")
-    print(f"Rate limit: 20 requests/second")
-    print(f"{'='*60}\n")
-    
-    start_time = time.time()
-    progress = ProgressTracker(len(questions))
-    enriched_questions = []
-    
-    # Use ThreadPoolExecutor for concurrent API calls
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        future_to_question = {
-            executor.submit(retrieve_context_for_question, q, progress, user, year): q 
-            for q in questions
-        }
-        
-        # Collect results as they complete
-        for future in as_completed(future_to_question):
-            result = future.result()
-            enriched_questions.append(result)
-    
-    # Sort by original question ID to maintain order
-    enriched_questions.sort(key=lambda x: x['id'])
-    
-    elapsed_time = time.time() - start_time
-    
-    # Print summary
-    print(f"\n{'='*60}")
-    print(f"Retrieval Complete!")
-    print(f"Total questions: {len(questions)}")
-    print(f"Successful: {progress.completed}")
-    print(f"Failed: {progress.failed}")
-    print(f"Time elapsed: {elapsed_time:.2f} seconds")
-    print(f"Average time per question: {elapsed_time/len(questions):.2f} seconds")
-    print(f"{'='*60}\n")
-    
-    return enriched_questions
\ No newline at end of file
+    if GENERATION_CACHE_BACKEND == 'none':
+        return None
+    if GENERATION_CACHE_BACKEND == 'local':
+        backend = LocalDiskCacheBackend('/tmp/generation-cache',
+                                        ttl_seconds=GENERATION_CACHE_TTL_SECONDS,
+                                        max_bytes=GENERATION_CACHE_MAX_BYTES)
+    else:
+        backend = S3CacheBackend(s3_client, S3_DOCS, generation_entries_prefix(MODEL_ID),
+                                 ttl_seconds=GENERATION_CACHE_TTL_SECONDS,
+                                 max_bytes=GENERATION_CACHE_MAX_BYTES)
+    return GenerationCache(backend)
+
+def retrieve_all_contexts_cached(questions: List[Dict], user: str, year: int, on_progress=None) -> List[Dict]:
+    """
+    Serve retrievals from the cache and only call the knowledge base for misses.
+    Same contract as retrieve_all_contexts_concurrent.
+    """
+    try:
+        cache = open_retrieval_cache()
+    except Exception as e:
+        print(f"Warning: Could not open retrieval cache: {str(e)}")
+        cache = None
+    if cache is None:
+        return retrieve_all_contexts_concurrent(questions, user=user, year=year, on_progress=on_progress)
+
+    cached, missing = cache.lookup(questions, user, year)
+    print(f"Retrieval cache: {len(cached)} hits, {len(missing)} misses (ingestion {cache.ingestion_version})")
+
+    if on_progress is not None:
+        on_progress(len(cached), len(questions))
+    fresh = retrieve_all_contexts_concurrent(
+        missing, user=user, year=year,
+        on_progress=(lambda done, total: on_progress(len(cached) + done, len(questions))) if on_progress else None
+    ) if missing else []
+    try:
+        cache.store(fresh, user, year)
+    except Exception as e:
+        print(f"Warning: Could not store retrievals in cache: {str(e)}")
+
+    cached_ids = {item['id'] for item in cached}
+    fresh = cache.expand(fresh, [q for q in questions if q['id'] not in cached_ids], user, year)
+    return sorted(cached + fresh, key=lambda x: x['id'])
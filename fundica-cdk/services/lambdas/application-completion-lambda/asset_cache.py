@@ -0,0 +1,145 @@
+"""
+Warm-container cache of per-form assets in S3_DOCS.
+
+Every run reads the same few objects for its application form: the template docx,
+the questions JSON, the writing prompt and the form config. AssetCache keeps their
+bytes and ETags at module level, so a warm container reuses them across
+invocations, and checks S3 for a newer version at most once per revalidate_seconds
+with a conditional GET (IfNoneMatch). An unchanged object costs one 304 with no
+body; inside the interval it costs no request at all.
+
+Assets are also mirrored to /tmp with their ETag and last check time, so a
+re-initialised handler module in the same execution environment starts warm
+instead of downloading everything again.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Optional,
+    Tuple
+)
+
+def _is_not_modified(error: Exception) -> bool:
+    response = getattr(error, 'response', None) or {}
+    return (response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304
+            or response.get('Error', {}).get('Code') in ('304', 'NotModified'))
+
+class AssetCache:
+    def __init__(self,
+                 s3_client: Any,
+                 bucket: str,
+                 revalidate_seconds: float = 60,
+                 mirror_dir: Optional[str] = '/tmp/asset-cache'):
+        """
+        Parameters:
+            s3_client (Any): S3 client.
+            bucket (str): Bucket the assets are read from.
+            revalidate_seconds (float): How long a cached asset is served without asking S3.
+                                        0 revalidates on every read.
+            mirror_dir (Optional[str]): Directory the assets are mirrored to, None to keep them in memory only.
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.revalidate_seconds = revalidate_seconds
+        self.mirror_dir = mirror_dir
+        self._entries: Dict[str, Dict] = {}
+        self._derived: Dict[Tuple[str, str, str], Any] = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'notModified': 0, 'downloads': 0}
+
+    def _mirror_path(self, key: str) -> str:
+        name = hashlib.sha256(f"{self.bucket}/{key}".encode('utf-8')).hexdigest()
+        return os.path.join(self.mirror_dir, name)
+
+    def _read_mirror(self, key: str) -> Optional[Dict]:
+        if not self.mirror_dir:
+            return None
+        path = self._mirror_path(key)
+        try:
+            with open(path + '.json', 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(path + '.bin', 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get('key') != key or meta.get('size') != len(body):
+            return None
+        return {'body': body, 'etag': meta['etag'], 'checked': meta.get('checked', 0.0)}
+
+    def _write_mirror(self, key: str, entry: Dict) -> None:
+        if not self.mirror_dir:
+            return
+        try:
+            os.makedirs(self.mirror_dir, exist_ok=True)
+            path = self._mirror_path(key)
+            # Temp names are unique per thread so concurrent writers never share one.
+            suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+            # Body first: a metadata file always describes a complete body.
+            with open(path + '.bin' + suffix, 'wb') as f:
+                f.write(entry['body'])
+            os.replace(path + '.bin' + suffix, path + '.bin')
+            with open(path + '.json' + suffix, 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'etag': entry['etag'], 'checked': entry['checked'],
+                           'size': len(entry['body'])}, f)
+            os.replace(path + '.json' + suffix, path + '.json')
+        except OSError as e:
+            print(f"Warning: Could not mirror asset {key} to {self.mirror_dir}: {str(e)}")
+
+    def get(self, key: str) -> Tuple[bytes, str]:
+        """
+        Body and ETag of an asset, revalidated if the last check is older than
+        revalidate_seconds. Errors other than 304 (e.g. NoSuchKey) are raised.
+        """
+        with self._lock:
+            entry = self._entries.get(key) or self._read_mirror(key)
+            now = time.time()
+            if entry is not None and now - entry['checked'] < self.revalidate_seconds:
+                self._entries[key] = entry
+                self.stats['hits'] += 1
+                return entry['body'], entry['etag']
+
+            kwargs = {'Bucket': self.bucket, 'Key': key}
+            if entry is not None:
+                kwargs['IfNoneMatch'] = entry['etag']
+            try:
+                response = self.s3_client.get_object(**kwargs)
+            except Exception as e:
+                if entry is None or not _is_not_modified(e):
+                    raise
+                entry = {**entry, 'checked': now}
+                self.stats['notModified'] += 1
+            else:
+                entry = {'body': response['Body'].read(), 'etag': response['ETag'], 'checked': now}
+                self.stats['downloads'] += 1
+            self._entries[key] = entry
+            self._write_mirror(key, entry)
+            return entry['body'], entry['etag']
+
+    def get_derived(self, key: str, name: str, build: Callable[[bytes, str], Any]) -> Any:
+        """
+        Value built from an asset, e.g. a parsed JSON document. It is rebuilt only
+        when the asset's ETag changes.
+        """
+        body, etag = self.get(key)
+        derived_key = (key, name, etag)
+        if derived_key not in self._derived:
+            # Drop values built from older versions of the asset.
+            for stale in [k for k in self._derived if k[:2] == (key, name)]:
+                del self._derived[stale]
+            self._derived[derived_key] = build(body, etag)
+        return self._derived[derived_key]
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """
+        Force the next read of key (or of every asset) to revalidate.
+        """
+        with self._lock:
+            for cached_key, entry in self._entries.items():
+                if key is None or cached_key == key:
+                    entry['checked'] = 0.0
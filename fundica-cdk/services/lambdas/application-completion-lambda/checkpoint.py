@@ -0,0 +1,76 @@
+"""
+Stage checkpoints of a completion run.
+
+A run is one attempt at completing a form, identified by a run id: the Step
+Functions execution name, the async job id or a runId sent by the caller. Every
+retry of the same run (a Step Functions retry after a timeout, or a failed
+pypandoc conversion) carries the same id. As each stage finishes, its result is
+written to S3_FILLED under {username}/{year}/runs/{run_id}/:
+
+    enriched_questions.json  retrieved contexts of every question
+    generation.json          generated markdown and its stats
+    output.json              response of the finished run (the docx is uploaded)
+
+On re-entry the handler loads the latest completed checkpoint and skips every
+stage before it. A run without an id is not checkpointed.
+"""
+import json
+from typing import (
+    Any,
+    Optional
+)
+
+CHECKPOINT_STAGES = ('enriched_questions', 'generation', 'output')
+
+def run_prefix(username: str, year: Any, run_id: str) -> str:
+    return f"{username}/{year}/runs/{run_id}/"
+
+class RunCheckpoints:
+    def __init__(self, s3_client: Any, bucket: str, prefix: str):
+        """
+        Parameters:
+            s3_client (Any): S3 client object.
+            bucket (str): Bucket of the checkpoints (S3_FILLED).
+            prefix (str): Prefix of the run, see run_prefix.
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def key(self, stage: str) -> str:
+        return f"{self.prefix}{stage}.json"
+
+    def load(self, stage: str) -> Optional[Any]:
+        """
+        Result of a completed stage, or None if the stage has no checkpoint yet.
+        """
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key(stage))
+        except Exception as e:
+            if 'NoSuchKey' not in str(e) and 'Not Found' not in str(e):
+                print(f"Warning: Could not read checkpoint {self.key(stage)}: {str(e)}")
+            return None
+        print(f"Checkpoint found: {self.key(stage)}")
+        return json.loads(response['Body'].read())
+
+    def save(self, stage: str, value: Any) -> None:
+        """
+        Record a completed stage. A failed write only costs the retry that stage.
+        """
+        try:
+            self.s3_client.put_object(Bucket=self.bucket,
+                                      Key=self.key(stage),
+                                      Body=json.dumps(value, default=str),
+                                      ContentType='application/json')
+        except Exception as e:
+            print(f"Warning: Could not write checkpoint {self.key(stage)}: {str(e)}")
+
+class NoCheckpoints:
+    """
+    Stands in for RunCheckpoints on runs without a run id.
+    """
+    def load(self, stage: str) -> Optional[Any]:
+        return None
+
+    def save(self, stage: str, value: Any) -> None:
+        pass
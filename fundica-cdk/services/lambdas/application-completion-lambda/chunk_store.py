@@ -0,0 +1,160 @@
+"""
+Cross-question chunk deduplication for the generation prompt.
+
+Many questions retrieve the same knowledge base chunks, and pasting each question's
+full context into enriched_text repeats a chunk once per question. ChunkStore keeps
+one copy of every distinct chunk, identified by a hash of its whitespace-normalised
+text, and remembers every location URI it was retrieved from. The prompt then lists
+each chunk once under an id ([C1], [C2], ...) and each question refers to its
+chunks by id.
+"""
+import hashlib
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple
+)
+from token_estimator import default_estimator
+
+CHUNK_SEPARATOR = '\n\n---\n\n'
+
+def estimate_tokens(text: str, model_id: Optional[str] = None) -> int:
+    """
+    Local token estimate from token_estimator, calibrated for model_id when a
+    calibration exists and about four characters per token otherwise.
+    """
+    return default_estimator.estimate(model_id, text)
+
+def content_hash(text: str) -> str:
+    """
+    Hash of the chunk text with whitespace collapsed, so the same chunk extracted
+    with different line breaks still dedupes.
+    """
+    return hashlib.sha256(' '.join(text.split()).encode('utf-8')).hexdigest()
+
+def question_chunks(enriched_question: Dict) -> List[Dict]:
+    """
+    Per-chunk details of an enriched question. Entries cached before per-chunk
+    details were recorded only have the joined context, so fall back to splitting it.
+    """
+    if 'chunks' in enriched_question:
+        return enriched_question['chunks']
+    context = enriched_question.get('context', '')
+    return [{'text': text, 'uri': '', 'score': 0} for text in context.split(CHUNK_SEPARATOR) if text]
+
+class ChunkStore:
+    def __init__(self):
+        """
+        Distinct chunks in first-seen order, with the URIs, best score and sections seen for each.
+        """
+        self.chunks: Dict[str, Dict] = {}
+        self.references = 0
+
+    def add(self, text: str, uri: str = '', score: float = 0, section: Optional[str] = None) -> str:
+        """
+        Add a chunk and return its id. A chunk seen before returns the existing id.
+        """
+        self.references += 1
+        digest = content_hash(text)
+        chunk = self.chunks.get(digest)
+        if chunk is None:
+            chunk = {
+                'id': f"C{len(self.chunks) + 1}",
+                'hash': digest,
+                'text': text,
+                'uris': [],
+                'score': score,
+                'questions': 0,
+                'sections': []
+            }
+            self.chunks[digest] = chunk
+        if uri and uri not in chunk['uris']:
+            chunk['uris'].append(uri)
+        if section is not None and section not in chunk['sections']:
+            chunk['sections'].append(section)
+        chunk['score'] = max(chunk['score'], score)
+        chunk['questions'] += 1
+        return chunk['id']
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+def collect_chunks(enriched_questions: List[Dict]) -> Tuple[ChunkStore, List[Dict]]:
+    """
+    Dedupe the chunks of all enriched questions.
+
+    Returns:
+        store (ChunkStore): Every distinct chunk.
+        questions (List[Dict]): 'section', 'question' and 'chunk_ids' per question, in order.
+    """
+    store = ChunkStore()
+    questions = []
+    for enrich in enriched_questions:
+        chunk_ids = []
+        for chunk in question_chunks(enrich):
+            chunk_id = store.add(chunk['text'], chunk.get('uri', ''), chunk.get('score', 0), enrich['section'])
+            if chunk_id not in chunk_ids:
+                chunk_ids.append(chunk_id)
+        questions.append({'section': enrich['section'], 'question': enrich['question'], 'chunk_ids': chunk_ids})
+    return store, questions
+
+def render_evidence(chunk: Dict) -> str:
+    source = f" (source: {', '.join(chunk['uris'])})" if chunk['uris'] else ''
+    return f"[{chunk['id']}]{source}\n{chunk['text']}"
+
+def render_question(question: Dict, keep_ids: Optional[Set[str]] = None) -> str:
+    chunk_ids = [chunk_id for chunk_id in question['chunk_ids'] if keep_ids is None or chunk_id in keep_ids]
+    references = ', '.join(f"[{chunk_id}]" for chunk_id in chunk_ids) or 'None'
+    return f"Section: {question['section']}\nQuestion: {question['question']}\nContext: {references}"
+
+def render_enriched_text(store: ChunkStore, questions: List[Dict], keep_ids: Optional[Set[str]] = None) -> str:
+    """
+    Evidence block followed by one block per question. With keep_ids, only those
+    chunks are emitted and questions only reference those.
+    """
+    evidence_blocks = [render_evidence(chunk) for chunk in store.chunks.values()
+                       if keep_ids is None or chunk['id'] in keep_ids]
+    question_blocks = [render_question(question, keep_ids) for question in questions]
+    return "Evidence:\n\n" + "\n\n".join(evidence_blocks) + "\n\nQuestions:\n\n" + "\n\n".join(question_blocks)
+
+def build_enriched_text(enriched_questions: List[Dict], packer: Optional[Any] = None) -> Tuple[str, Dict]:
+    """
+    Build the generation prompt with every distinct chunk emitted once.
+
+    Parameters:
+        enriched_questions (List[Dict]): Output of the retrieval step.
+        packer (Optional[Any]): ContextPacker that decides which chunks fit the token budget.
+
+    Returns:
+        enriched_text (str): Evidence block followed by one block per question.
+        stats (Dict): Chunk counts and estimated tokens with and without deduplication.
+    """
+    store, questions = collect_chunks(enriched_questions)
+
+    keep_ids = None
+    pack_stats = {}
+    if packer is not None:
+        keep_ids, pack_stats = packer.pack(store, questions)
+
+    enriched_text = render_enriched_text(store, questions, keep_ids)
+    baseline_text = "\n\n".join(
+        f"Section: {enrich['section']}\nQuestion: {enrich['question']}\n"
+        f"Context: {CHUNK_SEPARATOR.join(chunk['text'] for chunk in question_chunks(enrich))}"
+        for enrich in enriched_questions
+    )
+
+    baseline_tokens = estimate_tokens(baseline_text)
+    deduped_tokens = estimate_tokens(enriched_text)
+    stats = {
+        'chunk_references': store.references,
+        'unique_chunks': len(store),
+        'baseline_tokens': baseline_tokens,
+        'deduped_tokens': deduped_tokens,
+        'saved_tokens': baseline_tokens - deduped_tokens,
+        'saved_ratio': round(1 - deduped_tokens / baseline_tokens, 3) if baseline_tokens else 0.0,
+        **pack_stats
+    }
+    return enriched_text, stats
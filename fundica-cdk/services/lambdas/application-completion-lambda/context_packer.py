@@ -0,0 +1,158 @@
+"""
+Token-budget-aware packing of retrieved chunks into the generation prompt.
+
+enriched_text grows with the user's corpus and can overflow the model window or
+inflate latency. ContextPacker keeps the prompt under an input-token budget that is
+configured per application form (inputTokenBudget in
+{form}/config/{form}_config.json). It works on the deduplicated chunks of a
+ChunkStore:
+
+1. Every question keeps its best chunk if it fits, so no question is left without evidence.
+2. The remaining chunks are added by priority: retrieval score, boosted by how many
+   sections use the chunk.
+
+Sizes come from a fast local estimate; all chunks are sized in one batch when a batch
+estimator is supplied. When an exact counter is supplied (Bedrock count_tokens,
+normally through TokenEstimator.count_exact so counts are cached and become
+calibration samples), the system prompt and the packed text are checked once and
+trimmed further if the estimate was optimistic. Every dropped chunk is logged.
+"""
+import math
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple
+)
+from chunk_store import (
+    estimate_tokens,
+    render_enriched_text,
+    render_evidence
+)
+from token_estimator import foundation_model_id
+
+def chunk_priority(chunk: Dict) -> float:
+    """
+    Retrieval score weighted by the number of sections that use the chunk. A chunk
+    that feeds several sections is worth more than an equally scored one-off.
+    """
+    return chunk['score'] * (1 + math.log(max(1, len(chunk['sections']))))
+
+def count_tokens_exact(bedrock_runtime_client: Any, model_id: str, text: str) -> int:
+    """
+    Exact input token count of text sent as a converse user message, from Bedrock
+    count_tokens. Matches the exact_counter signature of TokenEstimator once the
+    client is bound. count_tokens only accepts foundation model ids, so an
+    inference-profile id is mapped first.
+    """
+    response = bedrock_runtime_client.count_tokens(
+        modelId=foundation_model_id(model_id),
+        input={
+            'converse': {
+                'messages': [{'role': 'user', 'content': [{'text': text}]}]
+            }
+        }
+    )
+    return response['inputTokens']
+
+class ContextPacker:
+    def __init__(self,
+                 budget: int,
+                 system_prompt: str = '',
+                 estimator: Callable[[str], int] = estimate_tokens,
+                 exact_counter: Optional[Callable[[str], int]] = None,
+                 batch_estimator: Optional[Callable[[List[str]], List[int]]] = None):
+        """
+        Parameters:
+            budget (int): Input-token budget for the system prompt plus enriched_text.
+                          The template document block is fixed per form and is not counted.
+            system_prompt (str): Application writing prompt sent alongside enriched_text.
+            estimator (Callable[[str], int]): Fast local token estimate.
+            exact_counter (Optional[Callable[[str], int]]): Exact count of a text, used for the
+                                                         system prompt and the packed enriched_text.
+            batch_estimator (Optional[Callable[[List[str]], List[int]]]): Local estimates of many texts
+                                                                          at once, used to size the chunks.
+        """
+        self.budget = budget
+        self.system_prompt = system_prompt
+        self.estimator = estimator
+        self.exact_counter = exact_counter
+        self.batch_estimator = batch_estimator
+
+    def _select(self, store: Any, questions: List[Dict], budget: int) -> Tuple[Set[str], List[Dict]]:
+        chunks_by_id = {chunk['id']: chunk for chunk in store.chunks.values()}
+
+        # Prompt scaffolding and question blocks are always sent.
+        remaining = budget - self.estimator(self.system_prompt) - self.estimator(
+            render_enriched_text(store, questions, keep_ids=set()))
+        keep_ids: Set[str] = set()
+        evidence = [render_evidence(chunk) for chunk in chunks_by_id.values()]
+        estimates = self.batch_estimator(evidence) if self.batch_estimator is not None else map(self.estimator, evidence)
+        sizes = {chunk_id: size + 1 for chunk_id, size in zip(chunks_by_id, estimates)}
+
+        def take(chunk_id):
+            nonlocal remaining
+            if chunk_id in keep_ids or sizes[chunk_id] > remaining:
+                return
+            keep_ids.add(chunk_id)
+            # Each reference adds a few tokens to the question block too.
+            remaining -= sizes[chunk_id] + chunks_by_id[chunk_id]['questions'] * 2
+
+        # Pass 1: best chunk of every question.
+        for question in questions:
+            if question['chunk_ids']:
+                take(max(question['chunk_ids'], key=lambda chunk_id: chunk_priority(chunks_by_id[chunk_id])))
+
+        # Pass 2: everything else by priority; smaller chunks may still fit after a big one does not.
+        for chunk in sorted(chunks_by_id.values(), key=chunk_priority, reverse=True):
+            take(chunk['id'])
+
+        dropped = [chunk for chunk in chunks_by_id.values() if chunk['id'] not in keep_ids]
+        return keep_ids, dropped
+
+    def pack(self, store: Any, questions: List[Dict]) -> Tuple[Set[str], Dict]:
+        """
+        Choose the chunks to send.
+
+        Parameters:
+            store (ChunkStore): Deduplicated chunks.
+            questions (List[Dict]): Output of chunk_store.collect_chunks.
+
+        Returns:
+            keep_ids (Set[str]): Ids of the chunks to emit.
+            stats (Dict): Budget, estimated tokens, exact tokens if checked, dropped chunk count.
+        """
+        keep_ids, dropped = self._select(store, questions, self.budget)
+        estimated = self.estimator(self.system_prompt) + self.estimator(render_enriched_text(store, questions, keep_ids))
+
+        exact = None
+        # The estimate is only worth double-checking when it lands close to the budget.
+        if self.exact_counter is not None and estimated > self.budget * 0.8:
+            exact = self.exact_counter(self.system_prompt) + self.exact_counter(render_enriched_text(store, questions, keep_ids))
+            if exact > self.budget:
+                # Shrink the working budget by the observed estimation error and re-pack once.
+                scaled_budget = int(self.budget * estimated / exact)
+                print(f"Exact count {exact} over budget {self.budget}; re-packing with estimate budget {scaled_budget}")
+                keep_ids, dropped = self._select(store, questions, scaled_budget)
+                estimated = self.estimator(self.system_prompt) + self.estimator(
+                    render_enriched_text(store, questions, keep_ids))
+                exact = self.exact_counter(self.system_prompt) + self.exact_counter(
+                    render_enriched_text(store, questions, keep_ids))
+
+        if dropped:
+            print(f"Context packer dropped {len(dropped)} of {len(store)} chunks to fit {self.budget} tokens:")
+            for chunk in sorted(dropped, key=chunk_priority, reverse=True):
+                print(f"  dropped [{chunk['id']}] score={chunk['score']:.3f} sections={len(chunk['sections'])} "
+                      f"~{self.estimator(chunk['text'])} tokens source={', '.join(chunk['uris']) or 'unknown'}")
+
+        stats = {
+            'token_budget': self.budget,
+            'packed_tokens_estimate': estimated,
+            'dropped_chunks': len(dropped)
+        }
+        if exact is not None:
+            stats['packed_tokens_exact'] = exact
+        return keep_ids, stats
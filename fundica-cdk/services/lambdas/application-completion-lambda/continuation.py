@@ -0,0 +1,100 @@
+"""
+Continue a generation that stopped on maxTokens.
+
+When converse returns stopReason 'max_tokens' the reply is cut off mid-answer.
+Instead of a full re-run with a larger maxTokens, the reply is trimmed back to its
+last complete markdown block and sent back as the start of the assistant turn
+(prefill), and the model carries on from there. The request prefix (system prompt,
+template, enriched_text) is unchanged, so with prompt caching on it is served from
+the cache. The continuations are merged without duplicating text, and the loop
+stops after max_continuations rounds.
+"""
+import copy
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Optional,
+    Tuple
+)
+
+def with_prefill(request: Dict, text: str) -> Dict:
+    """
+    Copy of a converse request with text as the beginning of the assistant reply.
+    Prefill must not end in whitespace.
+    """
+    continued = copy.copy(request)
+    continued['messages'] = list(request['messages']) + [{'role': 'assistant', 'content': [{'text': text.rstrip()}]}]
+    return continued
+
+def split_complete(text: str) -> Tuple[str, str]:
+    """
+    Split text after its last complete markdown block, i.e. at the last blank line
+    that is not inside a code fence.
+
+    Returns:
+        (complete part, incomplete remainder). Text without a blank line is all remainder.
+    """
+    cut = text.rfind('\n\n')
+    while cut > 0 and text[:cut].count('```') % 2 == 1:
+        cut = text.rfind('\n\n', 0, cut)
+    if cut <= 0:
+        return '', text
+    return text[:cut], text[cut:]
+
+def merge_continuation(previous: str, continuation: str, max_overlap: int = 2000) -> str:
+    """
+    Append continuation to previous, dropping any text the model repeated from the
+    end of previous.
+    """
+    head = continuation.lstrip()
+    tail = previous.rstrip()
+    for size in range(min(len(tail), len(head), max_overlap), 20, -1):
+        if tail.endswith(head[:size]):
+            return tail + head[size:]
+    return tail + continuation
+
+def converse_with_continuation(converse: Callable[..., Dict],
+                               request: Dict,
+                               max_continuations: int = 4,
+                               on_response: Optional[Callable[[Dict], Any]] = None) -> Tuple[str, str]:
+    """
+    Call converse and keep continuing while the reply stops on max_tokens.
+
+    Parameters:
+        converse (Callable[..., Dict]): Takes the request keyword arguments, e.g. a
+                                        rate-limited bedrock_runtime_client.converse.
+        request (Dict): Converse request.
+        max_continuations (int): Continuation rounds after the first call.
+        on_response (Optional[Callable[[Dict], Any]]): Called with every raw response, e.g. to record usage.
+
+    Returns:
+        (merged text, final stop reason). 'max_tokens' means the reply is still truncated.
+    """
+    response = converse(**request)
+    if on_response is not None:
+        on_response(response)
+    text = response['output']['message']['content'][0]['text']
+    stop_reason = response.get('stopReason', '')
+
+    rounds = 0
+    prefill_length = 0
+    while stop_reason == 'max_tokens' and rounds < max_continuations:
+        rounds += 1
+        complete, remainder = split_complete(text)
+        if len(complete.rstrip()) <= prefill_length:
+            # No complete block since the last round (one block longer than maxTokens):
+            # continue mid-block rather than loop on the same prefix.
+            complete, remainder = text, ''
+        prefill_length = len(complete.rstrip())
+        print(f"Reply hit max_tokens; continuation {rounds}/{max_continuations} "
+              f"from {len(complete)} characters (dropping {len(remainder)} incomplete)")
+        response = converse(**with_prefill(request, complete))
+        if on_response is not None:
+            on_response(response)
+        text = merge_continuation(complete, response['output']['message']['content'][0]['text'])
+        stop_reason = response.get('stopReason', '')
+
+    if stop_reason == 'max_tokens':
+        print(f"Warning: reply still truncated after {max_continuations} continuations")
+    return text, stop_reason
@@ -0,0 +1,81 @@
+"""
+Content-addressed cache of generated application forms.
+
+Step Functions retries, repeated clicks in the frontend and re-runs after a failed
+docx conversion all send exactly the same converse request again. The cache key is
+a hash of the request itself: model id, system prompt, template (skeleton text or
+docx bytes), enriched_text and inference config. Any change to the inputs
+produces a new key, so entries never need explicit invalidation and only age out
+through the backend's TTL and size bound.
+
+Entries are stored with the backends of retrieval_cache (S3 or local disk).
+"""
+import hashlib
+import json
+from typing import (
+    Any,
+    Dict,
+    Optional
+)
+
+GENERATION_CACHE_PREFIX = 'generation-cache'
+
+def generation_entries_prefix(model_id: str) -> str:
+    safe_model_id = model_id.replace(':', '_').replace('/', '_')
+    return f"{GENERATION_CACHE_PREFIX}/{safe_model_id}/entries/"
+
+def _canonical(value: Any) -> Any:
+    # Template bytes can be large; their digest identifies them just as well.
+    if isinstance(value, (bytes, bytearray)):
+        return {'sha256': hashlib.sha256(value).hexdigest()}
+    if isinstance(value, dict):
+        return {key: _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    return value
+
+def request_key(request: Dict) -> str:
+    """
+    Hash of a converse request (the keyword arguments of converse/converse_stream).
+    """
+    payload = json.dumps(_canonical(request), sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class GenerationCache:
+    def __init__(self, backend: Any):
+        """
+        Maps converse requests to generated text.
+
+        Parameters:
+            backend (Any): LocalDiskCacheBackend or S3CacheBackend from retrieval_cache.
+        """
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, request: Dict) -> Optional[str]:
+        """
+        Cached text for the request, or None. Backend errors count as misses.
+        """
+        key = request_key(request)
+        try:
+            found = self.backend.get_many([key])
+        except Exception as e:
+            print(f"Warning: Could not read generation cache: {str(e)}")
+            found = {}
+        if key in found:
+            self.hits += 1
+            print(f"Generation cache hit {key[:12]}")
+            return found[key]['text']
+        self.misses += 1
+        return None
+
+    def put(self, request: Dict, text: str, stop_reason: str = '') -> None:
+        """
+        Store a finished generation. Callers should only store complete replies, not
+        truncated or interrupted ones.
+        """
+        try:
+            self.backend.put_many({request_key(request): {'text': text, 'stopReason': stop_reason}})
+        except Exception as e:
+            print(f"Warning: Could not store generation in cache: {str(e)}")
@@ -0,0 +1,164 @@
+"""
+Status records for asynchronous completion jobs.
+
+In async mode lambda_handler only accepts the request, writes a 'queued' record to
+S3_FILLED at jobs/{job_id}.json, invokes itself with InvocationType 'Event' and
+returns the job id. The worker invocation updates the record as it goes through
+its stages (loading, retrieval, generation, conversion) with done/total counters
+where a stage has them, and finally marks it 'succeeded' with the response data or
+'failed' with the error. job_status_lambda reads the record for the frontend, so
+polling never touches the 15-minute worker.
+
+Progress updates are throttled to one write per min_interval seconds and written
+from a background thread, because progress is reported from the retrieval event
+loop and the section worker threads, which must not wait on S3. Stage changes and
+the final state are written synchronously, and a progress write that lands after
+a newer record is dropped.
+"""
+import json
+import threading
+import time
+import uuid
+from typing import (
+    Any,
+    Dict,
+    Optional,
+    Tuple
+)
+
+# Must match job_status_lambda.py
+JOBS_PREFIX = 'jobs'
+
+def job_key(job_id: str) -> str:
+    return f"{JOBS_PREFIX}/{job_id}.json"
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+def read_job(s3_client: Any, bucket: str, job_id: str) -> Optional[Dict]:
+    try:
+        return json.loads(s3_client.get_object(Bucket=bucket, Key=job_key(job_id))['Body'].read())
+    except Exception:
+        return None
+
+class JobStatus:
+    def __init__(self,
+                 s3_client: Any,
+                 bucket: str,
+                 job_id: str,
+                 min_interval: float = 2.0,
+                 record: Optional[Dict] = None):
+        """
+        Writer of one job's status record.
+
+        Parameters:
+            s3_client (Any): S3 client object.
+            bucket (str): Bucket of the status records (S3_FILLED).
+            job_id (str): Job id, see new_job_id.
+            min_interval (float): Minimum seconds between two progress writes.
+            record (Optional[Dict]): Existing record to continue, e.g. the queued one.
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.job_id = job_id
+        self.min_interval = min_interval
+        self.last_write = 0.0
+        self._lock = threading.Lock()
+        # Serializes puts; _seq numbers snapshots so an older one never overwrites a newer one.
+        self._write_lock = threading.Lock()
+        self._seq = 0
+        self._written_seq = 0
+        now = time.time()
+        self.record: Dict = {
+            'jobId': job_id,
+            'status': 'queued',
+            'stage': None,
+            'progress': None,
+            'stages': {},
+            'createdAt': now,
+            'updatedAt': now
+        }
+        if record:
+            self.record.update(record)
+
+    def _snapshot(self) -> Tuple[int, str]:
+        # Called with _lock held.
+        self.record['updatedAt'] = time.time()
+        self.last_write = self.record['updatedAt']
+        self._seq += 1
+        return self._seq, json.dumps(self.record, default=str)
+
+    def _put(self, seq: int, body: str) -> None:
+        with self._write_lock:
+            if seq <= self._written_seq:
+                return
+            try:
+                self.s3_client.put_object(Bucket=self.bucket,
+                                          Key=job_key(self.job_id),
+                                          Body=body,
+                                          ContentType='application/json')
+                self._written_seq = seq
+            except Exception as e:
+                # The job itself must not fail because its status could not be written.
+                print(f"Warning: Could not write status of job {self.job_id}: {str(e)}")
+
+    def _write(self) -> None:
+        self._put(*self._snapshot())
+
+    def queue(self, request: Dict) -> None:
+        with self._lock:
+            self.record['request'] = request
+            self._write()
+
+    def stage(self, name: str, total: Optional[int] = None) -> None:
+        """
+        Enter a stage. total is the number of steps when the stage reports progress.
+        """
+        with self._lock:
+            now = time.time()
+            previous = self.record['stage']
+            if previous is not None:
+                self.record['stages'][previous]['seconds'] = round(now - self.record['stages'][previous]['startedAt'], 1)
+            self.record['status'] = 'running'
+            self.record['stage'] = name
+            self.record['stages'][name] = {'startedAt': now}
+            self.record['progress'] = {'done': 0, 'total': total} if total is not None else None
+            self._write()
+
+    def progress(self, done: int, total: int) -> None:
+        with self._lock:
+            self.record['progress'] = {'done': done, 'total': total}
+            if done >= total or time.time() - self.last_write >= self.min_interval:
+                threading.Thread(target=self._put, args=self._snapshot(), daemon=True).start()
+
+    def finish(self, status: str, result: Optional[Dict] = None, error: Any = None) -> None:
+        """
+        Final state: 'succeeded' with the response data or 'failed' with the error.
+        """
+        with self._lock:
+            now = time.time()
+            stage = self.record['stage']
+            if stage is not None and 'seconds' not in self.record['stages'][stage]:
+                self.record['stages'][stage]['seconds'] = round(now - self.record['stages'][stage]['startedAt'], 1)
+            self.record['status'] = status
+            self.record['seconds'] = round(now - self.record['createdAt'], 1)
+            if result is not None:
+                self.record['result'] = result
+            if error is not None:
+                self.record['error'] = error
+            self._write()
+
+class NoJobStatus:
+    """
+    Stands in for JobStatus on synchronous runs, where nobody polls a record.
+    """
+    job_id = None
+
+    def stage(self, name: str, total: Optional[int] = None) -> None:
+        pass
+
+    def progress(self, done: int, total: int) -> None:
+        pass
+
+    def finish(self, status: str, result: Optional[Dict] = None, error: Any = None) -> None:
+        pass
@@ -0,0 +1,460 @@
+"""
+Multi-format rendering of a completed form.
+
+The markdown is parsed once with md_docx.parse_markdown and every requested format
+is rendered from the same blocks, one after the other (the renderers are pure
+Python and CPU-bound, so threads would only take turns on the GIL):
+
+    docx  md_docx.blocks_to_docx, unless the caller already has one (a filled template)
+    html  a standalone page with inline CSS
+    pdf   a Letter-size PDF in the standard Helvetica and Courier fonts
+
+Only the standard library is used. Markdown outside the native subset is
+converted with pandoc instead (docx and html); pdf is then skipped, because pandoc
+needs a LaTeX engine for PDF that the image does not have.
+"""
+import html
+import re
+import zlib
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple
+)
+from md_docx import (
+    DOCX_CONTENT_TYPE,
+    Block,
+    UnsupportedMarkdown,
+    blocks_to_docx,
+    pandoc_to_docx,
+    parse_markdown
+)
+
+OUTPUT_FORMATS = ('docx', 'pdf', 'html')
+CONTENT_TYPES = {
+    'docx': DOCX_CONTENT_TYPE,
+    'pdf': 'application/pdf',
+    'html': 'text/html; charset=utf-8'
+}
+
+# HTML -----------------------------------------------------------------------
+
+HTML_STYLE = (
+    'body{font-family:Calibri,Arial,sans-serif;max-width:48em;margin:2em auto;padding:0 1em;'
+    'line-height:1.4;color:#222}'
+    'h1,h2,h3,h4,h5,h6{color:#1F3864;margin:1.2em 0 .4em}'
+    'table{border-collapse:collapse;margin:1em 0}'
+    'th,td{border:1px solid #999;padding:4px 8px;vertical-align:top}th{background:#f2f2f2}'
+    'blockquote{border-left:3px solid #ccc;margin-left:0;padding-left:1em;color:#555}'
+    'pre{background:#f6f6f6;padding:.5em;overflow-x:auto}code{font-family:Consolas,monospace}')
+
+def _plain_text(runs) -> str:
+    return ''.join(run.text for run in runs)
+
+def _runs_html(runs) -> str:
+    parts = []
+    for run in runs:
+        text = '<br>'.join(html.escape(line, quote=False) for line in run.text.split('\n'))
+        if run.code:
+            text = f'<code>{text}</code>'
+        if run.strike:
+            text = f'<del>{text}</del>'
+        if run.italic:
+            text = f'<em>{text}</em>'
+        if run.bold:
+            text = f'<strong>{text}</strong>'
+        if run.link:
+            text = f'<a href="{html.escape(run.link)}">{text}</a>'
+        parts.append(text)
+    return ''.join(parts)
+
+def _list_html(items) -> str:
+    """
+    Nested <ul>/<ol> from (level, ordered, start, runs) items; a sub-list stays
+    inside the <li> of its parent item.
+    """
+    xml: List[str] = []
+    open_lists: List[str] = []
+    for level, ordered, start, runs in items:
+        while len(open_lists) > level + 1:
+            xml.append(f'</li></{open_lists.pop()}>')
+        if len(open_lists) == level + 1:
+            xml.append('</li>')
+        while len(open_lists) < level + 1:
+            tag = 'ol' if ordered else 'ul'
+            xml.append(f'<{tag} start="{start}">' if ordered and start != 1 else f'<{tag}>')
+            open_lists.append(tag)
+        xml.append(f'<li>{_runs_html(runs)}')
+    while open_lists:
+        xml.append(f'</li></{open_lists.pop()}>')
+    return ''.join(xml)
+
+def blocks_to_html(blocks: List[Block]) -> bytes:
+    body = []
+    title = 'Application form'
+    for block in blocks:
+        if block.kind == 'heading':
+            if title == 'Application form':
+                title = _plain_text(block.runs)
+            body.append(f'<h{block.level}>{_runs_html(block.runs)}</h{block.level}>')
+        elif block.kind == 'paragraph':
+            paragraph = f'<p>{_runs_html(block.runs)}</p>'
+            body.append(f'<blockquote>{paragraph}</blockquote>' if block.style == 'Quote' else paragraph)
+        elif block.kind == 'code':
+            body.append(f"<pre><code>{html.escape(chr(10).join(block.lines), quote=False)}</code></pre>")
+        elif block.kind == 'rule':
+            body.append('<hr>')
+        elif block.kind == 'list':
+            body.append(_list_html(block.items))
+        elif block.kind == 'table':
+            def cells(row, tag):
+                return ''.join(
+                    f'<{tag} style="text-align:{block.alignments[index]}">{_runs_html(cell)}</{tag}>'
+                    if index < len(block.alignments) and block.alignments[index]
+                    else f'<{tag}>{_runs_html(cell)}</{tag}>'
+                    for index, cell in enumerate(row))
+            rows = ''.join(f'<tr>{cells(row, "td")}</tr>' for row in block.rows)
+            body.append(f'<table><thead><tr>{cells(block.header, "th")}</tr></thead><tbody>{rows}</tbody></table>')
+    return (f'<!DOCTYPE html><html lang="en"><head><meta charset="utf-8">'
+            f'<meta name="viewport" content="width=device-width, initial-scale=1">'
+            f'<title>{html.escape(title)}</title><style>{HTML_STYLE}</style></head>'
+            f'<body>{chr(10).join(body)}</body></html>').encode('utf-8')
+
+def pandoc_to_html(markdown: str) -> bytes:
+    """
+    Convert markdown to a standalone html page with pandoc.
+    """
+    import pypandoc
+    return pypandoc.convert_text(source=markdown, to='html', format='md',
+                                 extra_args=['--standalone', '--metadata', 'title=Application form']).encode('utf-8')
+
+# PDF ------------------------------------------------------------------------
+
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+MARGIN = 72
+BODY_SIZE = 10.5
+HEADING_SIZES = (18, 15, 13, 12, 11, 11)
+# Helvetica advance widths of ASCII 32-126 in 1/1000 em, from the standard AFM metrics.
+HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584)
+# Helvetica-Bold is wider than Helvetica; wrapping with this margin keeps bold
+# text inside the column without a second metrics table.
+BOLD_WIDTH_FACTOR = 1.1
+PDF_FONTS = (
+    ('F1', 'Helvetica'),
+    ('F2', 'Helvetica-Bold'),
+    ('F3', 'Helvetica-Oblique'),
+    ('F4', 'Helvetica-BoldOblique'),
+    ('F5', 'Courier'))
+HEADING_COLOR = '0.122 0.220 0.392 rg'
+LINK_COLOR = '0.020 0.388 0.757 rg'
+WORD_PATTERN = re.compile(r'\S+|\s+')
+
+def _font(bold: bool, italic: bool, code: bool) -> str:
+    if code:
+        return 'F5'
+    return ('F1', 'F3', 'F2', 'F4')[bool(bold) * 2 + bool(italic)]
+
+def _text_width(text: str, font: str, size: float) -> float:
+    if font == 'F5':
+        return len(text) * 600 * size / 1000
+    width = sum(HELVETICA_WIDTHS[ord(char) - 32] if 32 <= ord(char) < 127 else 556 for char in text)
+    if font in ('F2', 'F4'):
+        width *= BOLD_WIDTH_FACTOR
+    return width * size / 1000
+
+def _pdf_string(text: str) -> str:
+    """
+    PDF literal string in WinAnsiEncoding; characters outside it become '?'.
+    """
+    encoded = text.encode('cp1252', errors='replace').decode('latin-1')
+    return '(' + encoded.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+class _PdfLayout:
+    """
+    Lays out blocks top to bottom over as many pages as needed. Every page is a
+    list of content stream operators.
+    """
+    def __init__(self):
+        self.pages: List[List[str]] = []
+        self.y = 0.0
+        self._new_page()
+
+    def _new_page(self) -> None:
+        self.pages.append([])
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def _ensure(self, height: float) -> None:
+        if self.y - height < MARGIN and self.y < PAGE_HEIGHT - MARGIN:
+            self._new_page()
+
+    def _space(self, height: float) -> None:
+        if self.y < PAGE_HEIGHT - MARGIN:
+            self.y -= height
+
+    def wrap(self, runs, width: float, size: float, bold: bool = False) -> List[List[Tuple[str, str, bool]]]:
+        """
+        Break runs into lines of (text, font, link) segments no wider than width.
+        """
+        lines: List[List[Tuple[str, str, bool]]] = [[]]
+        line_width = 0.0
+        for run in runs:
+            font = _font(run.bold or bold, run.italic, run.code)
+            for index, part in enumerate(run.text.split('\n')):
+                if index:
+                    lines.append([])
+                    line_width = 0.0
+                for word in WORD_PATTERN.findall(part):
+                    if word.isspace():
+                        if lines[-1]:
+                            lines[-1].append((' ', font, bool(run.link)))
+                            line_width += _text_width(' ', font, size)
+                        continue
+                    word_width = _text_width(word, font, size)
+                    if line_width + word_width > width and lines[-1]:
+                        while lines[-1] and lines[-1][-1][0] == ' ':
+                            lines[-1].pop()
+                        lines.append([])
+                        line_width = 0.0
+                    while word_width > width and len(word) > 1:
+                        # A word wider than the column (a long URL) is split.
+                        cut = len(word)
+                        while cut > 1 and _text_width(word[:cut], font, size) > width:
+                            cut -= 1
+                        lines[-1].append((word[:cut], font, bool(run.link)))
+                        lines.append([])
+                        word = word[cut:]
+                        word_width = _text_width(word, font, size)
+                    lines[-1].append((word, font, bool(run.link)))
+                    line_width += word_width
+        return lines
+
+    def draw_lines(self, lines, x: float, size: float, color: Optional[str] = None) -> None:
+        leading = size * 1.35
+        for segments in lines:
+            self._ensure(leading)
+            self.pages[-1].append(self._line_ops(segments, x, self.y - size, size, color))
+            self.y -= leading
+
+    def _line_ops(self, segments, x: float, baseline: float, size: float, color: Optional[str] = None) -> str:
+        ops = [f'BT {x:.2f} {baseline:.2f} Td']
+        current_font, current_color = None, None
+        # Neighbouring words in the same font and colour are shown with one Tj.
+        merged: List[List] = []
+        for text, font, link in segments:
+            if merged and merged[-1][1] == font and merged[-1][2] == link:
+                merged[-1][0] += text
+            else:
+                merged.append([text, font, link])
+        for text, font, link in merged:
+            if font != current_font:
+                ops.append(f'/{font} {size} Tf')
+                current_font = font
+            wanted = LINK_COLOR if link else (color or '0 g')
+            if wanted != current_color:
+                ops.append(wanted)
+                current_color = wanted
+            ops.append(f'{_pdf_string(text)} Tj')
+        ops.append('ET')
+        return ' '.join(ops)
+
+    def heading(self, block: Block) -> None:
+        size = HEADING_SIZES[block.level - 1]
+        self._space(size * 0.8)
+        lines = self.wrap(block.runs, PAGE_WIDTH - 2 * MARGIN, size, bold=True)
+        # Keep a heading with the first line of what follows it.
+        self._ensure(size * 1.35 * len(lines) + BODY_SIZE * 2.7)
+        self.draw_lines(lines, MARGIN, size, HEADING_COLOR)
+        self._space(size * 0.2)
+
+    def paragraph(self, block: Block) -> None:
+        indent = 18 if block.style == 'Quote' else 0
+        lines = self.wrap(block.runs, PAGE_WIDTH - 2 * MARGIN - indent, BODY_SIZE)
+        top = self.y
+        self.draw_lines(lines, MARGIN + indent, BODY_SIZE)
+        if indent and self.y < top:
+            self.pages[-1].append(f'0.8 G 2 w {MARGIN + 4:.2f} {self.y:.2f} m {MARGIN + 4:.2f} {top:.2f} l S 0 G')
+        self._space(BODY_SIZE * 0.6)
+
+    def code(self, block: Block) -> None:
+        size = 9
+        # Courier is monospaced, so code lines are cut by character count and keep
+        # their indentation.
+        per_line = int((PAGE_WIDTH - 2 * MARGIN) / (0.6 * size))
+        lines = [[(line[start:start + per_line], 'F5', False)]
+                 for line in block.lines or [''] for start in range(0, max(len(line), 1), per_line)]
+        self.draw_lines(lines, MARGIN, size)
+        self._space(BODY_SIZE * 0.6)
+
+    def rule(self) -> None:
+        self._ensure(BODY_SIZE)
+        self.y -= BODY_SIZE / 2
+        self.pages[-1].append(f'0.6 G 0.75 w {MARGIN} {self.y:.2f} m {PAGE_WIDTH - MARGIN} {self.y:.2f} l S 0 G')
+        self.y -= BODY_SIZE / 2
+
+    def list_block(self, block: Block) -> None:
+        counters: Dict[int, int] = {}
+        for level, ordered, start, runs in block.items:
+            for deeper in [key for key in counters if key > level]:
+                del counters[deeper]
+            counters[level] = counters.get(level, start - 1) + 1
+            marker = f'{counters[level]}.' if ordered else '•'
+            x = MARGIN + 18 * (level + 1)
+            lines = self.wrap(runs, PAGE_WIDTH - MARGIN - x, BODY_SIZE)
+            self._ensure(BODY_SIZE * 1.35)
+            self.pages[-1].append(self._line_ops([(marker, 'F1', False)],
+                                                 x - 4 - _text_width(marker, 'F1', BODY_SIZE),
+                                                 self.y - BODY_SIZE, BODY_SIZE))
+            self.draw_lines(lines, x, BODY_SIZE)
+        self._space(BODY_SIZE * 0.6)
+
+    def table(self, block: Block) -> None:
+        columns = max([len(block.header)] + [len(row) for row in block.rows])
+        column_width = (PAGE_WIDTH - 2 * MARGIN) / max(columns, 1)
+        size = BODY_SIZE - 1
+        leading = size * 1.35
+        padding = 4
+        for row_index, row in enumerate([block.header] + block.rows):
+            cells = [self.wrap(row[column] if column < len(row) else [], column_width - 2 * padding, size,
+                               bold=row_index == 0)
+                     for column in range(columns)]
+            height = max(len(lines) for lines in cells) * leading + 2 * padding
+            self._ensure(height)
+            top = self.y
+            for column, lines in enumerate(cells):
+                left = MARGIN + column * column_width
+                if row_index == 0:
+                    self.pages[-1].append(f'0.95 g {left:.2f} {top - height:.2f} {column_width:.2f} {height:.2f} re f 0 g')
+                alignment = block.alignments[column] if column < len(block.alignments) else ''
+                for line_index, segments in enumerate(lines):
+                    width = sum(_text_width(text, font, size) for text, font, _ in segments)
+                    free = column_width - 2 * padding - width
+                    offset = free if alignment == 'right' else free / 2 if alignment == 'center' else 0
+                    baseline = top - padding - line_index * leading - size
+                    self.pages[-1].append(self._line_ops(segments, left + padding + offset, baseline, size))
+                self.pages[-1].append(f'0.5 G 0.5 w {left:.2f} {top - height:.2f} {column_width:.2f} {height:.2f} re S 0 G')
+            self.y = top - height
+        self._space(BODY_SIZE * 0.8)
+
+    def add(self, block: Block) -> None:
+        if block.kind == 'heading':
+            self.heading(block)
+        elif block.kind == 'paragraph':
+            self.paragraph(block)
+        elif block.kind == 'code':
+            self.code(block)
+        elif block.kind == 'rule':
+            self.rule()
+        elif block.kind == 'list':
+            self.list_block(block)
+        elif block.kind == 'table':
+            self.table(block)
+
+def blocks_to_pdf(blocks: List[Block]) -> bytes:
+    layout = _PdfLayout()
+    for block in blocks:
+        layout.add(block)
+
+    objects: List[bytes] = [b'', b'']
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    fonts = ' '.join(f'/{name} {add(f"<< /Type /Font /Subtype /Type1 /BaseFont /{base} /Encoding /WinAnsiEncoding >>".encode())} 0 R'
+                     for name, base in PDF_FONTS)
+    page_ids = []
+    for operators in layout.pages:
+        stream = zlib.compress('\n'.join(operators).encode('latin-1'))
+        content = add(b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        page_ids.append(add((f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+                             f'/Resources << /Font << {fonts} >> >> /Contents {content} 0 R >>').encode()))
+    objects[0] = b'<< /Type /Catalog /Pages 2 0 R >>'
+    objects[1] = (f'<< /Type /Pages /Kids [{" ".join(f"{page} 0 R" for page in page_ids)}] '
+                  f'/Count {len(page_ids)} >>').encode()
+
+    pdf = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(pdf)
+    pdf += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b'%010d 00000 n \n' % offset
+    pdf += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+# Rendering ------------------------------------------------------------------
+
+NATIVE_RENDERERS: Dict[str, Callable[[List[Block]], bytes]] = {
+    'docx': blocks_to_docx,
+    'html': blocks_to_html,
+    'pdf': blocks_to_pdf
+}
+
+def render_formats(markdown: str,
+                   formats: Sequence[str] = ('docx',),
+                   writer: str = 'native',
+                   docx_bytes: Optional[bytes] = None,
+                   pandoc: Optional[Callable[[str], bytes]] = None) -> Dict[str, Tuple[bytes, str]]:
+    """
+    Render a completed form in every requested format from a single parse.
+
+    Parameters:
+        markdown (str): Completed form.
+        formats (Sequence[str]): Formats to render, out of OUTPUT_FORMATS.
+        writer (str): 'native', or 'pandoc' to convert the docx with pandoc.
+        docx_bytes (bytes): A docx made by the caller (a filled template), used as is.
+        pandoc (Callable): Converts markdown to docx with pandoc, pandoc_to_docx by default.
+
+    Returns:
+        {format: (bytes, renderer)} with renderer 'native', 'pandoc' or 'provided'.
+        A format that fails is logged and left out, except docx, which raises.
+    """
+    unknown = [output for output in formats if output not in OUTPUT_FORMATS]
+    if unknown:
+        raise ValueError(f"Unsupported output formats {unknown}, expected some of {list(OUTPUT_FORMATS)}")
+    pandoc = pandoc or pandoc_to_docx
+    try:
+        blocks = parse_markdown(markdown)
+    except UnsupportedMarkdown as e:
+        print(f"Native renderers do not support {str(e)}, rendering with pandoc")
+        blocks = None
+
+    def docx_renderer():
+        if blocks is not None and writer == 'native':
+            try:
+                return blocks_to_docx(blocks), 'native'
+            except Exception as e:
+                print(f"Warning: Native docx writer failed, converting with pandoc: {str(e)}")
+        return pandoc(markdown), 'pandoc'
+
+    renderers: Dict[str, Callable[[], Tuple[bytes, str]]] = {}
+    for output in dict.fromkeys(formats):
+        if output == 'docx':
+            renderers[output] = (lambda: (docx_bytes, 'provided')) if docx_bytes is not None else docx_renderer
+        elif blocks is not None:
+            renderers[output] = lambda render=NATIVE_RENDERERS[output]: (render(blocks), 'native')
+        elif output == 'html':
+            renderers[output] = lambda: (pandoc_to_html(markdown), 'pandoc')
+        else:
+            print(f"Warning: Skipping {output}, it has no pandoc fallback in this image")
+
+    outputs: Dict[str, Tuple[bytes, str]] = {}
+    for output, render in renderers.items():
+        try:
+            outputs[output] = render()
+        except Exception as e:
+            if output == 'docx':
+                raise
+            print(f"Warning: Could not render {output}: {str(e)}")
+    return outputs
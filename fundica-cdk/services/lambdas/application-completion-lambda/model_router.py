@@ -0,0 +1,136 @@
+"""
+Per-section model routing.
+
+Most of a form's sections are long narrative answers that need the large model,
+but some are short factual fields (company name, address, number of employees)
+that a smaller inference profile answers just as well, faster and for a fraction
+of the token cost. ModelRouter classifies every section as 'short' or 'long' from
+the size of its retrieved context and the kind of questions it asks, and picks the
+model for that class from a routing table.
+
+The table is configured per application form under modelRouting in
+{form}/config/{form}_config.json:
+
+    "modelRouting": {
+        "routes": {"short": "<small inference profile>", "long": "<large inference profile>"},
+        "shortMaxContextTokens": 3000,
+        "sections": {"Company Information": "short"}
+    }
+
+"sections" pins a class (or a model id) for specific sections and overrides the
+classifier. Routing only applies to section mode; a single-call form always uses
+the large model.
+"""
+import re
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple
+)
+from chunk_store import question_chunks
+from token_estimator import default_estimator
+
+SMALL_MODEL_ID = 'us.anthropic.claude-haiku-4-5-20251001-v1:0'
+
+# USD per million input / output tokens, used for cost reports only.
+MODEL_PRICING: Dict[str, Tuple[float, float]] = {
+    'us.anthropic.claude-sonnet-4-5-20250929-v1:0': (3.0, 15.0),
+    'us.anthropic.claude-sonnet-4-20250514-v1:0': (3.0, 15.0),
+    'us.anthropic.claude-3-7-sonnet-20250219-v1:0': (3.0, 15.0),
+    'us.anthropic.claude-haiku-4-5-20251001-v1:0': (1.0, 5.0),
+    'us.anthropic.claude-3-5-haiku-20241022-v1:0': (0.8, 4.0)
+}
+
+FACTUAL_PATTERN = re.compile(
+    r'(?i)\b(name|address|postal|phone|telephone|e-?mail|website|url|date|year|number of|how many|'
+    r'amount|total|registration|business number|incorporat\w*|province|city|country|employees|revenue|'
+    r'contact|title|position|naics|sector)\b')
+NARRATIVE_PATTERN = re.compile(
+    r'(?i)\b(describe|explain|outline|justify|why|how (will|would|does|do)|discuss|elaborate|strategy|'
+    r'plan|objectives?|impact|benefits?|rationale|summar\w*|challenges?|risks?)\b')
+
+def estimate_cost(model_id: str, input_tokens: int, output_tokens: int) -> float:
+    """
+    Token cost in USD, or 0.0 for a model without a price entry.
+    """
+    input_price, output_price = MODEL_PRICING.get(model_id, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+def is_factual_question(question: str) -> bool:
+    """
+    A question asks for a short factual answer if it names a factual field and does
+    not ask for any explanation.
+    """
+    return bool(FACTUAL_PATTERN.search(question)) and not NARRATIVE_PATTERN.search(question)
+
+class ModelRouter:
+    def __init__(self,
+                 default_model: str,
+                 routes: Optional[Dict[str, str]] = None,
+                 short_max_context_tokens: int = 3000,
+                 sections: Optional[Dict[str, str]] = None,
+                 estimator: Optional[Callable[[str], int]] = None):
+        """
+        Parameters:
+            default_model (str): Model for 'long' sections and anything unrouted.
+            routes (Optional[Dict[str, str]]): Model id per class ('short', 'long').
+            short_max_context_tokens (int): Sections with more retrieved context than
+                                            this are always 'long'.
+            sections (Optional[Dict[str, str]]): Class or model id pinned per section name.
+            estimator (Optional[Callable[[str], int]]): Token estimate for context size.
+                                                        Defaults to the calibrated estimate
+                                                        for default_model.
+        """
+        self.routes = {'short': SMALL_MODEL_ID, 'long': default_model, **(routes or {})}
+        self.short_max_context_tokens = short_max_context_tokens
+        self.sections = sections or {}
+        self.estimator = estimator or (lambda text: default_estimator.estimate(default_model, text))
+
+    @classmethod
+    def from_config(cls, default_model: str, config: Optional[Dict],
+                    estimator: Optional[Callable[[str], int]] = None) -> Optional['ModelRouter']:
+        """
+        Router for the modelRouting block of a form config, or None if routing is not configured.
+        """
+        if not config:
+            return None
+        return cls(default_model,
+                   routes=config.get('routes'),
+                   short_max_context_tokens=config.get('shortMaxContextTokens', 3000),
+                   sections=config.get('sections'),
+                   estimator=estimator)
+
+    def context_tokens(self, questions: List[Dict]) -> int:
+        texts = {chunk['text'] for enrich in questions for chunk in question_chunks(enrich)}
+        return sum(self.estimator(text) for text in texts)
+
+    def classify(self, section: str, questions: List[Dict]) -> str:
+        """
+        'short' if every question in the section is factual and its context is small, else 'long'.
+        """
+        pinned = self.sections.get(section)
+        if pinned in self.routes:
+            return pinned
+        if not questions or self.context_tokens(questions) > self.short_max_context_tokens:
+            return 'long'
+        return 'short' if all(is_factual_question(enrich['question']) for enrich in questions) else 'long'
+
+    def route(self, section: str, questions: List[Dict]) -> Tuple[str, str]:
+        """
+        Returns:
+            (model id, class) for the section. A model id pinned in sections is used as is.
+        """
+        pinned = self.sections.get(section)
+        if pinned and pinned not in self.routes:
+            return pinned, 'pinned'
+        route_class = self.classify(section, questions)
+        return self.routes[route_class], route_class
+
+    def describe(self) -> Dict:
+        return {
+            'routes': self.routes,
+            'shortMaxContextTokens': self.short_max_context_tokens,
+            'sections': self.sections
+        }
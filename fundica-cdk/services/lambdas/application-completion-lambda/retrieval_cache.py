@@ -0,0 +1,359 @@
+"""
+Persistent cache of knowledge base retrievals.
+
+Entries are keyed by (KB ID, question text, username, year, ingestion version), so
+re-running the completion for the same tenant skips every retrieve call until the
+knowledge base actually changes. The ingestion version is the id of the last
+ingestion job that modified the knowledge base; kb_sync_lambda writes it to
+retrieval-cache/{kb_id}/ingestion_version.json and purges the old entries, which
+invalidates the whole cache for that KB.
+
+Two backends are available: LocalDiskCacheBackend (e.g. /tmp in a warm Lambda
+container) and S3CacheBackend. Both expire entries after a TTL and evict the least
+recently used entries beyond max_entries (and beyond max_bytes, if set). The
+backends only store JSON values by key, so generation_cache reuses them.
+"""
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple
+)
+
+CACHE_PREFIX = 'retrieval-cache'
+# Last S3 eviction per bucket/prefix in this container. Listing a large prefix is
+# expensive, so put_many evicts at most once per evict_interval; expiry itself is
+# also handled by the bucket's lifecycle rules.
+_last_evicted: Dict[str, float] = {}
+
+def ingestion_version_key(kb_id: str) -> str:
+    return f"{CACHE_PREFIX}/{kb_id}/ingestion_version.json"
+
+def entries_prefix(kb_id: str) -> str:
+    return f"{CACHE_PREFIX}/{kb_id}/entries/"
+
+def read_ingestion_version(s3_client: Any, bucket: str, kb_id: str) -> Optional[str]:
+    """
+    Return the ingestion job id recorded by kb_sync_lambda, or None if the knowledge
+    base has not been synced since the cache was introduced. Without a version the
+    cache cannot tell stale entries apart, so callers should skip it.
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=ingestion_version_key(kb_id))
+        return json.loads(response['Body'].read()).get('ingestionJobId')
+    except Exception as e:
+        print(f"No ingestion version for {kb_id}, retrieval cache disabled: {str(e)}")
+        return None
+
+def lru_overflow(entries: List[Any], max_entries: int, max_bytes: Optional[int], size: Any) -> List[Any]:
+    """
+    Entries to evict from a list sorted oldest first so that at most max_entries
+    remain and, if max_bytes is set, their total size is at most max_bytes.
+    """
+    overflow = max(0, len(entries) - max_entries)
+    if max_bytes is not None:
+        total = sum(size(entry) for entry in entries[overflow:])
+        while overflow < len(entries) and total > max_bytes:
+            total -= size(entries[overflow])
+            overflow += 1
+    return entries[:overflow]
+
+def cache_key(kb_id: str, question_text: str, user: str, year: Any, ingestion_version: str) -> str:
+    """
+    Content hash of everything that determines a retrieval result.
+    """
+    payload = json.dumps([kb_id, question_text, user, str(year), ingestion_version])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class LocalDiskCacheBackend:
+    def __init__(self,
+                 directory: str,
+                 ttl_seconds: float = 30 * 24 * 3600,
+                 max_entries: int = 10000,
+                 max_bytes: Optional[int] = None):
+        """
+        One JSON file per entry. File mtime is refreshed on every hit and used for LRU order.
+
+        Parameters:
+            directory (str): Cache directory, created if missing.
+            ttl_seconds (float): Entries older than this are treated as misses and removed.
+            max_entries (int): Upper bound on the number of entries kept.
+            max_bytes (Optional[int]): Upper bound on the total size of the entries kept.
+        """
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict]:
+        found = {}
+        now = time.time()
+        for key in keys:
+            path = self._path(key)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if now - entry.get('created_at', 0) > self.ttl_seconds:
+                self._remove(path)
+                continue
+            os.utime(path)
+            found[key] = entry['value']
+        return found
+
+    def put_many(self, items: Dict[str, Dict]) -> None:
+        now = time.time()
+        for key, value in items.items():
+            path = self._path(key)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'created_at': now, 'value': value}, f)
+            os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        Remove expired entries, then the least recently used ones beyond max_entries.
+
+        Returns:
+            Number of entries removed.
+        """
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path, os.path.getsize(path)))
+                except OSError:
+                    continue
+
+        removed = 0
+        # mtime only says when an entry was last used, so TTL is checked against it
+        # here as a cheap upper bound; get_many enforces the exact created_at TTL.
+        live = []
+        for mtime, path, size in entries:
+            if now - mtime > self.ttl_seconds:
+                removed += self._remove(path)
+            else:
+                live.append((mtime, path, size))
+
+        live.sort()
+        for _, path, _ in lru_overflow(live, self.max_entries, self.max_bytes, size=lambda entry: entry[2]):
+            removed += self._remove(path)
+        return removed
+
+    def clear(self) -> None:
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                self._remove(os.path.join(self.directory, name))
+
+    def _remove(self, path: str) -> int:
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+class S3CacheBackend:
+    def __init__(self,
+                 s3_client: Any,
+                 bucket: str,
+                 prefix: str,
+                 ttl_seconds: float = 30 * 24 * 3600,
+                 max_entries: int = 100000,
+                 touch_interval: float = 24 * 3600,
+                 max_workers: int = 16,
+                 max_bytes: Optional[int] = None,
+                 evict_interval: float = 6 * 3600):
+        """
+        One S3 object per entry under prefix. S3 has no access time, so a hit older
+        than touch_interval is copied onto itself to refresh LastModified, which then
+        serves as the LRU clock.
+
+        Parameters:
+            s3_client (Any): S3 client object.
+            bucket (str): Bucket holding the cache.
+            prefix (str): Key prefix for entries, e.g. entries_prefix(KB_ID).
+            ttl_seconds (float): Entries older than this are treated as misses.
+            max_entries (int): Upper bound on the number of entries kept by evict().
+            touch_interval (float): Minimum age before a hit refreshes LastModified.
+            max_workers (int): Threads used for concurrent GET/PUT.
+            max_bytes (Optional[int]): Upper bound on the total size kept by evict().
+            evict_interval (float): Minimum seconds between evictions run by put_many.
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.max_workers = max_workers
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}.json"
+
+    def _get(self, key: str) -> Tuple[str, Optional[Dict]]:
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except Exception:
+            return key, None
+        age = time.time() - response['LastModified'].timestamp()
+        entry = json.loads(response['Body'].read())
+        if time.time() - entry.get('created_at', 0) > self.ttl_seconds:
+            return key, None
+        if age > self.touch_interval:
+            try:
+                self.s3_client.copy_object(Bucket=self.bucket,
+                                           Key=self._key(key),
+                                           CopySource={'Bucket': self.bucket, 'Key': self._key(key)},
+                                           MetadataDirective='REPLACE',
+                                           ContentType='application/json')
+            except Exception as e:
+                print(f"Could not refresh cache entry {key}: {str(e)}")
+        return key, entry['value']
+
+    def _put(self, item: Tuple[str, Dict]) -> None:
+        key, value = item
+        self.s3_client.put_object(Bucket=self.bucket,
+                                  Key=self._key(key),
+                                  Body=json.dumps({'created_at': time.time(), 'value': value}),
+                                  ContentType='application/json')
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return {key: value for key, value in executor.map(self._get, keys) if value is not None}
+
+    def put_many(self, items: Dict[str, Dict]) -> None:
+        if not items:
+            return
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(self._put, items.items()))
+        scope = f"{self.bucket}/{self.prefix}"
+        if time.time() - _last_evicted.get(scope, 0) >= self.evict_interval:
+            _last_evicted[scope] = time.time()
+            self.evict()
+
+    def _list(self) -> List[Dict]:
+        objects = []
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            objects.extend(page.get('Contents', []))
+        return objects
+
+    def _delete(self, keys: List[str]) -> None:
+        # delete_objects accepts at most 1000 keys per call
+        for i in range(0, len(keys), 1000):
+            self.s3_client.delete_objects(Bucket=self.bucket,
+                                          Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]],
+                                                  'Quiet': True})
+
+    def evict(self) -> int:
+        """
+        Remove expired entries, then the least recently used ones beyond max_entries.
+
+        Returns:
+            Number of entries removed.
+        """
+        now = time.time()
+        objects = self._list()
+        # As in LocalDiskCacheBackend, LastModified is the last use here; _get enforces
+        # the exact created_at TTL.
+        expired = [obj['Key'] for obj in objects if now - obj['LastModified'].timestamp() > self.ttl_seconds]
+        live = sorted((obj for obj in objects if now - obj['LastModified'].timestamp() <= self.ttl_seconds),
+                      key=lambda obj: obj['LastModified'])
+        overflow = [obj['Key'] for obj in lru_overflow(live, self.max_entries, self.max_bytes, size=lambda obj: obj['Size'])]
+        self._delete(expired + overflow)
+        return len(expired) + len(overflow)
+
+    def clear(self) -> None:
+        self._delete([obj['Key'] for obj in self._list()])
+
+class RetrievalCache:
+    def __init__(self, backend: Any, kb_id: str, ingestion_version: str):
+        """
+        Maps enriched question dicts to and from a cache backend.
+
+        Parameters:
+            backend (Any): LocalDiskCacheBackend or S3CacheBackend.
+            kb_id (str): Knowledge base ID.
+            ingestion_version (str): Id of the last ingestion job that changed the KB.
+        """
+        self.backend = backend
+        self.kb_id = kb_id
+        self.ingestion_version = ingestion_version
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, question_item: Dict, user: str, year: Any) -> str:
+        return cache_key(self.kb_id, question_item['question'], user, year, self.ingestion_version)
+
+    def lookup(self, questions: List[Dict], user: str, year: Any) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Split questions into cached results and the questions that still need a retrieve.
+
+        Returns:
+            (cached enriched question dicts, questions to retrieve)
+        """
+        # Questions with the same text share a key; every one of them keeps its id.
+        groups: Dict[str, List[Dict]] = {}
+        for question_item in questions:
+            groups.setdefault(self._key(question_item, user, year), []).append(question_item)
+        found = self.backend.get_many(groups.keys())
+
+        cached = []
+        missing = []
+        for key, group in groups.items():
+            if key in found:
+                # The same question can appear in another form or under another id.
+                cached.extend({**found[key], 'id': question_item['id'], 'section': question_item.get('section')}
+                              for question_item in group)
+            else:
+                missing.append(group[0])
+
+        self.hits += len(cached)
+        self.misses += sum(len(groups[self._key(question_item, user, year)]) for question_item in missing)
+        return cached, missing
+
+    def expand(self, fresh: List[Dict], questions: List[Dict], user: str, year: Any) -> List[Dict]:
+        """
+        Copy the results retrieved for the questions returned by lookup() to every
+        other question with the same text.
+        """
+        by_key = {self._key(enriched, user, year): enriched for enriched in fresh}
+        retrieved_ids = {enriched['id'] for enriched in fresh}
+        expanded = list(fresh)
+        for question_item in questions:
+            if question_item['id'] in retrieved_ids:
+                continue
+            enriched = by_key.get(self._key(question_item, user, year))
+            if enriched is not None:
+                expanded.append({**enriched, 'id': question_item['id'], 'section': question_item.get('section')})
+        return expanded
+
+    def store(self, enriched_questions: List[Dict], user: str, year: Any) -> None:
+        """
+        Store successful retrievals. Failed ones are left out so they are retried next run.
+        """
+        self.backend.put_many({
+            self._key(enriched, user, year): enriched
+            for enriched in enriched_questions
+            if enriched.get('status') == 'success'
+        })
@@ -0,0 +1,172 @@
+"""
+Section-parallel generation of the application form.
+
+Writing the whole form in one converse call makes latency grow linearly with the
+form, because output tokens are generated serially. In section mode the enriched
+questions are grouped by section and every section is written by its own converse
+call. The calls run concurrently and are paced by the shared 'converse' rate
+limiter. The section outputs are stitched back together in template order, so
+wall-clock time is bounded by the slowest section instead of the sum of all of them.
+
+Each section also gets a fingerprint of what went into it: its questions, the
+content hashes of its retrieved chunks, and the prompt, template and model. The
+fingerprints and section outputs of the last run are kept in a manifest, so a
+re-run after a small change (e.g. one extra uploaded document) only regenerates
+the sections whose fingerprint changed and reuses the rest as they were.
+"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple
+)
+from chunk_store import content_hash, question_chunks
+
+def group_by_section(enriched_questions: List[Dict]) -> List[Tuple[str, List[Dict]]]:
+    """
+    Group enriched questions by section. Questions are numbered in template order, so
+    sections are returned in the order they first appear.
+
+    Returns:
+        List of (section, questions of that section).
+    """
+    sections: Dict[str, List[Dict]] = {}
+    for enrich in sorted(enriched_questions, key=lambda x: x['id']):
+        sections.setdefault(enrich['section'], []).append(enrich)
+    return list(sections.items())
+
+def section_instruction(section: str, position: int, total: int) -> str:
+    """
+    Instruction appended to a section's prompt so the model writes that section only.
+    """
+    instruction = (f"Write ONLY the \"{section}\" section of the application form (section {position} of {total}). "
+                   f"Start with the section heading exactly as it appears in the template and stop at the end of "
+                   f"this section. Do not write any other section.")
+    if position == 1:
+        instruction += " Put the form title from the template above the section heading."
+    return instruction
+
+def generate_sections(sections: List[Tuple[str, List[Dict]]],
+                      generate_section: Callable[[str, List[Dict], int], str],
+                      max_workers: int = 8,
+                      positions: Optional[Dict[str, int]] = None,
+                      on_progress: Optional[Callable[[int, int], Any]] = None) -> List[Dict]:
+    """
+    Generate every section concurrently.
+
+    Parameters:
+        sections (List[Tuple[str, List[Dict]]]): Output of group_by_section.
+        generate_section (Callable[[str, List[Dict], int], str]): (section, questions, position) -> markdown.
+                                                                   Responsible for its own rate limiting.
+        max_workers (int): Sections generated at the same time.
+        positions (Optional[Dict[str, int]]): 1-based template position by section, when
+                                              sections is only a subset of the form.
+        on_progress (Optional[Callable[[int, int], Any]]): Called with (sections done, total)
+                                                           after every finished section.
+
+    Returns:
+        One dict per section in template order with 'section', 'text' and 'seconds'.
+        The first failing section's exception is raised.
+    """
+    done = []
+    lock = threading.Lock()
+
+    def run(item):
+        position, (section, questions) = item
+        position = (positions or {}).get(section, position)
+        start = time.time()
+        try:
+            text = generate_section(section, questions, position)
+        except Exception as e:
+            print(f"Section '{section}' failed: {str(e)}")
+            raise
+        seconds = time.time() - start
+        print(f"Section '{section}' generated in {seconds:.1f}s")
+        if on_progress is not None:
+            with lock:
+                done.append(section)
+                on_progress(len(done), len(sections))
+        return {'section': section, 'text': text, 'seconds': round(seconds, 1)}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sections)))) as executor:
+        # map yields in submission order, which is template order.
+        return list(executor.map(run, enumerate(sections, start=1)))
+
+def stitch_sections(results: List[Dict]) -> str:
+    """
+    Join section outputs into one markdown document.
+    """
+    return "\n\n".join(result['text'].strip() for result in results if result['text'].strip()) + "\n"
+
+def section_fingerprint(section_questions: List[Dict], salt: str = '') -> str:
+    """
+    Hash of everything that determines a section's output. Chunks are identified by
+    content hash and sorted, so retrieval order and score changes do not count.
+
+    Parameters:
+        section_questions (List[Dict]): Enriched questions of one section.
+        salt (str): Run-wide inputs, e.g. a hash of model id, prompt and template.
+    """
+    payload = {
+        'salt': salt,
+        'questions': [enrich['question'] for enrich in sorted(section_questions, key=lambda x: x['id'])],
+        'chunks': sorted({content_hash(chunk['text']) for enrich in section_questions for chunk in question_chunks(enrich)})
+    }
+    return hashlib.sha256(json.dumps(payload).encode('utf-8')).hexdigest()
+
+def plan_regeneration(sections: List[Tuple[str, List[Dict]]],
+                      previous: Optional[Dict],
+                      salt: str = '') -> Tuple[List[Tuple[str, List[Dict]]], Dict[str, Dict], Dict[str, str]]:
+    """
+    Split sections into those that must be generated and those whose previous
+    output can be reused.
+
+    Parameters:
+        sections (List[Tuple[str, List[Dict]]]): Output of group_by_section.
+        previous (Optional[Dict]): Manifest of the last run, see build_manifest.
+        salt (str): Passed to section_fingerprint.
+
+    Returns:
+        to_generate: Sections to generate, in template order.
+        reused: Previous result dicts by section for the unchanged sections.
+        fingerprints: Current fingerprint of every section.
+    """
+    previous_sections = {entry['section']: entry for entry in (previous or {}).get('sections', [])}
+    to_generate = []
+    reused = {}
+    fingerprints = {}
+    for section, questions in sections:
+        fingerprint = section_fingerprint(questions, salt)
+        fingerprints[section] = fingerprint
+        entry = previous_sections.get(section)
+        if entry is not None and entry.get('fingerprint') == fingerprint:
+            reused[section] = {'section': section, 'text': entry['text'], 'seconds': 0.0}
+        else:
+            to_generate.append((section, questions))
+    return to_generate, reused, fingerprints
+
+def build_manifest(results: List[Dict], fingerprints: Dict[str, str]) -> Dict:
+    """
+    Manifest stored after a run: section outputs and fingerprints in template order.
+    """
+    return {
+        'sections': [{'section': result['section'],
+                      'fingerprint': fingerprints[result['section']],
+                      'text': result['text']} for result in results]
+    }
+
+def load_manifest(s3_client: Any, bucket: str, key: str) -> Optional[Dict]:
+    try:
+        return json.loads(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read())
+    except Exception:
+        return None
+
+def store_manifest(s3_client: Any, bucket: str, key: str, manifest: Dict) -> None:
+    s3_client.put_object(Bucket=bucket, Key=key, Body=json.dumps(manifest), ContentType='application/json')
@@ -0,0 +1,212 @@
+"""
+Stream the generated markdown into S3 while the model is still writing.
+
+Without streaming, generate_application_form waits for the whole converse reply
+before anything reaches S3. With streaming on, converse_stream deltas are buffered
+into an S3 multipart upload of the draft markdown. Parts are only uploaded every
+5 MiB (the S3 minimum) and the object only exists once the upload is completed,
+so for a normal form the draft itself appears at close().
+
+The live channel is the progress record next to the draft ({key}.progress.json).
+Every few seconds it is replaced with the status, token usage, the total length
+and only the text generated since the previous record, with its character offset:
+
+    {"status": "streaming", "characters": 5120, "offset": 4096, "text": "...", ...}
+
+A reader appends text when offset equals the length it already has, and waits for
+the completed draft if it missed a record. Each write therefore stays the size of
+a few seconds of output instead of growing with the draft.
+
+If the stream fails or the Lambda is about to run out of time, the upload is
+completed with whatever was generated, which leaves a usable partial draft
+instead of nothing.
+"""
+import json
+import time
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Tuple
+)
+
+# S3 rejects multipart parts smaller than 5 MiB, except for the last one.
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+def progress_key(key: str) -> str:
+    return f"{key}.progress.json"
+
+class S3StreamWriter:
+    def __init__(self,
+                 s3_client: Any,
+                 bucket: str,
+                 key: str,
+                 part_size: int = MIN_PART_SIZE,
+                 progress_interval: float = 5.0,
+                 content_type: str = 'text/markdown'):
+        """
+        Append-only writer backed by an S3 multipart upload.
+
+        Parameters:
+            s3_client (Any): S3 client object.
+            bucket (str): Destination bucket.
+            key (str): Destination key of the draft.
+            part_size (int): Buffered bytes before a part is uploaded. At least MIN_PART_SIZE.
+            progress_interval (float): Minimum seconds between two progress record updates.
+            content_type (str): Content type of the draft object.
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.progress_interval = progress_interval
+        self.content_type = content_type
+        self.upload_id: Optional[str] = None
+        self.parts: List[Dict] = []
+        self.pending: List[str] = []
+        self.pending_bytes = 0
+        self.written: List[str] = []
+        self.characters = 0
+        self.usage: Dict = {}
+        self.started_at = time.time()
+        self.first_token_at: Optional[float] = None
+        self.last_progress = 0.0
+        # Pieces of written, and their characters, already sent in a progress record.
+        self.progress_pieces = 0
+        self.progress_offset = 0
+        self.status = 'created'
+
+    def __enter__(self) -> 'S3StreamWriter':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self.status != 'streaming':
+            return
+        # Keep what was generated before the failure as a partial draft.
+        self.close('partial' if exc_type else 'complete')
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.written)
+
+    def start(self) -> None:
+        response = self.s3_client.create_multipart_upload(Bucket=self.bucket,
+                                                          Key=self.key,
+                                                          ContentType=self.content_type)
+        self.upload_id = response['UploadId']
+        self.status = 'streaming'
+        self._write_progress()
+
+    def write(self, text: str) -> None:
+        """
+        Append generated text. Uploads a part once part_size bytes are buffered and
+        refreshes the progress record at most once per progress_interval.
+        """
+        if not text:
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.time()
+            print(f"First token after {self.first_token_at - self.started_at:.1f}s")
+        self.written.append(text)
+        self.pending.append(text)
+        self.characters += len(text)
+        self.pending_bytes += len(text.encode('utf-8'))
+        if self.pending_bytes >= self.part_size:
+            self._upload_part()
+        if time.time() - self.last_progress >= self.progress_interval:
+            self._write_progress()
+
+    def _upload_part(self) -> None:
+        body = ''.join(self.pending).encode('utf-8')
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(Bucket=self.bucket,
+                                              Key=self.key,
+                                              UploadId=self.upload_id,
+                                              PartNumber=part_number,
+                                              Body=body)
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.pending = []
+        self.pending_bytes = 0
+
+    def _write_progress(self) -> None:
+        self.last_progress = time.time()
+        pieces = len(self.written)
+        tail = ''.join(self.written[self.progress_pieces:pieces])
+        try:
+            self.s3_client.put_object(Bucket=self.bucket,
+                                      Key=progress_key(self.key),
+                                      Body=json.dumps({
+                                          'status': self.status,
+                                          'characters': self.characters,
+                                          'usage': self.usage,
+                                          'elapsedSeconds': round(self.last_progress - self.started_at, 1),
+                                          'offset': self.progress_offset,
+                                          'text': tail
+                                      }),
+                                      ContentType='application/json')
+            self.progress_pieces = pieces
+            self.progress_offset += len(tail)
+        except Exception as e:
+            # Progress is best effort; the draft itself is what matters.
+            print(f"Warning: Could not update progress for {self.key}: {str(e)}")
+
+    def close(self, status: str = 'complete') -> None:
+        """
+        Upload the last part and complete the upload.
+
+        Parameters:
+            status (str): 'complete', or 'partial' when generation stopped early.
+        """
+        # The last part may be smaller than 5 MiB, and an upload needs at least one part.
+        if self.pending or not self.parts:
+            self._upload_part()
+        self.s3_client.complete_multipart_upload(Bucket=self.bucket,
+                                                 Key=self.key,
+                                                 UploadId=self.upload_id,
+                                                 MultipartUpload={'Parts': self.parts})
+        self.status = status
+        self._write_progress()
+        print(f"Draft {self.key} {status}: {self.characters} characters in {len(self.parts)} part(s)")
+
+    def abort(self) -> None:
+        """
+        Discard the upload entirely. Use only when a partial draft would be misleading.
+        """
+        if self.upload_id and self.status == 'streaming':
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.status = 'aborted'
+            self._write_progress()
+
+def consume_converse_stream(response: Dict, writer: Any, deadline: Optional[float] = None) -> Tuple[str, Dict]:
+    """
+    Write the text deltas of a converse_stream response as they arrive.
+
+    Parameters:
+        response (Dict): Return value of bedrock_runtime_client.converse_stream.
+        writer (Any): S3StreamWriter or anything with write(text) and a usage dict.
+        deadline (Optional[float]): time.time() after which reading stops, so there is
+                                    still time to close the draft before the Lambda times out.
+
+    Returns:
+        stop_reason (str): Model stop reason, or 'deadline' if reading stopped early.
+        usage (Dict): Token usage from the stream metadata, empty if it never arrived.
+    """
+    stop_reason = ''
+    stream = response['stream']
+    for event in stream:
+        if 'contentBlockDelta' in event:
+            writer.write(event['contentBlockDelta']['delta'].get('text', ''))
+        elif 'messageStop' in event:
+            stop_reason = event['messageStop'].get('stopReason', '')
+        elif 'metadata' in event:
+            writer.usage = event['metadata'].get('usage', {})
+
+        if deadline is not None and time.time() > deadline:
+            print("Stopping generation early to leave time to save the draft")
+            stop_reason = 'deadline'
+            if hasattr(stream, 'close'):
+                stream.close()
+            break
+    return stop_reason, writer.usage
@@ -0,0 +1,360 @@
+"""
+Fill the application form template in place.
+
+Converting the model's markdown to a new docx loses the form's own layout (tables,
+logos, numbering, fonts), which is why completed forms often needed another
+formatting pass. TemplateFiller instead opens {form}_template.docx once and locates
+its slots: section headings and the questions or fields under them, each anchored
+by its position in the document (index of a top-level paragraph, or table / row /
+cell index for questions laid out in tables). A run then only has to split the
+generated markdown into one answer per slot and write every answer next to its
+anchor:
+
+    - paragraph question: into the empty paragraph that follows it, or as new
+      paragraphs right after it
+    - table question: into the empty cell to its right or below it, or after the
+      question inside its own cell
+
+Everything else in the package is copied unchanged and the result is written to a
+BytesIO buffer, so no pandoc round trip and no second formatting call are needed.
+"""
+import copy
+import io
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple
+)
+from md_docx import parse_inline
+from template_skeleton import LIMIT_PATTERN, NUMBERED_PATTERN
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+DOCUMENT_PART = 'word/document.xml'
+
+LIST_LINE_PATTERN = re.compile(r'^(\s*)([-*+]|\d{1,9}[.)])\s+(.*)$')
+MARKDOWN_HEADING_PATTERN = re.compile(r'^#{1,6}\s+(.*?)\s*#*$')
+
+def _w(tag: str) -> str:
+    return f'{{{W}}}{tag}'
+
+def _words(text: str) -> List[str]:
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+def _paragraph_text(paragraph: ET.Element) -> str:
+    return ''.join(node.text or '' for node in paragraph.iter(_w('t'))).strip()
+
+def _is_bold(paragraph: ET.Element) -> bool:
+    runs = [run for run in paragraph.iter(_w('r')) if ''.join(t.text or '' for t in run.iter(_w('t'))).strip()]
+    if not runs:
+        return False
+    for run in runs:
+        bold = run.find(f"{_w('rPr')}/{_w('b')}")
+        if bold is None or bold.get(_w('val')) in ('0', 'false'):
+            return False
+    return True
+
+def _style(paragraph: ET.Element) -> str:
+    style = paragraph.find(f"{_w('pPr')}/{_w('pStyle')}")
+    return style.get(_w('val'), '') if style is not None else ''
+
+def _is_field_text(text: str) -> bool:
+    return text.endswith('?') or text.endswith(':') or bool(NUMBERED_PATTERN.match(text)) or bool(LIMIT_PATTERN.search(text))
+
+def _slot_type(paragraph: ET.Element, text: str) -> Optional[str]:
+    """
+    'heading', 'field' or None for a template paragraph, with the same rules as the
+    template skeleton: heading styles and short bold labels are headings, questions,
+    numbered items, labels ending in ':' and limit notes are fields.
+    """
+    style = _style(paragraph).lower()
+    if style.startswith('heading') or style == 'title':
+        return 'heading'
+    if _is_bold(paragraph) and len(text.split()) <= 5 and not _is_field_text(text):
+        return 'heading'
+    if _is_field_text(text) or _is_bold(paragraph):
+        return 'field'
+    return None
+
+def _matches(line: str, slot_text: str) -> bool:
+    """
+    Whether a markdown line restates a template heading or question.
+    """
+    line_words = _words(NUMBERED_PATTERN.sub('', line))
+    slot_words = _words(NUMBERED_PATTERN.sub('', slot_text))
+    if not line_words or not slot_words:
+        return False
+    prefix = min(len(slot_words), 8)
+    if line_words[:prefix] == slot_words[:prefix]:
+        return True
+    # Shortened restatements of a long question, e.g. without its limit note.
+    return len(line_words) >= 4 and ' '.join(line_words) in ' '.join(slot_words)
+
+def _remainder(label: str, slot_text: str) -> str:
+    """
+    Answer given on the same line as the restated label, e.g. "Number of employees? 42"
+    or "Company name: Acme": the text after the label's closing '?', ':' or '.'.
+    """
+    slot_words = _words(NUMBERED_PATTERN.sub('', slot_text))
+    label = NUMBERED_PATTERN.sub('', label)
+    if slot_words:
+        pattern = r'[^a-z0-9]*' + r'[^a-z0-9]+'.join(map(re.escape, slot_words)) + r'[\s*_]*[?:.](.*)$'
+        match = re.match(pattern, label, re.IGNORECASE)
+        if match:
+            return match.group(1).strip(' *_')
+    # Shortened restatement: keep what follows its first '?' or ':'.
+    match = re.search(r'[?:]\s+(.*\S)', label)
+    return match.group(1).strip(' *_') if match else ''
+
+def _is_header_row(rows: List[ET.Element], row_index: int) -> bool:
+    """
+    Column header row of a question/answer table ("Question" | "Answer"): a first (or
+    repeating header) row of two or more short cells that are not fields, above a row
+    that holds a question. Its cells label the columns and are not slots, whereas
+    labels above blank answer cells are.
+    """
+    row = rows[row_index]
+    repeated = row.find(f"{_w('trPr')}/{_w('tblHeader')}") is not None
+    if (row_index != 0 and not repeated) or row_index + 1 >= len(rows):
+        return False
+    texts = [text for text in (_paragraph_text(cell) for cell in row.findall(_w('tc'))) if text]
+    if len(texts) < 2 or any(len(text.split()) > 3 or _is_field_text(text) for text in texts):
+        return False
+    return any(_is_field_text(_paragraph_text(cell)) for cell in rows[row_index + 1].findall(_w('tc')))
+
+class TemplateFiller:
+    def __init__(self, document_bytes: bytes):
+        """
+        Open the template and locate its slots. Build once per template version and
+        reuse for every fill.
+
+        Parameters:
+            document_bytes (bytes): The template docx.
+        """
+        self.document_bytes = document_bytes
+        with zipfile.ZipFile(io.BytesIO(document_bytes)) as template:
+            self.document_xml = template.read(DOCUMENT_PART).decode('utf-8')
+        self._register_namespaces()
+        self.root = ET.fromstring(self.document_xml)
+        self.slots = self._locate_slots(self.root)
+
+    def _register_namespaces(self) -> None:
+        # Serialize with the template's own prefixes; the original root tag (with
+        # every declaration, including those only named in mc:Ignorable) is put back
+        # on output.
+        for _, (prefix, uri) in ET.iterparse(io.StringIO(self.document_xml), events=('start-ns',)):
+            try:
+                ET.register_namespace(prefix, uri)
+            except ValueError:
+                pass
+        self.root_tag = re.search(r'<[\w:]*document\b[^>]*>', self.document_xml).group(0)
+        declaration = re.match(r'<\?xml[^>]*\?>', self.document_xml)
+        self.declaration = declaration.group(0) if declaration else '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+
+    @staticmethod
+    def _locate_slots(root: ET.Element) -> List[Dict]:
+        """
+        Headings and fields in document order with their anchors:
+        {'type', 'text', 'anchor': ('paragraph', index) or ('cell', table, row, cell, paragraph)}.
+        """
+        slots = []
+        body = root.find(_w('body'))
+        paragraph_index = 0
+        table_index = 0
+        for child in body:
+            if child.tag == _w('p'):
+                text = _paragraph_text(child)
+                slot_type = _slot_type(child, text) if text else None
+                if slot_type:
+                    slots.append({'type': slot_type, 'text': text, 'anchor': ('paragraph', paragraph_index)})
+                paragraph_index += 1
+            elif child.tag == _w('tbl'):
+                rows = child.findall(_w('tr'))
+                for row_index, row in enumerate(rows):
+                    if _is_header_row(rows, row_index):
+                        continue
+                    for cell_index, cell in enumerate(row.findall(_w('tc'))):
+                        for index_in_cell, paragraph in enumerate(cell.findall(_w('p'))):
+                            text = _paragraph_text(paragraph)
+                            slot_type = _slot_type(paragraph, text) if text else None
+                            if slot_type:
+                                slots.append({'type': slot_type, 'text': text,
+                                              'anchor': ('cell', table_index, row_index, cell_index, index_in_cell)})
+                table_index += 1
+        return slots
+
+    def split_answers(self, markdown: str) -> Dict[int, List[str]]:
+        """
+        Assign the lines of the generated markdown to slots. A line that restates a
+        heading or question starts that slot's answer; slots are matched in
+        document order, so a repeated label cannot pull text backwards.
+
+        Returns:
+            Answer lines by slot index, for slots with a non-empty answer.
+        """
+        answers: Dict[int, List[str]] = {}
+        current: Optional[int] = None
+        next_slot = 0
+        for raw in markdown.splitlines():
+            line = raw.strip()
+            label = re.sub(r'^(#{1,6}\s+|[-*+]\s+|\d{1,9}[.)]\s+)', '', line).strip('*_ ')
+            found = None
+            if line and not line.startswith('|'):
+                # Look a few slots ahead so a skipped question does not stall matching.
+                for index in range(next_slot, min(next_slot + 6, len(self.slots))):
+                    if _matches(label, self.slots[index]['text']):
+                        found = index
+                        break
+            if found is not None:
+                current = found
+                next_slot = found + 1
+                # "Question? answer" on one line keeps the part after the label.
+                remainder = _remainder(label, self.slots[found]['text'])
+                if remainder:
+                    answers.setdefault(current, []).append(remainder)
+                continue
+            if current is not None:
+                answers.setdefault(current, []).append(raw)
+        return {index: lines for index, lines in answers.items() if any(line.strip() for line in lines)}
+
+    def _answer_paragraphs(self, lines: List[str]) -> List[ET.Element]:
+        """
+        Plain paragraphs for an answer. Emphasis is kept; list items get a bullet or
+        their number and an indent, table rows become one line per row.
+        """
+        blocks: List[Tuple[str, int]] = []
+        pending: List[str] = []
+
+        def flush():
+            if pending:
+                blocks.append((' '.join(pending), 0))
+                pending.clear()
+
+        for raw in lines:
+            line = raw.strip()
+            if not line or re.fullmatch(r'[|:\-\s]+', line):
+                flush()
+                continue
+            item = LIST_LINE_PATTERN.match(raw)
+            heading = MARKDOWN_HEADING_PATTERN.match(line)
+            if item:
+                flush()
+                marker = '•' if item.group(2) in '-*+' else item.group(2)
+                blocks.append((f"{marker} {item.group(3)}", 1 + len(item.group(1)) // 2))
+            elif heading:
+                flush()
+                blocks.append((f"**{heading.group(1)}**", 0))
+            elif line.startswith('|'):
+                flush()
+                blocks.append((' | '.join(cell.strip() for cell in line.strip('|').split('|')), 0))
+            else:
+                pending.append(line)
+        flush()
+
+        paragraphs = []
+        for text, level in blocks:
+            paragraph = ET.Element(_w('p'))
+            if level:
+                properties = ET.SubElement(paragraph, _w('pPr'))
+                ET.SubElement(properties, _w('ind'), {_w('left'): str(360 * level), _w('hanging'): '360'})
+            for run in parse_inline(text):
+                element = ET.SubElement(paragraph, _w('r'))
+                if run.bold or run.italic or run.strike:
+                    run_properties = ET.SubElement(element, _w('rPr'))
+                    if run.bold:
+                        ET.SubElement(run_properties, _w('b'))
+                    if run.italic:
+                        ET.SubElement(run_properties, _w('i'))
+                    if run.strike:
+                        ET.SubElement(run_properties, _w('strike'))
+                content = run.text + (f" ({run.link})" if run.link and run.link != run.text else '')
+                for index, piece in enumerate(content.split('\n')):
+                    if index:
+                        ET.SubElement(element, _w('br'))
+                    node = ET.SubElement(element, _w('t'), {XML_SPACE: 'preserve'})
+                    node.text = piece
+            paragraphs.append(paragraph)
+        return paragraphs
+
+    @staticmethod
+    def _is_empty(element: ET.Element) -> bool:
+        return element.tag in (_w('p'), _w('tc')) and not ''.join(t.text or '' for t in element.iter(_w('t'))).strip()
+
+    def _write_after_paragraph(self, parent: ET.Element, anchor: ET.Element, paragraphs: List[ET.Element]) -> None:
+        position = list(parent).index(anchor) + 1
+        following = parent[position] if position < len(parent) else None
+        if following is not None and following.tag == _w('p') and self._is_empty(following):
+            # The template's blank answer line is replaced by the answer.
+            parent.remove(following)
+        for offset, paragraph in enumerate(paragraphs):
+            parent.insert(position + offset, paragraph)
+
+    def _write_into_cell(self, cell: ET.Element, paragraphs: List[ET.Element]) -> None:
+        for paragraph in cell.findall(_w('p')):
+            cell.remove(paragraph)
+        for paragraph in paragraphs:
+            cell.append(paragraph)
+
+    def fill(self, markdown: str) -> Tuple[io.BytesIO, Dict]:
+        """
+        Write the answers in the generated markdown into a copy of the template.
+
+        Returns:
+            (docx buffer positioned at 0, stats with 'slots', 'fields' and 'filled').
+        """
+        root = copy.deepcopy(self.root)
+        body = root.find(_w('body'))
+        top_paragraphs = [child for child in body if child.tag == _w('p')]
+        tables = [child for child in body if child.tag == _w('tbl')]
+        answers = self.split_answers(markdown)
+
+        # Resolve every anchor to its element before anything is inserted.
+        writes = []
+        for index, lines in answers.items():
+            anchor = self.slots[index]['anchor']
+            paragraphs = self._answer_paragraphs(lines)
+            if not paragraphs:
+                continue
+            if anchor[0] == 'paragraph':
+                writes.append(('after', body, top_paragraphs[anchor[1]], paragraphs))
+                continue
+            _, table_index, row_index, cell_index, index_in_cell = anchor
+            rows = tables[table_index].findall(_w('tr'))
+            cells = rows[row_index].findall(_w('tc'))
+            right = cells[cell_index + 1] if cell_index + 1 < len(cells) else None
+            below_cells = rows[row_index + 1].findall(_w('tc')) if row_index + 1 < len(rows) else []
+            below = below_cells[cell_index] if cell_index < len(below_cells) else None
+            if right is not None and self._is_empty(right):
+                writes.append(('cell', right, None, paragraphs))
+            elif below is not None and self._is_empty(below):
+                writes.append(('cell', below, None, paragraphs))
+            else:
+                cell = cells[cell_index]
+                writes.append(('after', cell, cell.findall(_w('p'))[index_in_cell], paragraphs))
+
+        for kind, parent, anchor, paragraphs in writes:
+            if kind == 'after':
+                self._write_after_paragraph(parent, anchor, paragraphs)
+            else:
+                self._write_into_cell(parent, paragraphs)
+
+        serialized = ET.tostring(root, encoding='unicode')
+        serialized = self.declaration + self.root_tag + serialized[serialized.index('>') + 1:]
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(io.BytesIO(self.document_bytes)) as template, \
+                zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as filled:
+            for item in template.infolist():
+                data = serialized.encode('utf-8') if item.filename == DOCUMENT_PART else template.read(item.filename)
+                filled.writestr(item, data)
+        buffer.seek(0)
+        stats = {
+            'slots': len(self.slots),
+            'fields': sum(1 for slot in self.slots if slot['type'] == 'field'),
+            'filled': len(writes)
+        }
+        return buffer, stats
@@ -0,0 +1,144 @@
+"""
+Compile an application form template into a compact text skeleton.
+
+Sending {form}_template.docx as a document block makes the model parse the whole
+file on every run, including styling, boilerplate and instructions it does not
+need. The skeleton keeps only what the answer has to follow: section headings, the
+questions or fields under each section, and any length limits they state. It is
+compiled once with pandoc and stored next to the template as
+{form}/templates/{form}_skeleton.json, keyed by the template's ETag, so it is
+recompiled only when the template changes.
+"""
+import json
+import os
+import re
+import tempfile
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Tuple
+)
+from lazy_init import LazyModule
+
+# Imported on first compile; a stored skeleton needs no pandoc.
+pypandoc = LazyModule('pypandoc')
+
+LIMIT_PATTERN = re.compile(r'(?i)(?:max(?:imum)?\.?\s*(?:of\s*)?)?(\d[\d,]*)\s*(characters|chars|words|pages)')
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.*)$')
+BOLD_LINE_PATTERN = re.compile(r'^\*\*(.+?)\*\*:?$')
+NUMBERED_PATTERN = re.compile(r'^(\d+(\.\d+)*[.)]|[a-z][.)])\s+')
+
+def skeleton_key(application_form: str) -> str:
+    return f'{application_form}/templates/{application_form}_skeleton.json'
+
+def template_key(application_form: str) -> str:
+    return f'{application_form}/templates/{application_form}_template.docx'
+
+def _clean(text: str) -> str:
+    text = re.sub(r'\\([\\`*_{}\[\]()#+\-.!|])', r'\1', text)
+    text = re.sub(r'[*_]{1,3}([^*_]+)[*_]{1,3}', r'\1', text)
+    return ' '.join(text.split())
+
+def _lines(markdown: str) -> List[str]:
+    """
+    Flatten the markdown into logical lines. Table rows become one line per cell so
+    questions laid out in tables are kept.
+    """
+    lines = []
+    for raw in markdown.splitlines():
+        line = raw.strip()
+        if not line or re.fullmatch(r'[|:\-\s+=]+', line):
+            continue
+        if line.startswith('|'):
+            lines.extend(cell.strip() for cell in line.strip('|').split('|') if cell.strip())
+        else:
+            lines.append(re.sub(r'^([-*+]|>)\s+', '', line))
+    return lines
+
+def _is_field(line: str) -> bool:
+    return (line.endswith('?') or line.endswith(':') or bool(NUMBERED_PATTERN.match(line))
+            or bool(LIMIT_PATTERN.search(line)))
+
+def parse_skeleton(markdown: str) -> List[Dict]:
+    """
+    Extract sections, fields and limits from the pandoc markdown of a template.
+
+    Returns:
+        List of {'title', 'fields': [{'text', 'limit'}]} in template order.
+    """
+    sections: List[Dict] = []
+    current = {'title': '', 'fields': []}
+    for line in _lines(markdown):
+        heading = HEADING_PATTERN.match(line)
+        bold = BOLD_LINE_PATTERN.match(line)
+        text = _clean(line)
+        # Templates often use bold text for headings too; short bold labels count as
+        # headings, longer bold lines are prompts to answer.
+        if heading or (bold and len(text.split()) <= 5 and not _is_field(text)):
+            if current['title'] or current['fields']:
+                sections.append(current)
+            current = {'title': text.lstrip('#').strip(), 'fields': []}
+            continue
+        if not bold and not _is_field(text):
+            continue
+        limit = LIMIT_PATTERN.search(text)
+        field = {'text': text, 'limit': f"{limit.group(1)} {limit.group(2).lower()}" if limit else None}
+        # A line that is only a limit note, e.g. "(Maximum 500 words)", belongs to the field above.
+        limit_only = limit and len(LIMIT_PATTERN.sub('', text).strip(' ()[].:').split()) <= 1
+        if limit_only and current['fields'] and current['fields'][-1]['limit'] is None:
+            current['fields'][-1]['limit'] = field['limit']
+        else:
+            current['fields'].append(field)
+    if current['title'] or current['fields']:
+        sections.append(current)
+    return sections
+
+def render_skeleton(sections: List[Dict]) -> str:
+    """
+    Compact text form sent to the model in place of the template document.
+    """
+    blocks = []
+    for section in sections:
+        lines = [f"## {section['title']}"] if section['title'] else []
+        for field in section['fields']:
+            limit = f" [limit: {field['limit']}]" if field['limit'] and field['limit'] not in field['text'] else ''
+            lines.append(f"- {field['text']}{limit}")
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+def compile_skeleton(document_bytes: bytes) -> Tuple[List[Dict], str]:
+    """
+    Convert template bytes to markdown with pandoc and compile the skeleton.
+
+    Returns:
+        sections (List[Dict]): Output of parse_skeleton.
+        text (str): Output of render_skeleton.
+    """
+    with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as f:
+        f.write(document_bytes)
+        path = f.name
+    try:
+        markdown = pypandoc.convert_file(path, 'gfm', format='docx', extra_args=['--wrap=none'])
+    finally:
+        os.remove(path)
+    sections = parse_skeleton(markdown)
+    return sections, render_skeleton(sections)
+
+def load_skeleton(s3_client: Any, bucket: str, application_form: str, etag: str) -> Optional[str]:
+    """
+    Return the stored skeleton text if it was compiled from the template with this ETag.
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=skeleton_key(application_form))
+        stored = json.loads(response['Body'].read())
+    except Exception:
+        return None
+    return stored['text'] if stored.get('etag') == etag else None
+
+def store_skeleton(s3_client: Any, bucket: str, application_form: str, etag: str, sections: List[Dict], text: str) -> None:
+    s3_client.put_object(Bucket=bucket,
+                         Key=skeleton_key(application_form),
+                         Body=json.dumps({'etag': etag, 'sections': sections, 'text': text}, indent=2),
+                         ContentType='application/json')
@@ -0,0 +1,75 @@
+from lazy_init import lazy_client, log_cold_start
+import json
+import os
+
+S3_FILLED = os.getenv("S3_FILLED", '')
+# Must match job_status.py in the application completion lambda
+JOBS_PREFIX = 'jobs'
+
+# S3 client, created on first use
+s3_client = lazy_client('s3')
+
+@log_cold_start
+def lambda_handler(event, context):
+    """
+    Returns the status record of an asynchronous application form job. The job id
+    comes from the query string (?jobId=...), the path parameters or the body.
+    """
+    try:
+        body = event.get('body') or {}
+        if isinstance(body, str):
+            body = json.loads(body)
+        job_id = ((event.get('queryStringParameters') or {}).get('jobId')
+                  or (event.get('pathParameters') or {}).get('jobId')
+                  or body.get('jobId'))
+
+        # Job ids are uuid4 hex strings; anything else cannot name a record.
+        if not job_id or not job_id.isalnum():
+            return error_response(400, 'Missing or invalid jobId')
+
+        try:
+            response = s3_client.get_object(Bucket=S3_FILLED, Key=f'{JOBS_PREFIX}/{job_id}.json')
+        except Exception as e:
+            print(f"Job {job_id} not found: {str(e)}")
+            return error_response(404, f'Job {job_id} not found')
+
+        record = json.loads(response['Body'].read())
+        # The request echo is only useful for debugging the worker.
+        record.pop('request', None)
+        return success_response(record)
+
+    except Exception as e:
+        print(f"Error in lambda_handler: {str(e)}")
+        return error_response(500, f'Internal server error: {str(e)}')
+
+def success_response(data):
+    """
+    Return a successful response with proper CORS headers.
+    """
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            # Polled every few seconds; never serve a cached status
+            'Cache-Control': 'no-store'
+        },
+        'body': json.dumps(data)
+    }
+
+def error_response(status_code, message):
+    """
+    Return an error response with proper CORS headers.
+    """
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+            'Access-Control-Allow-Headers': 'Content-Type',
+        },
+        'body': json.dumps({'error': message})
+    }
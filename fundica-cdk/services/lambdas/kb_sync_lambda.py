@@ -1,4 +1,4 @@
-import boto3
+from lazy_init import lazy_client, log_cold_start
 import os
 import json
 import time
@@ -6,9 +6,15 @@ from datetime import date
 
 KB_ID = os.getenv("KB_ID", '')
 KB_DATASOURCE_ID = os.getenv("KB_DATASOURCE_ID", '')
+S3_DOCS = os.getenv("S3_DOCS", '')
+# Must match retrieval_cache.py in the application completion lambda
+RETRIEVAL_CACHE_PREFIX = 'retrieval-cache'
 
-bedrock_agent_client = boto3.client("bedrock-agent")
+# Created on first use, see lazy_init.py
+bedrock_agent_client = lazy_client("bedrock-agent")
+s3_client = lazy_client('s3')
 
+@log_cold_start
 def lambda_handler(event, context):
 
     try:
@@ -48,6 +54,7 @@ def lambda_handler(event, context):
             time.sleep(10)
         
         if job_status == 'COMPLETE':
+            invalidate_retrieval_cache(job_response['ingestionJob'])
             return success_response({
             'message': 'Knowledge base ingestion job completed successfully',
             'username': username,
@@ -74,6 +81,54 @@ def lambda_handler(event, context):
         },
         status_code = 400)
 
+def invalidate_retrieval_cache(ingestion_job):
+    """
+    Record the ingestion job as the new knowledge base version and purge cached
+    retrievals, but only if the job actually changed something. Every pipeline run
+    starts an ingestion job, so bumping the version on no-op syncs would defeat the cache.
+
+    Args:
+        ingestion_job (dict): 'ingestionJob' from get_ingestion_job.
+    """
+    if not S3_DOCS:
+        return
+
+    statistics = ingestion_job.get('statistics', {})
+    changed = sum(statistics.get(stat, 0) for stat in ['numberOfNewDocumentsIndexed',
+                                                         'numberOfModifiedDocumentsIndexed',
+                                                         'numberOfMetadataDocumentsModified',
+                                                         'numberOfDocumentsDeleted'])
+    version_key = f'{RETRIEVAL_CACHE_PREFIX}/{KB_ID}/ingestion_version.json'
+    try:
+        s3_client.head_object(Bucket=S3_DOCS, Key=version_key)
+        version_exists = True
+    except Exception:
+        version_exists = False
+
+    if changed == 0 and version_exists:
+        print("Ingestion job changed no documents, retrieval cache kept")
+        return
+
+    try:
+        s3_client.put_object(Bucket=S3_DOCS,
+                             Key=version_key,
+                             Body=json.dumps({'ingestionJobId': ingestion_job['ingestionJobId'],
+                                              'statistics': statistics}, default=str),
+                             ContentType='application/json')
+
+        deleted = 0
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=S3_DOCS, Prefix=f'{RETRIEVAL_CACHE_PREFIX}/{KB_ID}/entries/'):
+            keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+            if keys:
+                s3_client.delete_objects(Bucket=S3_DOCS, Delete={'Objects': keys, 'Quiet': True})
+                deleted += len(keys)
+        print(f"Retrieval cache invalidated: version {ingestion_job['ingestionJobId']}, {deleted} entries purged")
+    except Exception as e:
+        # A stale version marker would serve outdated retrievals, so surface this loudly.
+        print(f"ERROR: Could not invalidate retrieval cache: {str(e)}")
+        raise
+
 def check_knowledge_base_exists(bedrock_agent_client, knowledge_base_name_or_id):
     """
     Checks if a Bedrock knowledge base with the given name or ID exists.
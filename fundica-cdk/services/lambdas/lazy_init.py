@@ -0,0 +1,141 @@
+"""
+Lazy initialisation shared by the Lambda functions.
+
+Creating boto3 clients and importing heavy modules (boto3 itself, pypandoc) at
+module load puts them on the cold-start path of every container, including
+invocations that fail validation before they touch AWS. Here clients are created
+on first use and cached for the lifetime of the container, and heavy modules are
+imported the first time one of their attributes is used:
+
+    s3_client = lazy_client('s3')
+    pypandoc = LazyModule('pypandoc')
+
+    @log_cold_start
+    def lambda_handler(event, context):
+        ...
+
+On the first invocation of a container log_cold_start prints one JSON line with the
+time from this module's import to the handler call (the init phase) and the time
+spent creating clients and importing modules on demand, so init regressions can be
+tracked with a CloudWatch metric filter on { $.metric = "coldStart" }. Import this
+module first in a handler module so its import marks the start of init.
+
+The zip-deployed Lambdas import this file from services/lambdas; the Docker
+images copy it next to their handler at build time (see their Dockerfiles).
+"""
+import functools
+import importlib
+import json
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Tuple
+)
+
+INIT_STARTED = time.perf_counter()
+
+_lock = threading.RLock()
+_clients: Dict[Tuple, Any] = {}
+_modules: Dict[str, Any] = {}
+# Milliseconds spent per lazily created client / imported module.
+_timings: Dict[str, float] = {}
+_cold_start = True
+
+def _timed(name: str, create: Callable[[], Any]) -> Any:
+    start = time.perf_counter()
+    value = create()
+    _timings[name] = round((time.perf_counter() - start) * 1000, 1)
+    print(f"Lazy init {name}: {_timings[name]} ms")
+    return value
+
+def import_module(name: str) -> Any:
+    """
+    Import a module once and time the import.
+    """
+    module = _modules.get(name)
+    if module is None:
+        with _lock:
+            module = _modules.get(name)
+            if module is None:
+                module = _timed(f'import:{name}', lambda: importlib.import_module(name))
+                _modules[name] = module
+    return module
+
+def get_client(service_name: str, **client_kwargs: Any) -> Any:
+    """
+    boto3 client for service_name, created on first call and reused afterwards.
+    Clients with different keyword arguments (e.g. region_name) are cached separately.
+    boto3 clients are thread-safe, so one client is shared by all threads.
+    """
+    key = (service_name, tuple(sorted(client_kwargs.items())))
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                boto3 = import_module('boto3')
+                client = _timed(f'client:{service_name}', lambda: boto3.client(service_name, **client_kwargs))
+                _clients[key] = client
+    return client
+
+class LazyClient:
+    def __init__(self, service_name: str, **client_kwargs: Any):
+        """
+        Stands in for a boto3 client and creates it on first attribute access, so it
+        can be assigned at module level and passed to helpers like a real client.
+        """
+        self._service_name = service_name
+        self._client_kwargs = client_kwargs
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(get_client(self._service_name, **self._client_kwargs), name)
+
+    def __repr__(self) -> str:
+        return f"LazyClient({self._service_name!r})"
+
+def lazy_client(service_name: str, **client_kwargs: Any) -> LazyClient:
+    return LazyClient(service_name, **client_kwargs)
+
+class LazyModule:
+    def __init__(self, name: str):
+        """
+        Stands in for a module and imports it on first attribute access.
+        """
+        self._name = name
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(import_module(self._name), attr)
+
+def init_timings() -> Dict[str, float]:
+    return dict(_timings)
+
+def log_cold_start(handler: Callable[[Any, Any], Any]) -> Callable[[Any, Any], Any]:
+    """
+    Decorator for a lambda_handler that logs the init duration on the first
+    invocation of a container.
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _cold_start
+        if _cold_start:
+            _cold_start = False
+            init_ms = round((time.perf_counter() - INIT_STARTED) * 1000, 1)
+            function_name = getattr(context, 'function_name', None) or handler.__module__
+            print(json.dumps({'metric': 'coldStart',
+                              'function': function_name,
+                              'initMs': init_ms,
+                              'lazyInitMs': init_timings()}))
+            start = time.perf_counter()
+            try:
+                return handler(event, context)
+            finally:
+                # Clients and imports created during the first invocation.
+                print(json.dumps({'metric': 'coldStartFirstInvocation',
+                                  'function': function_name,
+                                  'durationMs': round((time.perf_counter() - start) * 1000, 1),
+                                  'lazyInitMs': init_timings()}))
+        return handler(event, context)
+    return wrapper
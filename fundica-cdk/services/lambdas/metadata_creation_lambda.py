@@ -1,5 +1,5 @@
+from lazy_init import lazy_client, log_cold_start
 import json
-import boto3
 import os
 from datetime import datetime, date
 from typing import (
@@ -8,12 +8,13 @@ from typing import (
     List
 )
 
-# Initialize S3 client
-s3_client = boto3.client('s3')
+# S3 client, created on first use
+s3_client = lazy_client('s3')
 
 # Get environment variables
 S3_USERS = os.getenv('S3_USERS', '')
 
+@log_cold_start
 def lambda_handler(event, context):
     """
     This Lambda function is triggered when a user uploads documents.
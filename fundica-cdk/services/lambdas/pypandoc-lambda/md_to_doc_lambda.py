@@ -1,13 +1,34 @@
 import json
 import boto3
 import os
+from io import BytesIO
 from datetime import date
-import pypandoc
+from boto3.s3.transfer import TransferConfig
+from md_docx import DOCX_CONTENT_TYPE, convert_markdown, pandoc_to_docx
+from pandoc_server import PandocServer
 
 S3_FILLED = os.getenv("S3_FILLED")
+# 'native' writes the docx in process and falls back to pandoc for markdown it does
+# not support; 'pandoc' always converts with pypandoc.
+DOCX_WRITER = os.getenv("DOCX_WRITER", 'native')
+# Send pandoc conversions to a `pandoc server` process started once per container
+# instead of starting pandoc for every document. Conversions fall back to a pandoc
+# subprocess while the server is unavailable.
+PANDOC_SERVER = os.getenv("PANDOC_SERVER", 'false').lower() == 'true'
+PANDOC_SERVER_PORT = int(os.getenv("PANDOC_SERVER_PORT", 3030))
+# The docx is streamed to S3 from memory; documents above one part are uploaded in
+# UPLOAD_PART_BYTES parts, UPLOAD_MAX_CONCURRENCY at a time.
+UPLOAD_PART_BYTES = int(os.getenv("UPLOAD_PART_BYTES", 8 * 1024 * 1024))
+UPLOAD_MAX_CONCURRENCY = int(os.getenv("UPLOAD_MAX_CONCURRENCY", 4))
+
+# One client and transfer config per container, shared by every invocation
+s3_client = boto3.client("s3")
+transfer_config = TransferConfig(multipart_threshold=UPLOAD_PART_BYTES,
+                                 multipart_chunksize=UPLOAD_PART_BYTES,
+                                 max_concurrency=UPLOAD_MAX_CONCURRENCY)
+pandoc_server = PandocServer(fallback=pandoc_to_docx, port=PANDOC_SERVER_PORT) if PANDOC_SERVER else None
 
 def lambda_handler(event, context):
-    s3_client = boto3.client("s3")
     try:
         # Parse the incoming request body
         if isinstance(event.get('body'), str):
@@ -38,17 +59,16 @@ def lambda_handler(event, context):
         print(f"md file not found.")
         return error_response(400, f'Application prompt not found at {S3_FILLED}/{username}/{year}/{filename}: {str(e)}')
 
-    temp_docx = '/tmp/output.docx'
-    pypandoc.convert_text(
-            source=text_file,
-            to='docx',
-            format='md',
-            outputfile=temp_docx
-        )
-        
-        # Upload to S3
-    s3_client = boto3.client('s3')
-    s3_client.upload_file(temp_docx, S3_FILLED, f'{username}/{year}/{username}_{year}_{application_form}_completed.docx')
+    docx_bytes, writer = convert_markdown(text_file,
+                                          writer=DOCX_WRITER,
+                                          pandoc=pandoc_server.to_docx if pandoc_server else None)
+    print(f"Converted {filename} with {writer} writer ({len(docx_bytes)} bytes)")
+
+    # Upload to S3 straight from memory
+    s3_client.upload_fileobj(BytesIO(docx_bytes), S3_FILLED,
+                             f'{username}/{year}/{username}_{year}_{application_form}_completed.docx',
+                             ExtraArgs={'ContentType': DOCX_CONTENT_TYPE},
+                             Config=transfer_config)
 
     return success_response({
             'message': 'Application form completed',